@@ -0,0 +1,157 @@
+"""Per-client rate limits and admission control for upstream calls.
+
+RateLimiter holds one token bucket per (rule, client). A rule is a refill
+rate in requests per second plus a burst size. A bucket that has been idle
+long enough to refill is the same as no bucket at all, so those are
+dropped whenever the table grows past `max_keys`.
+
+AdmissionGate caps how many upstream calls a worker has in flight. Any
+call may take a free slot. Once all slots are busy, callers queue, and each
+freed slot goes to the highest priority that is waiting:
+- CRITICAL: background work.
+- HIGH: bookings, top-ups.
+- NORMAL.
+- LOW: map reads, analytics.
+A caller that has waited `waits[priority]` seconds gives up and raises
+Overloaded, which the app turns into a 503 with Retry-After. Under a surge,
+LOW calls give up first and HIGH ones rarely do. CRITICAL calls and calls
+marked patient never give up. Requests that already got a call through are
+patient, since shedding them halfway would leave a half-applied write.
+
+Both are in-process: limits and caps apply per worker.
+"""
+import math
+import threading
+import time
+
+CRITICAL, HIGH, NORMAL, LOW = 0, 1, 2, 3
+PRIORITY_NAMES = ('critical', 'high', 'normal', 'low')
+
+
+class Overloaded(Exception):
+    def __init__(self, priority, retry_after):
+        super().__init__(f"Upstream busy, {PRIORITY_NAMES[priority]} priority call shed")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    def __init__(self, rules=None, max_keys=100000, clock=time.monotonic):
+        self.rules = dict(rules or {})   # name -> (rate per second, burst)
+        self.max_keys = max_keys
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.buckets = {}                # (rule, client) -> [tokens, updated_at]
+        self.allowed = {}
+        self.limited = {}
+
+    def hit(self, rule, client, cost=1.0):
+        """Take `cost` tokens; returns 0 if allowed, else seconds until it would be."""
+        rate, burst = self.rules[rule]
+        now = self.clock()
+        key = (rule, client)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self._prune(now)
+                bucket = self.buckets[key] = [float(burst), now]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self.allowed[rule] = self.allowed.get(rule, 0) + 1
+                return 0.0
+            self.limited[rule] = self.limited.get(rule, 0) + 1
+            return (cost - bucket[0]) / rate
+
+    def _prune(self, now):
+        full = [k for k, (tokens, at) in self.buckets.items()
+                if tokens + (now - at) * self.rules[k[0]][0] >= self.rules[k[0]][1]]
+        for k in full:
+            del self.buckets[k]
+        if len(self.buckets) >= self.max_keys:
+            # Still full of active clients: forget the least recently seen half
+            stale = sorted(self.buckets, key=lambda k: self.buckets[k][1])[:len(self.buckets) // 2]
+            for k in stale:
+                del self.buckets[k]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'clients': len(self.buckets),
+                'rules': {name: {'rate': rate, 'burst': burst,
+                                 'allowed': self.allowed.get(name, 0), 'limited': self.limited.get(name, 0)}
+                          for name, (rate, burst) in self.rules.items()}
+            }
+
+
+class AdmissionGate:
+    def __init__(self, limit, waits=(None, 2.0, 0.5, 0.05), retry_after=1.0, priority=None):
+        # priority() -> (priority, patient) for the call about to be made
+        self.limit = limit
+        self.waits = waits
+        self.retry_after = retry_after
+        self.priority = priority or (lambda: (NORMAL, False))
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.peak = 0
+        self.waiting = [0] * len(PRIORITY_NAMES)
+        self.admitted = [0] * len(PRIORITY_NAMES)
+        self.shed = [0] * len(PRIORITY_NAMES)
+        self.wait_time = 0.0
+
+    def _blocked(self, priority):
+        return self.in_flight >= self.limit or any(self.waiting[:priority])
+
+    def acquire(self, priority, patient=False):
+        with self.cond:
+            if not self._blocked(priority):
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                self.admitted[priority] += 1
+                return
+            wait = None if patient else self.waits[priority]
+            start = time.monotonic()
+            deadline = None if wait is None else start + wait
+            self.waiting[priority] += 1
+            try:
+                while self._blocked(priority):
+                    left = None if deadline is None else deadline - time.monotonic()
+                    if left is not None and left <= 0:
+                        self.shed[priority] += 1
+                        raise Overloaded(priority, math.ceil(self.retry_after))
+                    self.cond.wait(left)
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                self.admitted[priority] += 1
+                self.wait_time += time.monotonic() - start
+            finally:
+                self.waiting[priority] -= 1
+                # lower priorities may have been held back only by this waiter
+                self.cond.notify_all()
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def __enter__(self):
+        self.acquire(*self.priority())
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'peak': self.peak,
+                'wait_time_ms': round(self.wait_time * 1000, 3),
+                'waiting': dict(zip(PRIORITY_NAMES, self.waiting)),
+                'admitted': dict(zip(PRIORITY_NAMES, self.admitted)),
+                'shed': dict(zip(PRIORITY_NAMES, self.shed))
+            }
@@ -0,0 +1,80 @@
+import threading
+import time
+
+
+class AnalyticsRollup:
+    """Running revenue / booking totals, broken down by day, spot and owner.
+
+    Seeded from one aggregated read (the analytics_summary RPC, or a
+    projected scan when the function isn't installed) and then kept current
+    by add() on every transaction this process writes. Writes made by other
+    workers are picked up by re-seeding every `refresh` seconds.
+    """
+
+    def __init__(self, refresh=300.0):
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.seeded_at = None
+        self._reset()
+
+    def _reset(self):
+        self.revenue = 0.0
+        self.bookings = 0
+        self.by_day = {}
+        self.by_spot = {}
+        self.by_owner = {}
+
+    @staticmethod
+    def _bump(bucket, key, amount, booking):
+        row = bucket.setdefault(str(key), {'revenue': 0.0, 'bookings': 0})
+        row['revenue'] += amount
+        row['bookings'] += booking
+
+    def _add(self, txn, owner_id):
+        amount = float(txn.get('amount') or 0)
+        booking = 1 if txn.get('type') == 'Booking' else 0
+        self.revenue += amount
+        self.bookings += booking
+        if txn.get('date'):
+            self._bump(self.by_day, txn['date'], amount, booking)
+        if txn.get('spot_id') is not None:
+            self._bump(self.by_spot, txn['spot_id'], amount, booking)
+        if owner_id is not None:
+            self._bump(self.by_owner, owner_id, amount, booking)
+
+    def add(self, txn, owner_id=None):
+        with self.lock:
+            if self.seeded_at is not None:
+                self._add(txn, owner_id)
+
+    def stale(self):
+        return self.seeded_at is None or time.monotonic() - self.seeded_at > self.refresh
+
+    def load_summary(self, summary):
+        # summary: the analytics_summary() RPC payload
+        with self.lock:
+            self._reset()
+            self.revenue = float(summary.get('revenue') or 0)
+            self.bookings = int(summary.get('total_bookings') or 0)
+            for name in ('by_day', 'by_spot', 'by_owner'):
+                setattr(self, name, {str(r['key']): {'revenue': float(r['revenue'] or 0), 'bookings': int(r['bookings'] or 0)}
+                                     for r in summary.get(name) or [] if r.get('key') is not None})
+            self.seeded_at = time.monotonic()
+
+    def load_rows(self, txns, owner_of):
+        # Fallback seed from projected transaction rows; owner_of(spot_id) -> owner id
+        with self.lock:
+            self._reset()
+            for t in txns:
+                self._add(t, owner_of(t.get('spot_id')) if t.get('spot_id') is not None else None)
+            self.seeded_at = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'revenue': round(self.revenue, 2),
+                'total_bookings': self.bookings,
+                'by_day': {k: dict(v) for k, v in sorted(self.by_day.items())},
+                'by_spot': {k: dict(v) for k, v in self.by_spot.items()},
+                'by_owner': {k: dict(v) for k, v in self.by_owner.items()}
+            }
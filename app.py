@@ -1,23 +1,194 @@
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
+from flask import Flask, render_template, jsonify, request, session, redirect, url_for, g, has_app_context, has_request_context, stream_with_context
 import json
 import os
 import time
 import math
 from functools import wraps
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 import uuid
+import atexit
+import contextvars
+import hmac
 from dotenv import load_dotenv
 import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cache import ReadThroughCache, ChangeLog
+from shared_state import from_url as shared_state_from_url, SQLiteState, RedisState, SQLiteQueueManager
+from analytics import AnalyticsRollup
+from payments import PaystackVerifier, SUCCESS, PENDING
+from tokens import decode_hs256, TokenError, TokenExpired
+from scheduler import ExpiryScheduler
+from metrics import Metrics
+from admission import RateLimiter, AdmissionGate, Overloaded, CRITICAL, HIGH, NORMAL, LOW
+from storage import LocalStore
+from writebehind import WriteBehindQueue
+from payload import Payload, negotiate, dumps
+import bulk
+from geo import haversine, SpotIndex, ClusterIndex, grid_cell, grid_cells_in_bbox
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
 load_dotenv()
 
 from datetime import timedelta
 
+# --- Pooled HTTP (keep-alive sessions shared by all upstream calls) ---
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.opened = 0       # real TCP/TLS handshakes
+        self.checkouts = 0    # connections handed to a request
+        self.wait_time = 0.0  # seconds spent waiting on a full pool
+        self.max_wait = 0.0
+
+    def record_open(self):
+        with self.lock:
+            self.opened += 1
+
+    def record_checkout(self, waited):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'opened': self.opened,
+                'reused': max(self.checkouts - self.opened, 0),
+                'checkouts': self.checkouts,
+                'wait_time_ms': round(self.wait_time * 1000, 3),
+                'max_wait_ms': round(self.max_wait * 1000, 3)
+            }
+
+def _counting_pool(base, stats):
+    # Pool subclass that reports handshakes and checkout waits to `stats`
+    class Connection(base.ConnectionCls):
+        def connect(self):
+            stats.record_open()
+            return super().connect()
+
+    class Pool(base):
+        ConnectionCls = Connection
+
+        def _get_conn(self, timeout=None):
+            start = time.perf_counter()
+            conn = super()._get_conn(timeout)
+            stats.record_checkout(time.perf_counter() - start)
+            return conn
+
+    return Pool
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, stats, timeout, **kwargs):
+        self.stats = stats
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats)
+        }
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+class HTTPPool:
+    """Keep-alive requests.Session with bounded per-host pools and retries.
+
+    The session is created lazily and re-created after a fork, so gunicorn
+    workers never share sockets inherited from the master process.
+    """
+    IDEMPOTENT = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, block=None,
+                 connect_timeout=None, read_timeout=None, retries=None, backoff=None,
+                 name='upstream', observer=None, gate=None):
+        env = os.environ.get
+        self.name = name
+        self.observer = observer # observer(name, method, url, status, seconds) after every call
+        self.gate = gate         # AdmissionGate held for the duration of every call
+        self.pool_connections = pool_connections or int(env('HTTP_POOL_CONNECTIONS', 4))
+        self.pool_maxsize = pool_maxsize or int(env('HTTP_POOL_MAXSIZE', 20))
+        self.block = block if block is not None else env('HTTP_POOL_BLOCK', '1') == '1'
+        self.timeout = (connect_timeout or float(env('HTTP_CONNECT_TIMEOUT', 3.05)),
+                        read_timeout or float(env('HTTP_READ_TIMEOUT', 10)))
+        self.retries = retries if retries is not None else int(env('HTTP_RETRIES', 2))
+        self.backoff = backoff if backoff is not None else float(env('HTTP_BACKOFF', 0.2))
+        self.stats = PoolStats()
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    def _build(self):
+        retry = Retry(total=self.retries, connect=self.retries, read=self.retries,
+                      status=self.retries, backoff_factor=self.backoff,
+                      status_forcelist=(502, 503, 504),
+                      allowed_methods=self.IDEMPOTENT, raise_on_status=False)
+        adapter = PooledAdapter(self.stats, self.timeout,
+                                pool_connections=self.pool_connections,
+                                pool_maxsize=self.pool_maxsize,
+                                pool_block=self.block, max_retries=retry)
+        s = requests.Session()
+        s.mount('https://', adapter)
+        s.mount('http://', adapter)
+        return s
+
+    @property
+    def session(self):
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._build()
+                    self._pid = pid
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        if self.gate is None:
+            return self._request(method, url, **kwargs)
+        with self.gate:
+            return self._request(method, url, **kwargs)
+
+    def _request(self, method, url, **kwargs):
+        if self.observer is None:
+            return self.session.request(method, url, **kwargs)
+        start = time.perf_counter()
+        status = None
+        try:
+            r = self.session.request(method, url, **kwargs)
+            status = r.status_code
+            return r
+        finally:
+            self.observer(self.name, method, url, status, time.perf_counter() - start)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats_snapshot(self):
+        snap = self.stats.snapshot()
+        snap.update({'pool_maxsize': self.pool_maxsize, 'pool_connections': self.pool_connections,
+                     'block': self.block, 'timeout': list(self.timeout), 'retries': self.retries})
+        return snap
+
 # --- Config & Supabase Lite (No SDK Required) ---
 class SupabaseLite:
-    def __init__(self, url, key):
+    def __init__(self, url, key, http=None):
         self.url = url.rstrip('/')
         self.key = key
+        self.http = http or HTTPPool()
         self.headers = {
             "apikey": key,
             "Authorization": f"Bearer {key}",
@@ -29,49 +200,80 @@ class SupabaseLite:
     def table(self, name):
         return TableLite(self, name)
 
+    def rpc(self, fn, params=None):
+        # Postgres function exposed by PostgREST at /rest/v1/rpc/<fn>
+        q = TableLite(self, f"rpc/{fn}")
+        q.method = 'POST'
+        q.json_data = params or {}
+        return q
+
 class AuthLite:
     def __init__(self, client):
         self.client = client
     
     def sign_up(self, credentials):
         try:
-            r = requests.post(f"{self.client.url}/auth/v1/signup", 
+            r = self.client.http.post(f"{self.client.url}/auth/v1/signup", 
                             json=credentials, headers=self.client.headers)
             # Supabase returns 200 on success, or error
             if r.status_code == 200:
                 data = r.json()
                 return AuthResponse(data.get('user'), error=None)
             return AuthResponse(None, error=r.json().get('msg', 'Signup failed'))
+        except Overloaded:
+            raise
         except Exception as e:
             return AuthResponse(None, error=str(e))
 
     def sign_in_with_password(self, credentials):
         try:
-            r = requests.post(f"{self.client.url}/auth/v1/token?grant_type=password", 
+            r = self.client.http.post(f"{self.client.url}/auth/v1/token?grant_type=password", 
                             json=credentials, headers=self.client.headers)
             if r.status_code == 200:
                 data = r.json()
-                return AuthResponse(data.get('user'), error=None)
+                return AuthResponse(data.get('user'), error=None, session=data)
             return AuthResponse(None, error=r.json().get('error_description', 'Login failed'))
+        except Overloaded:
+            raise
+        except Exception as e:
+            return AuthResponse(None, error=str(e))
+
+    def refresh_session(self, refresh_token):
+        try:
+            r = self.client.http.post(f"{self.client.url}/auth/v1/token?grant_type=refresh_token",
+                            json={'refresh_token': refresh_token}, headers=self.client.headers)
+            if r.status_code == 200:
+                data = r.json()
+                return AuthResponse(data.get('user'), error=None, session=data)
+            return AuthResponse(None, error=r.json().get('error_description', 'Refresh failed'))
+        except Overloaded:
+            raise
         except Exception as e:
             return AuthResponse(None, error=str(e))
 
 class AuthResponse:
-    def __init__(self, user, error=None):
+    def __init__(self, user, error=None, session=None):
         self.user = user
         self.error = error
+        self.session = session # access_token, refresh_token, expires_in ... as Supabase returned them
 
 class TableLite:
     def __init__(self, client, name):
         self.client = client
         self.endpoint = f"{client.url}/rest/v1/{name}"
         self.params = {}
+        self.headers = {}
+        self.prefer = []
         self.json_data = None
         self.method = 'GET'
+        self.is_single = False
 
-    def select(self, columns="*"):
+    def select(self, columns="*", count=None):
+        # count: 'exact' | 'planned' | 'estimated' -> total reported in APIResponse.count
         self.method = 'GET'
         self.params['select'] = columns
+        if count:
+            self.prefer.append(f"count={count}")
         return self
 
     def insert(self, data):
@@ -79,6 +281,15 @@ class TableLite:
         self.json_data = data
         return self
 
+    def upsert(self, data, on_conflict=None, ignore_duplicates=False):
+        # Insert-or-update on the primary key (or `on_conflict` columns); data may be a list
+        self.method = 'POST'
+        self.json_data = data
+        self.prefer.append('resolution=ignore-duplicates' if ignore_duplicates else 'resolution=merge-duplicates')
+        if on_conflict:
+            self.params['on_conflict'] = on_conflict
+        return self
+
     def update(self, data):
         self.method = 'PATCH'
         self.json_data = data
@@ -88,39 +299,101 @@ class TableLite:
         self.method = 'DELETE'
         return self
 
-    def eq(self, column, value):
-        self.params[f"{column}"] = f"eq.{value}"
+    def _filter(self, column, op, value):
+        # Repeated filters on one column (e.g. a range) become repeated query params
+        cond = f"{op}.{value}"
+        existing = self.params.get(column)
+        if existing is None: self.params[column] = cond
+        elif isinstance(existing, list): existing.append(cond)
+        else: self.params[column] = [existing, cond]
         return self
+
+    def eq(self, column, value):
+        return self._filter(column, 'eq', value)
+
+    def neq(self, column, value):
+        return self._filter(column, 'neq', value)
+
+    def gt(self, column, value):
+        return self._filter(column, 'gt', value)
+
+    def gte(self, column, value):
+        return self._filter(column, 'gte', value)
+
+    def lt(self, column, value):
+        return self._filter(column, 'lt', value)
+
+    def lte(self, column, value):
+        return self._filter(column, 'lte', value)
+
+    def in_(self, column, values):
+        def fmt(v):
+            if isinstance(v, str):
+                return '"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            return str(v)
+        return self._filter(column, 'in', f"({','.join(fmt(v) for v in values)})")
     
     def order(self, column, desc=False):
         direction = 'desc' if desc else 'asc'
         self.params['order'] = f"{column}.{direction}"
         return self
 
+    def limit(self, count):
+        self.params['limit'] = int(count)
+        return self
+
+    def offset(self, count):
+        self.params['offset'] = int(count)
+        return self
+
+    def range(self, start, end):
+        # Inclusive row window via PostgREST's Range header
+        self.headers['Range-Unit'] = 'items'
+        self.headers['Range'] = f"{int(start)}-{int(end)}"
+        return self
+
+    def after(self, column, value, desc=False):
+        # Keyset pagination: rows strictly past `value` in the current sort order
+        return self._filter(column, 'lt' if desc else 'gt', value)
+
+    def single(self):
+        # Exactly one row, returned as an object; anything else is an error (data None)
+        self.is_single = True
+        self.headers['Accept'] = 'application/vnd.pgrst.object+json'
+        return self
+
     def execute(self):
         try:
-            if self.method == 'GET':
-                r = requests.get(self.endpoint, headers=self.client.headers, params=self.params)
-            elif self.method == 'POST':
-                r = requests.post(self.endpoint, headers=self.client.headers, params=self.params, json=self.json_data)
-            elif self.method == 'PATCH':
-                r = requests.patch(self.endpoint, headers=self.client.headers, params=self.params, json=self.json_data)
-            elif self.method == 'DELETE':
-                r = requests.delete(self.endpoint, headers=self.client.headers, params=self.params)
-            
+            headers = {**self.client.headers, **self.headers} if self.headers else self.client.headers
+            if self.prefer:
+                headers = {**headers, 'Prefer': ','.join([headers.get('Prefer', '')] + self.prefer).strip(',')}
+            r = self.client.http.request(self.method, self.endpoint, headers=headers,
+                                         params=self.params, json=self.json_data)
+
             if r.status_code >= 400:
                 print(f"Supabase Error {r.status_code}: {r.text}")
-                return APIResponse(None)
-                
-            data = r.json() if r.text and 'application/json' in r.headers.get('Content-Type', '') else []
-            return APIResponse(data)
+                return APIResponse(None, status=r.status_code)
+
+            ctype = r.headers.get('Content-Type', '')
+            data = r.json() if r.text and ('application/json' in ctype or 'pgrst.object' in ctype) else ([] if not self.is_single else None)
+            return APIResponse(data, count=_parse_count(r.headers.get('Content-Range')), status=r.status_code)
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Request Error: {e}")
             return APIResponse(None)
 
 class APIResponse:
-    def __init__(self, data):
+    def __init__(self, data, count=None, status=None):
         self.data = data
+        self.count = count
+        self.status = status # None when the request never got a response
+
+def _parse_count(content_range):
+    # "0-24/3573" -> 3573 ("*" when the total wasn't requested)
+    if not content_range or '/' not in content_range: return None
+    total = content_range.rsplit('/', 1)[1]
+    return int(total) if total.isdigit() else None
 
 # --- App Init ---
 app = Flask(__name__)
@@ -132,6 +405,137 @@ app.config['SESSION_COOKIE_HTTPONLY'] = True # Prevent JS access to session cook
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax' # CSRF protection
 # app.config['SESSION_COOKIE_SECURE'] = True # Un-comment in Production (HTTPS only)
 
+# --- Metrics ---
+# Per-route latency, upstream calls (by service/table/verb) and Socket.IO
+# fan-out, scraped from /metrics. Each response also carries a
+# Server-Timing header splitting its time between Python and upstream calls.
+METRICS_ENABLED = os.environ.get('METRICS', 'on') != 'off'
+metrics = Metrics()
+
+def _upstream_target(url):
+    # ".../rest/v1/spots?id=eq.1" -> "spots", ".../rest/v1/rpc/fn" -> "rpc/fn",
+    # ".../auth/v1/token?..." -> "auth/token", ".../transaction/verify/<ref>" -> "transaction/verify"
+    path = url.split('?', 1)[0]
+    for marker, prefix in (('/rest/v1/', ''), ('/auth/v1/', 'auth/')):
+        if marker in path:
+            return prefix + path.split(marker, 1)[1]
+    parts = [p for p in path.split('/')[3:] if p]
+    return '/'.join(parts[:2]) or '/'
+
+def _note_upstream(service, seconds):
+    if has_request_context():
+        acc = g.setdefault('upstream', {}).setdefault(service, [0, 0.0])
+        acc[0] += 1
+        acc[1] += seconds
+
+def record_upstream(service, method, url, status, seconds):
+    if not METRICS_ENABLED: return
+    metrics.observe_upstream(service, _upstream_target(url), method, status or 'error', seconds)
+    _note_upstream(service, seconds)
+
+def emit_event(event, data, to=None):
+    # socketio.emit plus fan-out accounting (recipients counted on this worker only)
+    if METRICS_ENABLED:
+        targets = [to] if to is None or isinstance(to, str) else list(to)
+        members = socketio.server.manager.rooms.get('/', {}) if socketio.server else {}
+        metrics.observe_emit(event, len(targets), sum(len(members.get(room) or ()) for room in targets))
+    socketio.emit(event, data, to=to)
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.pop('request_start', None)
+        if start is None: return response
+        elapsed = time.perf_counter() - start
+        upstream = g.get('upstream') or {}
+        metrics.observe_request(request.endpoint or 'unmatched', request.method, response.status_code, elapsed, upstream)
+        # Upstream calls made side by side (fetch_all) can add up to more than the wall time
+        timing = [f"app;dur={max(elapsed - sum(v[1] for v in upstream.values()), 0) * 1000:.1f}"]
+        timing += [f'{service};desc="{calls} calls";dur={spent * 1000:.1f}' for service, (calls, spent) in upstream.items()]
+        response.headers['Server-Timing'] = ', '.join(timing)
+        return response
+
+# --- Admission control ---
+# Token buckets per client (logged-in user, else IP) for each group of
+# routes answer 429 once a client goes over its rate. Upstream calls go
+# through upstream_gate, which caps them per worker. Under a surge, map and
+# analytics reads are shed first (503) and bookings and top-ups get the freed slots.
+def _rate_rule(name, default):
+    # RATE_LIMIT_<NAME>="<requests per second>:<burst>"
+    rate, _, burst = os.environ.get(f"RATE_LIMIT_{name.upper()}", default).partition(':')
+    return float(rate), float(burst or rate)
+
+RATE_RULES = {
+    'booking': _rate_rule('booking', '1:10'),
+    'auth': _rate_rule('auth', '0.2:5'),
+    'read': _rate_rule('read', '20:60'),
+    'analytics': _rate_rule('analytics', '1:5'),
+    'default': _rate_rule('default', '10:30')
+}
+# endpoint -> (rate rule or None for no limit, upstream priority)
+ROUTE_POLICY = {
+    'reserve_spot': ('booking', HIGH),
+    'topup_wallet': ('booking', HIGH),
+    'paystack_webhook': (None, HIGH),
+    'login': ('auth', NORMAL),
+    'signup': ('auth', NORMAL),
+    'get_spots': ('read', LOW),
+    'get_spot': ('read', LOW),
+    'nearby_spots': ('read', LOW),
+    'spot_clusters': ('read', LOW),
+    'analytics': ('analytics', LOW),
+    'export_spots': ('analytics', LOW),
+    'export_transactions': ('analytics', LOW),
+    'static': (None, NORMAL),
+    'metrics_endpoint': (None, NORMAL)
+}
+rate_limiter = RateLimiter(RATE_RULES) if os.environ.get('RATE_LIMITS', 'on') != 'off' else None
+
+def upstream_priority():
+    # -> (priority, patient). Requests that already got a call through wait
+    # for a slot rather than being shed: stopping them halfway could leave
+    # a booking half written.
+    if not has_request_context(): return CRITICAL, True
+    patient = g.get('upstream_admitted', False)
+    g.upstream_admitted = True
+    return g.get('priority', NORMAL), patient
+
+UPSTREAM_MAX_INFLIGHT = int(os.environ.get('UPSTREAM_MAX_INFLIGHT', os.environ.get('HTTP_POOL_MAXSIZE', 20)))
+upstream_gate = AdmissionGate(UPSTREAM_MAX_INFLIGHT,
+                              waits=(None, float(os.environ.get('ADMISSION_WAIT_HIGH', 2)),
+                                     float(os.environ.get('ADMISSION_WAIT_NORMAL', 0.5)),
+                                     float(os.environ.get('ADMISSION_WAIT_LOW', 0.05))),
+                              retry_after=float(os.environ.get('ADMISSION_RETRY_AFTER', 1)),
+                              priority=upstream_priority) if UPSTREAM_MAX_INFLIGHT > 0 else None
+
+# Behind N proxies (Vercel, a load balancer) trust N X-Forwarded-For hops for the client IP
+if int(os.environ.get('PROXY_FIX_X_FOR', 0)):
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ['PROXY_FIX_X_FOR']))
+
+def _rate_client():
+    uid = session.get('user_id')
+    if uid: return f"user:{uid}"
+    if 'admin' in session: return 'admin'
+    return f"ip:{request.remote_addr}"
+
+@app.before_request
+def admit_request():
+    rule, g.priority = ROUTE_POLICY.get(request.endpoint, ('default', NORMAL))
+    if rule is None or rate_limiter is None: return
+    if rule == 'auth' and request.method == 'GET': return # only attempts count, not page views
+    wait = rate_limiter.hit(rule, _rate_client())
+    if wait:
+        return jsonify({'message': 'Too many requests, please slow down'}), 429, {'Retry-After': str(math.ceil(wait))}
+
+@app.errorhandler(Overloaded)
+def upstream_overloaded(e):
+    return jsonify({'message': 'Server busy, please retry shortly'}), 503, {'Retry-After': str(e.retry_after)}
+
 # Security Headers & Inactivity Check
 @app.after_request
 def add_security_headers(response):
@@ -145,7 +549,7 @@ def check_inactivity_and_security():
     session.permanent = True # Ensure lifetime is respected
     
     # Exempt routes from timeout check
-    if request.endpoint in ('static', 'login', 'signup', 'home', 'topup_wallet', 'reserve_spot'):
+    if request.endpoint in ('static', 'login', 'signup', 'home', 'topup_wallet', 'reserve_spot', 'metrics_endpoint'):
         return
 
     # Check Inactivity
@@ -161,40 +565,328 @@ def check_inactivity_and_security():
         # Update activity timestamp
         session['last_active'] = now
 
+# With the project's JWT secret (Supabase > Settings > API), the access
+# token saved at sign-in is checked here on each request, signature and
+# expiry, without calling the auth server. Only an expired token costs a
+# call, to swap the refresh token for a new one. Unset: no local checks,
+# and no tokens kept in the session cookie.
+SUPABASE_JWT_SECRET = os.environ.get('SUPABASE_JWT_SECRET')
+_token_checks = {'verified': 0, 'refreshed': 0, 'rejected': 0}
+_token_checks_lock = threading.Lock()
+
+def _count_token_check(result):
+    with _token_checks_lock:
+        _token_checks[result] += 1
+
+def verify_auth_session(auth, uid=None):
+    # Claims of the access token in a sign-in/refresh reply, or None if it doesn't check out
+    try:
+        claims = decode_hs256((auth or {}).get('access_token'), SUPABASE_JWT_SECRET)
+    except TokenError:
+        return None
+    return claims if uid is None or claims['sub'] == uid else None
+
+def _keep_auth_session(auth):
+    session['access_token'] = auth['access_token']
+    session['refresh_token'] = auth.get('refresh_token')
+
+@app.before_request
+def check_access_token():
+    if not SUPABASE_JWT_SECRET or request.endpoint in ('static', 'login', 'signup', 'home', 'metrics_endpoint'):
+        return
+    token = session.get('access_token')
+    if not token: return # admin, or signed in before tokens were kept
+    uid = session.get('user_id')
+    try:
+        if decode_hs256(token, SUPABASE_JWT_SECRET)['sub'] == uid:
+            _count_token_check('verified')
+            return
+    except TokenExpired:
+        refresh = session.get('refresh_token')
+        res = supabase.auth.refresh_session(refresh) if refresh and supabase else None
+        if res and res.user and verify_auth_session(res.session, uid):
+            _keep_auth_session(res.session)
+            _count_token_check('refreshed')
+            return
+    except TokenError:
+        pass
+    _count_token_check('rejected')
+    session.clear()
+    return redirect(url_for('login', error="Session expired, please log in again."))
+
 # Init Client
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 
-if not url or not key:
-    print("WARNING: Supabase credentials not found. DB calls will fail.")
-    supabase = None
+# STORAGE picks where the helpers below read and write (see storage.py):
+#   supabase     straight to Supabase (default)
+#   local        SQLite file only, seeded from the legacy JSON dumps
+#   local-first  SQLite for reads, writes queued and synced to Supabase in the background
+# The SQLite file is created on first use, not at import.
+STORAGE = os.environ.get('STORAGE', 'supabase')
+LOCAL_DB_PATH = os.environ.get('LOCAL_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parkwell.db'))
+remote = SupabaseLite(url, key, http=HTTPPool(name='supabase', observer=record_upstream, gate=upstream_gate)) if url and key else None
+
+if STORAGE == 'supabase':
+    if not remote: print("WARNING: Supabase credentials not found. DB calls will fail.")
+    supabase = remote
+elif STORAGE == 'local':
+    supabase = LocalStore(LOCAL_DB_PATH, legacy_root=os.path.dirname(os.path.abspath(__file__)))
+elif STORAGE == 'local-first':
+    if not remote: raise ValueError("STORAGE=local-first needs SUPABASE_URL and SUPABASE_KEY")
+    supabase = LocalStore(LOCAL_DB_PATH, remote=remote)
 else:
-    supabase = SupabaseLite(url, key)
-
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-UNDO_STACK = []
-REDO_STACK = []
+    raise ValueError(f"Unsupported STORAGE: {STORAGE}")
+
+# Undo history and cache invalidations shared between workers (see shared_state.py).
+# Caches look for other workers' writes at most every SHARED_STATE_POLL seconds.
+SHARED_STATE_URL = os.environ.get('SHARED_STATE_URL')
+shared_state = shared_state_from_url(SHARED_STATE_URL)
+SHARED_STATE_POLL = float(os.environ.get('SHARED_STATE_POLL', 0.5))
+
+# Emits from one worker must reach clients connected to the others: use the
+# configured message queue, else whatever already backs the shared state.
+# ASYNC_MODE=gevent serves requests and Socket.IO on greenlets; wsgi.py
+# monkey-patches the standard library first, so upstream calls through
+# requests yield instead of blocking a thread.
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+message_queue = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or (SHARED_STATE_URL if isinstance(shared_state, RedisState) else None)
+if message_queue:
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, message_queue=message_queue)
+elif isinstance(shared_state, SQLiteState):
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE,
+                        client_manager=SQLiteQueueManager(shared_state.path))
+else:
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
+
+# Independent upstream reads in one handler run side by side, on threads
+# (greenlets once gevent has patched threading). FANOUT_WORKERS=0 runs them in turn.
+FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 32))
+_fanout = ThreadPoolExecutor(FANOUT_WORKERS, thread_name_prefix='fanout') if FANOUT_WORKERS > 0 else None
+
+def fetch_all(*calls):
+    """Run zero-argument callables concurrently; returns their results in order.
+
+    A None in place of a callable gives None. Each call runs in a copy of
+    the caller's context, so request, session and g are the caller's. The
+    first runs on the calling thread, so a full pool delays the others but
+    never deadlocks the request.
+    """
+    work = [i for i, call in enumerate(calls) if call is not None]
+    results = [None] * len(calls)
+    if len(work) < 2 or _fanout is None:
+        for i in work: results[i] = calls[i]()
+        return results
+    futures = [(i, _fanout.submit(contextvars.copy_context().run, calls[i])) for i in work[1:]]
+    results[work[0]] = calls[work[0]]()
+    for i, f in futures: results[i] = f.result()
+    return results
+
+UNDO_KEY = 'undo'
+REDO_KEY = 'redo'
 MAX_HISTORY = 20
 
+# Spots are read on every map load and after every data_update broadcast;
+# serve them from memory and drop the entry whenever a write goes through.
+spots_cache = ReadThroughCache('spots', ttl=float(os.environ.get('SPOTS_CACHE_TTL', 30)),
+                               shared=shared_state if SHARED_STATE_URL else None,
+                               poll=SHARED_STATE_POLL)
+# A user's own row (name, wallet, points) is read at login and by every
+# profile, booking and top-up; keep it briefly. Our writes replace or drop
+# the entry (_user_written), so only other writers can leave it stale, and
+# only until the TTL runs out. 0 turns it off.
+user_cache = ReadThroughCache('users', ttl=float(os.environ.get('USER_CACHE_TTL', 10)),
+                              shared=shared_state if SHARED_STATE_URL else None,
+                              poll=SHARED_STATE_POLL)
+# Revenue / booking totals kept up to date by create_transaction
+analytics_rollup = AnalyticsRollup(refresh=float(os.environ.get('ANALYTICS_REFRESH', 300)))
+_analytics_seed_lock = threading.Lock()
+# Grid index over the cached rows for /api/spots/nearby
+spot_index = SpotIndex(cell_deg=float(os.environ.get('SPOT_INDEX_CELL_DEG', 0.01)))
+# Per-zoom cluster aggregates for /api/spots/clusters, patched alongside spot_index
+cluster_index = ClusterIndex(max_zoom=int(os.environ.get('CLUSTER_MAX_ZOOM', 16)))
+# Revisioned spot deltas: broadcast with data_update, replayed by /api/spots?since=
+spot_log = ChangeLog(maxlen=int(os.environ.get('SPOT_LOG_SIZE', 1000)),
+                     shared=shared_state if SHARED_STATE_URL else None, name='spots:rev')
+_known_spots = {}   # last row seen per spot id, to compute changed fields
+_known_lock = threading.Lock()
+
+# --- Socket.IO rooms ---
+# Map clients join one room per grid cell in their viewport (plus one per spot
+# they hold a session on); spot events only go to the cells they touch.
+# 'admin' sees everything, as does 'spots:all' for zoomed-out viewports.
+ROOM_CELL_DEG = float(os.environ.get('ROOM_CELL_DEG', 0.05))
+MAX_VIEWPORT_CELLS = int(os.environ.get('MAX_VIEWPORT_CELLS', 64))
+MAX_SPOT_ROOMS = 50
+ADMIN_ROOM = 'admin'
+ALL_SPOTS_ROOM = 'spots:all'
+
+def cell_room(lat, lng):
+    try:
+        r, c = grid_cell(lat, lng, ROOM_CELL_DEG)
+    except (TypeError, ValueError):
+        return None
+    return f"cell:{r}:{c}"
+
+def spot_rooms(spot_id, *rows):
+    # Rooms interested in a spot: its own room and the cell(s) it was/is in
+    out = {f"spot:{spot_id}"}
+    for row in rows:
+        if row and row.get('lat') is not None:
+            room = cell_room(row['lat'], row.get('lng'))
+            if room: out.add(room)
+    return out
+
 # --- Database Help ---
+def _load_user(uid):
+    res = supabase.table('users').select("*").eq('id', uid).execute()
+    return res.data[0] if res.data else None # no row or a failed read: not cached
+
 def get_user_by_id(uid):
     if not supabase: return None
-    res = supabase.table('users').select("*").eq('id', uid).execute()
-    return res.data[0] if res.data else None
+    user = user_cache.get(uid, lambda: _load_user(uid))
+    return dict(user) if user else None # callers add keys to their copy
+
+def _user_written(uid, row=None):
+    # Write-through: the row a write returned replaces the cached one; a
+    # write whose result we didn't get drops it
+    if row: user_cache.patch(uid, lambda _: dict(row))
+    else: user_cache.invalidate(uid)
 
 def create_public_user(user_data):
     if not supabase: return
     supabase.table('users').insert(user_data).execute()
+    _user_written(user_data['id'])
 
 # (Reusing previous CRUD helpers)
+def _load_spots():
+    # None (upstream error) is returned to callers but never cached.
+    # Runs at the priority of whichever request started it, so a map read
+    # can be shed; requests waiting on it then load at their own priority.
+    res = supabase.table('spots').select("*").order('id').execute()
+    if res.data is None: return None
+    spot_index.rebuild(res.data)
+    cluster_index.rebuild(res.data)
+    by_id = {s['id']: s for s in res.data}
+    # Log what changed upstream since our last look (e.g. other workers' writes)
+    with _known_lock:
+        first_load = not _known_spots
+    removed = [] if first_load else [sid for sid in list(_known_spots) if sid not in by_id]
+    _record_spot_changes(res.data, removed, log=not first_load)
+    return {'list': res.data, 'by_id': by_id}
+
+def _record_spot_changes(upserts=(), removed=(), log=True):
+    changes, targets = [], []
+    with _known_lock:
+        for row in upserts:
+            old = _known_spots.get(row['id'])
+            _known_spots[row['id']] = row
+            fields = dict(row) if old is None else {k: v for k, v in row.items() if old.get(k) != v}
+            if fields:
+                changes.append({'op': 'upsert', 'id': row['id'], 'fields': fields})
+                targets.append(spot_rooms(row['id'], old, row))
+        for sid in removed:
+            old = _known_spots.pop(sid, None)
+            changes.append({'op': 'remove', 'id': sid})
+            targets.append(spot_rooms(sid, old))
+    if changes and log:
+        spot_log.append(changes)
+        # Collected per request (or background job) and sent with its data_update event
+        if has_app_context():
+            g.setdefault('spot_changes', []).extend(changes)
+            g.setdefault('spot_targets', []).extend(targets)
+    return changes
+
+def _patch_spots(upserts=(), removed=()):
+    # Apply a successful write to the cached snapshot (copy-on-write, so
+    # requests already holding the old list are unaffected) and the index.
+    def apply(cached):
+        by_id = dict(cached['by_id'])
+        for row in upserts: by_id[row['id']] = row
+        for sid in removed: by_id.pop(sid, None)
+        return {'list': list(by_id.values()), 'by_id': by_id}
+    spots_cache.patch('all', apply)
+    for row in upserts:
+        spot_index.upsert(row)
+        cluster_index.upsert(row)
+    for sid in removed:
+        spot_index.remove(sid)
+        cluster_index.remove(sid)
+    _record_spot_changes(upserts, removed)
+
+def _spots_write_failed():
+    # We can't describe the change, so drop the cache and tell clients to refetch
+    spots_cache.invalidate()
+    if has_app_context():
+        g.spots_resync = True
+
+def emit_data_update(event_type):
+    changes = g.pop('spot_changes', [])
+    targets = g.pop('spot_targets', [])
+    rev = spot_log.rev
+    if g.pop('spots_resync', False) or not changes:
+        # Nothing we can target: everyone refetches
+        emit_event('data_update', {'type': event_type, 'rev': rev, 'changes': [], 'resync': True})
+        return
+
+    # Each room gets only the changes that touch it; rooms with the same
+    # subset share one emit. Admins and zoomed-out clients get them all.
+    by_room = {}
+    for i, room_set in enumerate(targets):
+        for room in room_set:
+            by_room.setdefault(room, []).append(i)
+    by_subset = {}
+    for room, idx in by_room.items():
+        by_subset.setdefault(tuple(idx), []).append(room)
+    by_subset.setdefault(tuple(range(len(changes))), []).extend([ADMIN_ROOM, ALL_SPOTS_ROOM])
+
+    for idx, room_list in by_subset.items():
+        emit_event('data_update', {
+            'type': event_type, 'rev': rev,
+            'changes': [changes[i] for i in idx], 'resync': False
+        }, to=room_list)
+
+@socketio.on('connect')
+def on_connect():
+    if 'admin' in session:
+        join_room(ADMIN_ROOM)
+
+@socketio.on('subscribe_viewport')
+def on_subscribe_viewport(data):
+    # data: {south, west, north, east} for the visible map (optional) and
+    # spot_ids for spots the client follows regardless of viewport (optional)
+    data = data or {}
+    wanted = set()
+    try:
+        cells = grid_cells_in_bbox(float(data['south']), float(data['west']),
+                                   float(data['north']), float(data['east']),
+                                   ROOM_CELL_DEG, MAX_VIEWPORT_CELLS)
+        if cells is None: wanted.add(ALL_SPOTS_ROOM) # Zoomed out too far to list cells
+        else: wanted.update(f"cell:{r}:{c}" for r, c in cells)
+    except (KeyError, TypeError, ValueError, OverflowError):
+        pass # No (usable) viewport: no cell rooms; grid_cell rejects nan/inf
+    for spot_id in (data.get('spot_ids') or [])[:MAX_SPOT_ROOMS]:
+        wanted.add(f"spot:{spot_id}")
+
+    current = {r for r in rooms() if r.startswith(('cell:', 'spot:')) or r == ALL_SPOTS_ROOM}
+    for room in current - wanted:
+        leave_room(room)
+    for room in wanted - current:
+        join_room(room)
+    return {'rooms': len(wanted)}
+
 def get_all_spots():
+    # Cached rows are shared between requests: treat them as read-only
     if not supabase: return []
-    res = supabase.table('spots').select("*").order('id').execute()
-    return res.data or []
+    cached = spots_cache.get('all', _load_spots)
+    return cached['list'] if cached else []
 
 def get_spot_by_id(spot_id):
     if not supabase: return None
+    cached = spots_cache.get('all', _load_spots)
+    if cached and spot_id in cached['by_id']:
+        return cached['by_id'][spot_id]
+    # Not in the snapshot (e.g. created by another worker within the TTL)
     res = supabase.table('spots').select("*").eq('id', spot_id).execute()
     return res.data[0] if res.data else None
 
@@ -202,15 +894,37 @@ def create_spot(spot_data):
     if not supabase: return None
     if 'id' in spot_data: del spot_data['id']
     res = supabase.table('spots').insert(spot_data).execute()
+    if res.data: _patch_spots(upserts=res.data)
+    else: _spots_write_failed()
     return res.data[0] if res.data else None
 
 def update_spot(spot_id, updates):
     if not supabase: return None
-    return supabase.table('spots').update(updates).eq('id', spot_id).execute()
+    res = supabase.table('spots').update(updates).eq('id', spot_id).execute()
+    if res.data is not None: _patch_spots(upserts=res.data)
+    else: _spots_write_failed()
+    return res
 
 def delete_spot_db(spot_id):
     if not supabase: return
-    supabase.table('spots').delete().eq('id', spot_id).execute()
+    res = supabase.table('spots').delete().eq('id', spot_id).execute()
+    if res.data is not None: _patch_spots(removed=[int(spot_id)])
+    else: _spots_write_failed()
+
+# --- Write-behind ---
+# WRITE_BEHIND=on: booking transactions and sessions are spooled to a local
+# file and inserted upstream in bulk by a background thread instead of one
+# POST each on the request path (see writebehind.py). Rows carry their ids
+# from the start, so a resent batch is ignored rather than inserted twice.
+def _insert_rows(table, rows):
+    return supabase.table(table).upsert(rows, on_conflict='id', ignore_duplicates=True).execute().status
+
+write_behind = None
+if supabase and os.environ.get('WRITE_BEHIND', 'off') == 'on':
+    write_behind = WriteBehindQueue(
+        os.environ.get('WRITE_BEHIND_SPOOL', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'writebehind.db')),
+        _insert_rows, batch=int(os.environ.get('WRITE_BEHIND_BATCH', 100)),
+        delay=float(os.environ.get('WRITE_BEHIND_DELAY', 0.05)))
 
 def get_sessions():
     if not supabase: return []
@@ -219,7 +933,9 @@ def get_sessions():
 
 def create_session(session_data):
     if not supabase: return
-    supabase.table('sessions').insert(session_data).execute()
+    if write_behind: return write_behind.add('sessions', session_data)
+    res = supabase.table('sessions').insert(session_data).execute()
+    return res.data[0] if res.data else None
 
 def delete_session(spot_id):
     if not supabase: return
@@ -233,8 +949,228 @@ def get_transactions():
 def create_transaction(txn_data):
     if not supabase: return
     if 'id' in txn_data: del txn_data['id']
-    supabase.table('transactions').insert(txn_data).execute()
+    if write_behind:
+        row = write_behind.add('transactions', txn_data)
+        analytics_rollup.add(row, _spot_owner(row.get('spot_id')))
+        return row
+    res = supabase.table('transactions').insert(txn_data).execute()
+    for row in res.data or []:
+        analytics_rollup.add(row, _spot_owner(row.get('spot_id')))
+    return res.data[0] if res.data else None
+
+HISTORY_COLUMNS = "id,type,amount,date,spot_name,created_at"
+
+def get_user_transactions(uid, cursor=None, limit=20, columns=HISTORY_COLUMNS):
+    # Newest first, keyset-paginated on id; returns (rows, next_cursor)
+    if not supabase: return [], None
+    q = supabase.table('transactions').select(columns).eq('user_id', uid).order('id', desc=True).limit(limit + 1)
+    if cursor is not None: q.after('id', cursor, desc=True)
+    rows = q.execute().data or []
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (rows[-1]['id'] if more else None)
+
+def count_user_bookings(uid):
+    if not supabase: return 0
+    res = supabase.table('transactions').select("id", count='exact').eq('user_id', uid).eq('type', 'Booking').limit(1).execute()
+    return res.count or 0
+
+def get_transaction_by_id(txn_id):
+    if not supabase: return None
+    return supabase.table('transactions').select("*").eq('id', txn_id).single().execute().data
+
+def get_recent_transactions(limit=10):
+    if not supabase: return []
+    res = supabase.table('transactions').select("*").order('created_at', desc=True).limit(limit).execute()
+    return res.data or []
+
+def _spot_owner(spot_id):
+    # Owner from the cached spots snapshot only; never worth an upstream read
+    cached = spots_cache.peek('all')
+    spot = cached['by_id'].get(spot_id) if cached and spot_id is not None else None
+    return spot.get('owner_id') if spot else None
+
+def get_analytics_summary():
+    if supabase and analytics_rollup.stale():
+        with _analytics_seed_lock:
+            if analytics_rollup.stale():
+                res = supabase.rpc('analytics_summary').execute()
+                if isinstance(res.data, dict):
+                    analytics_rollup.load_summary(res.data)
+                else:
+                    # Function not installed (see migration_analytics.sql): scan just the columns we need
+                    rows = supabase.table('transactions').select("type,amount,date,spot_id").execute().data
+                    if rows is not None:
+                        get_all_spots() # Warm the snapshot _spot_owner reads from
+                        analytics_rollup.load_rows(rows, _spot_owner)
+    return analytics_rollup.snapshot()
     
+# --- Reservations ---
+# One booking = take a bay, debit the wallet (if paying from it), record the
+# transaction and open a session. reserve_spot() in migration_reserve.sql
+# does all of it in one database transaction. Without the function we fall
+# back to conditional updates that only land if the row still holds the value
+# we read, with bookings for the same spot queued behind a lock in-process.
+_reserve_rpc = True # Cleared once PostgREST tells us the function is missing
+_reserve_locks = [threading.Lock() for _ in range(64)]
+CAS_ATTEMPTS = 5
+
+def _cas_update(table, row_id, column, change, row=None):
+    # change(row) -> updates dict, or an error message to refuse.
+    # Returns (row, error); row is the updated row on success. A passed-in
+    # `row` may come from a cache, so it's only trusted to attempt a write.
+    fresh = row is None
+    for _ in range(CAS_ATTEMPTS):
+        if row is None:
+            rows = supabase.table(table).select("*").eq('id', row_id).execute().data
+            if rows is None: return None, 'Booking failed, please retry'
+            if not rows: return None, 'Not found'
+            row, fresh = rows[0], True
+        updates = change(row)
+        if isinstance(updates, str):
+            if fresh: return row, updates
+            row = None # Refuse on what the table holds now, not a cached copy
+            continue
+        res = supabase.table(table).update(updates).eq('id', row_id).eq(column, row[column]).execute()
+        if table == 'users': _user_written(row_id, res.data[0] if res.data else None)
+        if res.data: return res.data[0], None
+        if res.data is None: return None, 'Booking failed, please retry'
+        row = None # Lost the race (or `row` came from a stale cache): re-read and try again
+    return None, 'Spot is busy, please retry'
+
+def _reserve_fallback(spot, uid, vehicle_plate, duration, pay_method, ref, user=None):
+    spot_id = spot['id']
+    if user is None and uid != 'admin_placeholder': user = get_user_by_id(uid)
+    if pay_method == 'wallet' and not user:
+        return {'ok': False, 'error': 'User not found'}
+
+    with _reserve_locks[hash(spot_id) % len(_reserve_locks)]:
+        spot, error = _cas_update('spots', spot_id, 'available',
+                                  lambda s: 'Unavailable' if s['available'] < 1 else {'available': s['available'] - 1},
+                                  row=spot)
+        if error: return {'ok': False, 'error': error}
+        price = spot['price']
+
+        if pay_method == 'wallet':
+            user, error = _cas_update('users', uid, 'wallet_balance',
+                                      lambda u: 'Funds too low' if float(u['wallet_balance']) < price
+                                      else {'wallet_balance': float(u['wallet_balance']) - price},
+                                      row=user)
+            if error:
+                # Give the bay back
+                restored, _ = _cas_update('spots', spot_id, 'available', lambda s: {'available': s['available'] + 1}, row=spot)
+                if not restored: _spots_write_failed()
+                return {'ok': False, 'error': error}
+            ref = f"WALLET-{int(time.time())}"
+
+    txn = create_transaction({
+        'user_id': uid, 'spot_id': spot_id, 'type': 'Booking',
+        'amount': price, 'spot_name': spot['name'],
+        'payment_ref': ref, 'date': time.strftime("%Y-%m-%d"),
+        'vehicle_plate': vehicle_plate,
+        'timestamp': time.time()
+    })
+    sess = create_session({
+        'spot_id': spot_id, 'user_name': user['name'] if user else 'Guest',
+        'vehicle_plate': vehicle_plate,
+        'start_time': time.time(),
+        'expiry_time': time.time() + (duration * 3600),
+        'price': price, 'payment_ref': ref
+    })
+    return {'ok': True, 'spot': spot, 'transaction': txn, 'session': sess}
+
+def reserve(spot, uid, vehicle_plate=None, duration=1, pay_method=None, ref=None, user=None):
+    """Book one bay on `spot`; returns {'ok': True, 'spot', 'transaction', 'session'} or {'ok': False, 'error'}.
+
+    `user` is the booker's row if the caller already has it (only the fallback path needs it).
+    """
+    global _reserve_rpc
+    if not supabase: return {'ok': False, 'error': 'Unavailable'}
+    result = None
+    if _reserve_rpc:
+        res = supabase.rpc('reserve_spot', {
+            'p_spot_id': spot['id'], 'p_user_id': uid, 'p_vehicle_plate': vehicle_plate,
+            'p_duration_hours': duration, 'p_payment_method': pay_method, 'p_payment_ref': ref
+        }).execute()
+        if isinstance(res.data, dict):
+            result = res.data
+            if result.get('ok') and result.get('transaction'):
+                analytics_rollup.add(result['transaction'], result['spot'].get('owner_id'))
+            if result.get('ok') and pay_method == 'wallet':
+                balance = result.get('wallet_balance')
+                if balance is None: _user_written(uid)
+                else: user_cache.patch(uid, lambda u: dict(u, wallet_balance=balance))
+        elif res.status == 404:
+            _reserve_rpc = False
+        else:
+            # The call may or may not have been applied; don't risk booking twice
+            _user_written(uid)
+            return {'ok': False, 'error': 'Booking failed, please retry'}
+    if result is None:
+        result = _reserve_fallback(spot, uid, vehicle_plate, duration, pay_method, ref, user)
+    if result.get('ok'):
+        _patch_spots(upserts=[result['spot']])
+        if result.get('session'): schedule_session_expiry(result['session'])
+    return result
+
+# --- Session expiry ---
+# Every worker keeps a heap of its known sessions' expiry times and frees
+# the bay when one comes due. Deleting the session row is the claim: only
+# the worker whose delete returns the row gives the bay back, so workers
+# racing on the same session can't release it twice.
+SESSION_EXPIRY_GRACE = float(os.environ.get('SESSION_EXPIRY_GRACE', 0))
+SESSION_EXPIRY_RESYNC = float(os.environ.get('SESSION_EXPIRY_RESYNC', 300))
+_RESYNC = '__resync__' # Scheduler key that triggers a reload of the sessions table
+
+def schedule_session_expiry(row):
+    if row.get('id') is not None and row.get('expiry_time') is not None:
+        expiry_scheduler.schedule(row['id'], float(row['expiry_time']) + SESSION_EXPIRY_GRACE)
+
+def recover_session_expiry():
+    # Sessions opened by other (possibly dead) workers only reach us here.
+    # Merged into what we already hold: sessions scheduled since the read
+    # (or still spooled by write-behind) aren't in these rows.
+    rows = supabase.table('sessions').select("id,expiry_time").execute().data
+    if rows is None:
+        print("Could not load sessions for expiry; retrying later")
+    else:
+        expiry_scheduler.load((r['id'], float(r['expiry_time']) + SESSION_EXPIRY_GRACE)
+                              for r in rows if r.get('expiry_time') is not None)
+    expiry_scheduler.schedule(_RESYNC, time.time() + SESSION_EXPIRY_RESYNC)
+
+def expire_sessions(session_ids):
+    if _RESYNC in session_ids:
+        recover_session_expiry()
+        session_ids = [sid for sid in session_ids if sid != _RESYNC]
+    if not session_ids: return []
+    res = supabase.table('sessions').delete().in_('id', session_ids).execute()
+    if res.data is None: raise RuntimeError('could not delete expired sessions')
+    freed = {}
+    for row in res.data:
+        if row.get('spot_id') is not None:
+            freed[row['spot_id']] = freed.get(row['spot_id'], 0) + 1
+    with app.app_context():
+        restored = []
+        for spot_id, n in freed.items():
+            spot, error = _cas_update('spots', spot_id, 'available', lambda s, n=n: {'available': (s['available'] or 0) + n},
+                                      row=get_spot_by_id(spot_id)) # Cached row saves a read unless it's stale
+            if spot: restored.append(spot)
+            elif error != 'Not found': _spots_write_failed()
+        if restored: _patch_spots(upserts=restored)
+        for spot_id in freed:
+            emit_event('force_end_session', {
+                'spot_id': spot_id, 'reason': 'expired', 'message': 'Your parking session has expired.'
+            }, to=[f"spot:{spot_id}", ADMIN_ROOM])
+        if freed: emit_data_update('session_expired')
+    return res.data
+
+expiry_scheduler = ExpiryScheduler(expire_sessions, batch=int(os.environ.get('SESSION_EXPIRY_BATCH', 500)))
+
+def start_session_expiry():
+    if not supabase or os.environ.get('SESSION_EXPIRY', 'on') == 'off': return
+    recover_session_expiry()
+    expiry_scheduler.start(socketio.start_background_task)
+
 def get_users():
     if not supabase: return []
     res = supabase.table('users').select("*").execute()
@@ -242,44 +1178,51 @@ def get_users():
 
 def update_user(user_id, updates):
     if not supabase: return
-    supabase.table('users').update(updates).eq('id', user_id).execute()
+    res = supabase.table('users').update(updates).eq('id', user_id).execute()
+    _user_written(user_id, res.data[0] if res.data else None)
+
+def push_undo(op, before=(), after=()):
+    # One entry per admin operation: just the rows it touched, as they were
+    # before and after. A new operation invalidates anything we could redo.
+    shared_state.push(UNDO_KEY, {'op': op, 'before': list(before), 'after': list(after)},
+                      maxlen=MAX_HISTORY, clear=(REDO_KEY,))
+
+APPLY_CHUNK = 500 # rows per upsert / ids per delete, keeping bulk-import undo entries within URL limits
+
+def apply_spot_rows(rows, keep_ids=()):
+    # Make the table hold exactly `rows` for the ids involved: bulk upserts
+    # for the rows, in_ deletes for ids present only on the other side.
+    if not supabase: return False
+    ok = True
+    rows = list(rows)
+    for i in range(0, len(rows), APPLY_CHUNK):
+        res = supabase.table('spots').upsert([dict(r) for r in rows[i:i + APPLY_CHUNK]], on_conflict='id').execute()
+        if res.data is not None: _patch_spots(upserts=res.data)
+        else: ok = False
+    drop = sorted(set(keep_ids) - {r['id'] for r in rows})
+    for i in range(0, len(drop), APPLY_CHUNK):
+        res = supabase.table('spots').delete().in_('id', drop[i:i + APPLY_CHUNK]).execute()
+        if res.data is not None: _patch_spots(removed=drop[i:i + APPLY_CHUNK])
+        else: ok = False
+    if not ok: _spots_write_failed()
+    return ok
+
+def _step_history(src, dst, side, other):
+    # pop() is atomic across workers, so two admins can't apply the same entry
+    entry = shared_state.pop(src)
+    if entry is None: return None
+    if apply_spot_rows(entry[side], keep_ids=[r['id'] for r in entry[other]]):
+        shared_state.push(dst, entry, maxlen=MAX_HISTORY)
+        return entry
+    shared_state.push(src, entry, maxlen=MAX_HISTORY) # Leave it in place so the admin can retry
+    return None
+
+def undo_last():
+    return _step_history(UNDO_KEY, REDO_KEY, 'before', 'after')
+
+def redo_last():
+    return _step_history(REDO_KEY, UNDO_KEY, 'after', 'before')
 
-def push_undo_snapshot():
-    global UNDO_STACK, REDO_STACK
-    current = get_all_spots()
-    UNDO_STACK.append(current)
-    if len(UNDO_STACK) > MAX_HISTORY:
-        UNDO_STACK.pop(0)
-    REDO_STACK.clear()
-
-def restore_snapshot(snapshot):
-    if not supabase: return
-    current_ids = {s['id'] for s in get_all_spots()}
-    snapshot_ids = {s['id'] for s in snapshot}
-    
-    for spot in snapshot:
-        clean = spot.copy()
-        if 'created_at' in clean: del clean['created_at']
-        if spot['id'] in current_ids:
-            update_spot(spot['id'], clean)
-        else:
-            create_spot(clean)
-            
-    for cid in current_ids:
-        if cid not in snapshot_ids:
-            delete_spot_db(cid)
-            
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000
-    try:
-        phi1 = math.radians(float(lat1))
-        phi2 = math.radians(float(lat2))
-        dphi = math.radians(float(lat2)-float(lat1))
-        dlam = math.radians(float(lon2)-float(lon1))
-        a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlam/2)**2
-        c = 2*math.atan2(math.sqrt(a),math.sqrt(1-a))
-        return R*c
-    except: return 9999999
 
 # --- Routes ---
 
@@ -307,8 +1250,13 @@ def login():
         # 2. Check Supabase Auth (Users)
         if supabase:
             res = supabase.auth.sign_in_with_password({"email": username, "password": password})
+            # Local stores have no tokens; Supabase's are checked and kept
+            tokens = SUPABASE_JWT_SECRET and res.user and res.session
+            if tokens and not verify_auth_session(res.session, res.user['id']):
+                return render_template('login.html', error="Login failed, please try again")
             if res.user:
                 session['user_id'] = res.user['id']
+                if tokens: _keep_auth_session(res.session)
                 session['user_email'] = res.user['email']
                 # Ensure public user record exists
                 if not get_user_by_id(res.user['id']):
@@ -376,13 +1324,121 @@ def admin_dashboard():
     return render_template('dashboard.html', is_admin=True, paystack_key=pk)
 
 # --- API ---
+MAX_SPOT_PROJECTIONS = 16 # distinct ?fields= bodies kept per snapshot
+
+def _spots_payload(fields=None):
+    # Serialized once per snapshot and projection: a patch or reload
+    # replaces the snapshot dict, which drops its payloads with it
+    cached = spots_cache.get('all', _load_spots) if supabase else None
+    if not cached: return Payload([])
+    payloads = cached.setdefault('payloads', {})
+    payload = payloads.get(fields)
+    if payload is None:
+        rows = cached['list'] if fields is None else [{f: s.get(f) for f in fields} for s in cached['list']]
+        payload = Payload(rows)
+        if len(payloads) < MAX_SPOT_PROJECTIONS: payloads[fields] = payload
+    return payload
+
+def _bbox_arg():
+    # bbox=west,south,east,north (Leaflet's toBBoxString order); ValueError if malformed
+    west, south, east, north = (float(v) for v in request.args['bbox'].split(','))
+    if not all(math.isfinite(v) for v in (west, south, east, north)):
+        raise ValueError('bbox must be finite numbers')
+    return west, south, east, north
+
+MAX_VIEW_SPOTS = 2000 # rows a bbox query answers with at most
+
+def _spots_in_view(bbox):
+    west, south, east, north = bbox
+    limit = max(1, min(request.args.get('limit', 500, type=int), MAX_VIEW_SPOTS))
+    get_all_spots() # Make sure the index reflects a fresh snapshot
+    return spot_index.within(south, west, north, east, limit)
+
 @app.route('/api/spots', methods=['GET'])
 def get_spots():
-    return jsonify(get_all_spots())
+    # ?bbox= answers with the spots in a map view instead of all of them
+    try:
+        bbox = _bbox_arg() if 'bbox' in request.args else None
+    except (ValueError, OverflowError):
+        return jsonify({'message': 'bbox must be west,south,east,north'}), 400
+
+    # Read the revision first: replaying a change the snapshot already has is harmless
+    rev = spot_log.rev
+    since = request.args.get('since', type=int)
+    if since is not None:
+        spots = get_all_spots()
+        changes = spot_log.since(since)
+        if changes is not None:
+            return jsonify({'rev': rev, 'changes': changes})
+        # Too far behind for the log: hand back a full snapshot instead
+        if bbox is None:
+            return jsonify({'rev': rev, 'full': True, 'spots': spots})
+        spots, truncated = _spots_in_view(bbox)
+        return jsonify({'rev': rev, 'full': True, 'spots': spots, 'truncated': truncated})
+
+    if bbox is not None:
+        spots, truncated = _spots_in_view(bbox)
+        response = jsonify(spots)
+        response.headers['X-Spots-Revision'] = str(rev)
+        response.headers['X-Spots-Truncated'] = 'true' if truncated else 'false'
+        return response
+
+    # ?fields=id,lat,lng,available,price trims rows to what a map view needs
+    fields = request.args.get('fields')
+    if fields is not None:
+        fields = tuple(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip()))
+        if not fields or len(fields) > 32 or not all(f.isidentifier() for f in fields):
+            return jsonify({'message': 'fields must be a comma-separated list of column names'}), 400
+    payload = _spots_payload(fields)
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+    headers = {'ETag': payload.tag(encoding), 'X-Spots-Revision': str(rev),
+               'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if payload.matches(request.headers.get('If-None-Match')):
+        return app.response_class(status=304, headers=headers)
+    body, content_encoding = payload.encoded(encoding)
+    if content_encoding: headers['Content-Encoding'] = content_encoding
+    return app.response_class(body, mimetype='application/json', headers=headers)
+
+@app.route('/api/spots/<int:spot_id>', methods=['GET'])
+def get_spot(spot_id):
+    spot = get_spot_by_id(spot_id)
+    if not spot: return jsonify({'message': 'Spot not found'}), 404
+    return jsonify(spot)
+
+@app.route('/api/spots/nearby', methods=['GET'])
+def nearby_spots():
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius = min(float(request.args.get('radius', 5000)), 50000)
+        limit = max(1, min(int(request.args.get('limit', 20)), 200))
+    except (KeyError, ValueError):
+        return jsonify({'message': 'lat and lng required'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180 and 0 <= radius): # also rejects nan
+        return jsonify({'message': 'lat, lng or radius out of range'}), 400
+
+    vehicle_type = request.args.get('vehicle_type')
+    predicate = (lambda s: (s.get('vehicle_type') or 'car') == vehicle_type) if vehicle_type else None
+
+    get_all_spots() # Make sure the index reflects a fresh snapshot
+    results = spot_index.nearby(lat, lng, radius, limit, predicate)
+    return jsonify([dict(spot, distance_m=round(d, 1)) for d, spot in results])
+
+@app.route('/api/spots/clusters', methods=['GET'])
+def spot_clusters():
+    try:
+        west, south, east, north = _bbox_arg()
+        zoom = int(float(request.args['zoom']))
+        limit = max(1, min(int(request.args.get('limit', 2000)), 10000))
+    except (KeyError, ValueError, OverflowError):
+        return jsonify({'message': 'bbox=west,south,east,north and zoom required'}), 400
+
+    get_all_spots() # Make sure the index reflects a fresh snapshot
+    level, clusters = cluster_index.query(south, west, north, east, zoom, limit + 1)
+    return jsonify({'zoom': level, 'clusters': clusters[:limit], 'truncated': len(clusters) > limit})
 
 @app.route('/api/spots', methods=['POST'])
 def add_spot():
-    push_undo_snapshot()
     new_spot = request.json
     try:
         spot_lat = float(new_spot['lat'])
@@ -421,7 +1477,8 @@ def add_spot():
         db_spot['owner_id'] = 'admin'
         
     created = create_spot(db_spot)
-    socketio.emit('data_update', {'type': 'spot_added'})
+    if created: push_undo('spot_added', after=[created])
+    emit_data_update('spot_added')
     return jsonify(created), 201
 
 # ... (keep existing code) ...
@@ -443,50 +1500,290 @@ def edit_spot(spot_id):
         clean['is_premium'] = updates['is_premium']
         
     update_spot(spot_id, clean)
-    socketio.emit('data_update', {'type': 'spot_updated'})
+    emit_data_update('spot_updated')
     return jsonify({'success': True})
 
 @app.route('/api/spots/<int:spot_id>', methods=['DELETE'])
 def delete_spot(spot_id):
-    push_undo_snapshot()
+    spot = get_spot_by_id(spot_id)
     delete_spot_db(spot_id)
+    if spot: push_undo('spot_deleted', before=[spot])
     delete_session(spot_id)
-    socketio.emit('data_update', {'type': 'spot_deleted'})
+    emit_data_update('spot_deleted')
     return jsonify({'success': True})
 
+# --- Bulk import / export (admin) ---
+# Uploads are read a line at a time and written in batched upserts; exports
+# page through the table by id and stream each page out as it arrives.
+IMPORT_BATCH = int(os.environ.get('IMPORT_BATCH', 500))
+IMPORT_UNDO_LIMIT = int(os.environ.get('IMPORT_UNDO_LIMIT', 20000)) # rows kept for undo; larger imports can't be undone
+EXPORT_PAGE = int(os.environ.get('EXPORT_PAGE', 1000))
+MAX_REPORTED_ERRORS = 100
+
+def _ndjson(obj):
+    return dumps(obj) + b'\n'
+
+@app.route('/api/admin/spots/import', methods=['POST'])
+def import_spots():
+    """Stream-import spots from CSV or NDJSON (?format=, else the Content-Type).
+
+    Records with an id update the fields they give on that spot, others
+    are inserted. Replies with NDJSON: one progress line per batch,
+    rejected records with their line numbers, then a summary. ?dry_run=1
+    only validates. The whole import is one undo entry.
+    """
+    if 'admin' not in session: return jsonify({'error': '401'}), 401
+    fmt = bulk.detect_format(request.args.get('format'), request.content_type)
+    if not fmt: return jsonify({'message': 'format must be csv or ndjson'}), 400
+    if not supabase: return jsonify({'message': 'Unavailable'}), 503
+    dry_run = request.args.get('dry_run') == '1'
+
+    def run():
+        totals = {'rows': 0, 'inserted': 0, 'updated': 0, 'rejected': 0}
+        before, after, seen = [], [], set()
+        undo = not dry_run
+        inserts, updates = [], {}
+        failed = False
+
+        def write(query, kind):
+            nonlocal undo
+            res = query.execute()
+            if res.data is None:
+                _spots_write_failed()
+                return False
+            _patch_spots(upserts=res.data)
+            totals[kind] += len(res.data)
+            if undo:
+                after.extend(res.data)
+                if len(before) + len(after) > IMPORT_UNDO_LIMIT:
+                    undo = False
+                    before.clear(); after.clear()
+            return True
+
+        def flush():
+            ok = True
+            if inserts: ok = write(supabase.table('spots').insert(list(inserts)), 'inserted')
+            # Updates carry only the fields their records gave; PostgREST wants
+            # the same keys on every row of one request, so send one per key set
+            groups = {}
+            for row in updates.values(): groups.setdefault(tuple(sorted(row)), []).append(row)
+            for rows in groups.values():
+                if ok: ok = write(supabase.table('spots').upsert(rows, on_conflict='id'), 'updated')
+            inserts.clear(); updates.clear()
+            return ok
+
+        for line, rec, error in bulk.read_records(request.stream, fmt):
+            totals['rows'] += 1
+            row = None
+            if not error:
+                row, error = bulk.spot_row(rec)
+            if not error and 'id' in row:
+                current = get_spot_by_id(row['id'])
+                if not current: error = f"no spot with id {row['id']}"
+                elif row['id'] not in seen:
+                    seen.add(row['id'])
+                    if undo: before.append(current)
+            if error:
+                totals['rejected'] += 1
+                if totals['rejected'] <= MAX_REPORTED_ERRORS:
+                    yield _ndjson({'line': line, 'error': error})
+                continue
+            if dry_run: continue
+            if 'id' in row: updates[row['id']] = {**updates.get(row['id'], {}), **row} # later fields win within a batch
+            else: inserts.append(row)
+            if len(inserts) + len(updates) >= IMPORT_BATCH:
+                failed = not flush()
+                if failed: break
+                yield _ndjson({'line': line, **totals})
+        if not dry_run and not failed:
+            failed = not flush()
+        if before or after:
+            push_undo('spots_imported', before=before, after=after)
+        if totals['inserted'] or totals['updated']:
+            emit_data_update('spots_imported')
+        yield _ndjson({'done': not failed, **totals, 'dry_run': dry_run, 'undo': bool(undo and (before or after)),
+                       **({'error': 'Upstream write failed; rows up to here were saved'} if failed else {})})
+
+    return app.response_class(stream_with_context(run()), mimetype='application/x-ndjson')
+
+def _paged_rows(table, columns="*", filters=()):
+    # Keyset pages in id order; a failed page ends the stream with an error,
+    # which cuts the response short rather than passing as a complete export
+    last = None
+    while True:
+        q = supabase.table(table).select(columns).order('id').limit(EXPORT_PAGE)
+        for column, op, value in filters:
+            getattr(q, op)(column, value)
+        if last is not None: q.after('id', last)
+        rows = q.execute().data
+        if rows is None: raise RuntimeError(f"Export of {table} failed after id {last}")
+        yield from rows
+        if len(rows) < EXPORT_PAGE: return
+        last = rows[-1]['id']
+
+def _export(table, columns, filters=()):
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in bulk.FORMATS: return jsonify({'message': 'format must be csv or ndjson'}), 400
+    if not supabase: return jsonify({'message': 'Unavailable'}), 503
+    rows = _paged_rows(table, filters=filters)
+    body = bulk.csv_lines(rows, columns) if fmt == 'csv' else bulk.ndjson_lines(rows)
+    filename = f"{table}-{time.strftime('%Y%m%d')}.{fmt}"
+    return app.response_class(stream_with_context(body), mimetype=bulk.FORMATS[fmt],
+                              headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                                       'Cache-Control': 'no-store'})
+
+@app.route('/api/admin/export/spots', methods=['GET'])
+def export_spots():
+    if 'admin' not in session: return jsonify({'error': '401'}), 401
+    return _export('spots', bulk.SPOT_COLUMNS)
+
+@app.route('/api/admin/export/transactions', methods=['GET'])
+def export_transactions():
+    # ?since=YYYY-MM-DD&until=YYYY-MM-DD filter on the transaction date, both inclusive
+    if 'admin' not in session: return jsonify({'error': '401'}), 401
+    filters = [('date', op, request.args[arg]) for arg, op in (('since', 'gte'), ('until', 'lte')) if request.args.get(arg)]
+    return _export('transactions', bulk.TRANSACTION_COLUMNS, filters)
+
 PAYSTACK_SECRET_KEY = os.environ.get('PAYSTACK_SECRET_KEY')
-def verify_paystack(ref):
-    if not ref: return False
+PAYSTACK_HTTP = HTTPPool(pool_maxsize=int(os.environ.get('PAYSTACK_POOL_MAXSIZE', 10)),
+                         name='paystack', observer=record_upstream)
+# Longest a request handler waits on Paystack before answering "pending"
+PAYSTACK_WAIT = float(os.environ.get('PAYSTACK_WAIT', 3))
+payment_verifier = PaystackVerifier(PAYSTACK_SECRET_KEY, PAYSTACK_HTTP,
+                                    base_url=os.environ.get('PAYSTACK_BASE_URL', 'https://api.paystack.co'),
+                                    workers=int(os.environ.get('PAYSTACK_WORKERS', 8)))
+def verify_payment(ref):
+    # The lookup itself runs on the verifier's pool; what this request pays is the wait
+    start = time.perf_counter()
     try:
-        r = requests.get(f"https://api.paystack.co/transaction/verify/{ref}", 
-            headers={"Authorization": f"Bearer {PAYSTACK_SECRET_KEY}"})
-        if r.status_code == 200 and r.json()['data']['status'] == 'success':
-            return r.json()['data']
-    except: pass
-    return False
+        return payment_verifier.verify(ref, wait=PAYSTACK_WAIT)
+    finally:
+        _note_upstream('paystack', time.perf_counter() - start)
+
+# Top-ups still pending at Paystack: ref -> (user id, when), settled when a
+# webhook confirms the payment. Oldest first; entries go after
+# PENDING_TOPUP_TTL seconds or beyond PENDING_TOPUP_MAX. One dropped early is
+# still credited when the client retries with its reference.
+PENDING_TOPUP_TTL = float(os.environ.get('PENDING_TOPUP_TTL', 3600))
+PENDING_TOPUP_MAX = int(os.environ.get('PENDING_TOPUP_MAX', 10000))
+_pending_topups = {}
+_pending_lock = threading.Lock()
+
+def _hold_pending_topup(ref, uid):
+    now = time.time()
+    with _pending_lock:
+        _pending_topups.pop(ref, None)
+        _pending_topups[ref] = (uid, now)
+        while True:
+            oldest = next(iter(_pending_topups))
+            if len(_pending_topups) <= PENDING_TOPUP_MAX and _pending_topups[oldest][1] >= now - PENDING_TOPUP_TTL: break
+            del _pending_topups[oldest]
+
+def _take_pending_topup(ref):
+    with _pending_lock:
+        held = _pending_topups.pop(ref, None)
+    return held[0] if held and held[1] >= time.time() - PENDING_TOPUP_TTL else None
+_topup_locks = [threading.Lock() for _ in range(64)]
+
+_topup_rpc = True # Cleared once PostgREST tells us settle_topup is missing
+
+def settle_topup(uid, ref, amount):
+    """Credit a verified top-up exactly once; returns 'credited', 'duplicate' or 'error'.
+
+    The Deposit transaction is the claim on the reference (migration_payments.sql
+    makes payment_ref unique for deposits) and its `credited` flag records
+    whether the wallet was paid. settle_topup() in that migration claims and
+    credits in one database transaction. 'duplicate' only ever means the
+    wallet has been credited; after 'error' a retry with the same reference
+    finishes the job.
+    """
+    global _topup_rpc
+    if not supabase: return 'error'
+    with _topup_locks[hash(ref) % len(_topup_locks)]:
+        if _topup_rpc:
+            res = supabase.rpc('settle_topup', {'p_user_id': uid, 'p_ref': ref, 'p_amount': amount}).execute()
+            if isinstance(res.data, dict) and res.data.get('status') in ('credited', 'duplicate'):
+                if res.data['status'] == 'credited':
+                    analytics_rollup.add(res.data['transaction'])
+                    balance = res.data.get('wallet_balance')
+                    if balance is None: _user_written(uid)
+                    else: user_cache.patch(uid, lambda u: dict(u, wallet_balance=balance))
+                return res.data['status']
+            if res.status != 404:
+                return 'error' # Rolled back, or unknown: either way a retry settles it
+            _topup_rpc = False
+        return _settle_topup_fallback(uid, ref, amount)
+
+def _settle_topup_fallback(uid, ref, amount):
+    # Claim, then take the credit by flipping `credited` (only one caller
+    # can), then pay the wallet. If the payment fails the flag is flipped
+    # back so the next attempt finishes it.
+    rows = supabase.table('transactions').select("*").eq('payment_ref', ref).eq('type', 'Deposit').limit(1).execute().data
+    if rows is None: return 'error'
+    if not rows:
+        res = supabase.table('transactions').insert({
+            'user_id': uid, 'type': 'Deposit', 'amount': amount,
+            'payment_ref': ref, 'date': time.strftime("%Y-%m-%d"),
+            'timestamp': time.time(), 'credited': False
+        }).execute()
+        if res.status == 409: # Claimed elsewhere just now: go on with their row
+            rows = supabase.table('transactions').select("*").eq('payment_ref', ref).eq('type', 'Deposit').limit(1).execute().data
+        else:
+            rows = res.data
+        if not rows: return 'error'
+    claim = rows[0]
+    if claim.get('credited') is not False: return 'duplicate'
+
+    taken = supabase.table('transactions').update({'credited': True}).eq('id', claim['id']).eq('credited', False).execute()
+    if not taken.data: return 'error' # Being credited elsewhere right now, or the update failed: retry sees which
+    user, error = _cas_update('users', claim['user_id'], 'wallet_balance',
+                              lambda u: {'wallet_balance': float(u['wallet_balance'] or 0) + float(claim['amount'])},
+                              row=get_user_by_id(claim['user_id']))
+    if error:
+        released = supabase.table('transactions').update({'credited': False}).eq('id', claim['id']).execute()
+        if released.data is None:
+            print(f"Top-up {ref}: wallet credit failed and the claim could not be released; credit it by hand")
+        else:
+            print(f"Top-up {ref}: wallet credit failed ({error}), left for a retry")
+        return 'error'
+    analytics_rollup.add(taken.data[0])
+    return 'credited'
 
 @app.route('/api/user/topup', methods=['POST'])
 def topup_wallet():
     # Helper: Get current user ID
     uid = session.get('user_id')
     if not uid or uid == 'admin': return jsonify({'message': 'Login required'}), 401
-    
-    ref = request.json.get('reference')
-    data = verify_paystack(ref)
-    if not data: return jsonify({'success': False, 'message': 'Failed'}), 400
-    
-    amt = data['amount'] / 100.0
-    user = get_user_by_id(uid)
-    
-    if user:
-        update_user(uid, {'wallet_balance': float(user['wallet_balance']) + amt})
-        create_transaction({
-            'user_id': uid, 'type': 'Deposit', 'amount': amt, 
-            'payment_ref': ref, 'date': time.strftime("%Y-%m-%d"),
-            'timestamp': time.time()
-        })
-        return jsonify({'success': True, 'message': 'Funded'})
-    return jsonify({'success': False, 'message': 'User not found'})
+
+    # Safe to retry with the same reference: verification is cached and
+    # settle_topup credits each reference once
+    ref = (request.json or {}).get('reference')
+    status, data = verify_payment(ref)
+    if status == PENDING:
+        _hold_pending_topup(ref, uid)
+        return jsonify({'success': False, 'pending': True, 'message': 'Payment is still being confirmed'}), 202
+    if status != SUCCESS: return jsonify({'success': False, 'message': 'Failed'}), 400
+
+    _take_pending_topup(ref)
+    outcome = settle_topup(uid, ref, data['amount'] / 100.0)
+    if outcome == 'credited': return jsonify({'success': True, 'message': 'Funded'})
+    if outcome == 'duplicate': return jsonify({'success': True, 'message': 'Already credited'})
+    return jsonify({'success': False, 'message': 'Could not credit wallet, please retry'}), 503
+
+@app.route('/api/paystack/webhook', methods=['POST'])
+def paystack_webhook():
+    if not payment_verifier.check_signature(request.get_data(), request.headers.get('X-Paystack-Signature')):
+        return jsonify({'message': 'Bad signature'}), 401
+    event = request.get_json(silent=True) or {}
+    data = event.get('data') or {}
+    ref = data.get('reference')
+    if event.get('event') == 'charge.success' and ref:
+        payment_verifier.record(ref, data)
+        # A top-up that timed out on this worker can be finished right away;
+        # anything else is picked up when the client retries
+        uid = _take_pending_topup(ref)
+        if uid: settle_topup(uid, ref, data['amount'] / 100.0)
+    return jsonify({'received': True})
 
 @app.route('/api/reserve/<int:spot_id>', methods=['POST'])
 def reserve_spot(spot_id):
@@ -499,42 +1796,25 @@ def reserve_spot(spot_id):
         return jsonify({'message': 'Please login to book'}), 401
     if uid == 'admin': uid = 'admin_placeholder' 
 
-    spot = get_spot_by_id(spot_id)
-    if not spot or spot['available'] < 1: return jsonify({'message': 'Unavailable'}), 400
-    
-    user = get_user_by_id(uid) if uid != 'admin_placeholder' else None
-    
     pay_method = info.get('payment_method')
     ref = info.get('payment_reference')
-    
-    if pay_method == 'wallet':
-        if not user: return jsonify({'message': 'User not found'}), 400
-        if float(user['wallet_balance']) < spot['price']: return jsonify({'message': 'Funds too low'}), 400
-        update_user(uid, {'wallet_balance': float(user['wallet_balance']) - spot['price']})
-        ref = f"WALLET-{int(time.time())}"
-    else:
-        if PAYSTACK_SECRET_KEY and 'sk_test' not in PAYSTACK_SECRET_KEY:
-             if not verify_paystack(ref): return jsonify({'message': 'Payment failed'}), 400
+    verify = pay_method != 'wallet' and PAYSTACK_SECRET_KEY and 'sk_test' not in PAYSTACK_SECRET_KEY
+    # The spot lookup, the Paystack check and (for the fallback path) the user row don't depend on each other
+    spot, payment, user = fetch_all(lambda: get_spot_by_id(spot_id),
+                                    (lambda: verify_payment(ref)) if verify else None,
+                                    (lambda: get_user_by_id(uid)) if not _reserve_rpc and uid != 'admin_placeholder' else None)
+    if not spot or spot['available'] < 1: return jsonify({'message': 'Unavailable'}), 400
 
-    update_spot(spot_id, {'available': spot['available'] - 1})
-    
-    create_transaction({
-        'user_id': uid, 'spot_id': spot_id, 'type': 'Booking',
-        'amount': spot['price'], 'spot_name': spot['name'],
-        'payment_ref': ref, 'date': time.strftime("%Y-%m-%d"),
-        'vehicle_plate': info.get('vehicle_plate'),
-        'timestamp': time.time()
-    })
-    
-    create_session({
-        'spot_id': spot_id, 'user_name': user['name'] if user else 'Guest',
-        'vehicle_plate': info.get('vehicle_plate'),
-        'start_time': time.time(),
-        'expiry_time': time.time() + (int(info.get('duration', 1)) * 3600),
-        'price': spot['price'], 'payment_ref': ref
-    })
-    
-    socketio.emit('data_update', {'type': 'reservation'})
+    if verify:
+        status, _ = payment
+        if status == PENDING:
+            return jsonify({'success': False, 'pending': True, 'message': 'Payment is still being confirmed'}), 202
+        if status != SUCCESS: return jsonify({'message': 'Payment failed'}), 400
+
+    result = reserve(spot, uid, info.get('vehicle_plate'), int(info.get('duration', 1)), pay_method, ref, user)
+    if not result['ok']: return jsonify({'message': result['error']}), 400
+
+    emit_data_update('reservation')
     return jsonify({'success': True})
 
 @app.route('/api/admin/sessions', methods=['GET'])
@@ -550,42 +1830,130 @@ def cancel_booking():
     if spot:
         update_spot(sid, {'available': spot['available'] + 1})
         delete_session(sid)
-        socketio.emit('data_update', {'type': 'cancellation'})
+        emit_data_update('cancellation')
+        emit_event('force_end_session', {
+            'spot_id': sid, 'message': 'Your session has been cancelled by the Admin.'
+        }, to=[f"spot:{sid}", ADMIN_ROOM])
         return jsonify({'success': True})
     return jsonify({'error': '404'})
 
 @app.route('/api/admin/undo', methods=['POST'])
 def undo():
     if 'admin' not in session: return jsonify({'error': '401'}), 401
-    if UNDO_STACK:
-        restore_snapshot(UNDO_STACK.pop())
-        socketio.emit('data_update', {'type': 'undo'})
-        return jsonify({'success': True})
-    return jsonify({'success': False})
+    entry = undo_last()
+    if entry or g.get('spots_resync'): emit_data_update('undo')
+    return jsonify({'success': entry is not None, 'op': entry and entry['op']})
 
-@app.route('/api/analytics', methods=['GET'])
-def analytics():
+@app.route('/api/admin/redo', methods=['POST'])
+def redo():
+    if 'admin' not in session: return jsonify({'error': '401'}), 401
+    entry = redo_last()
+    if entry or g.get('spots_resync'): emit_data_update('redo')
+    return jsonify({'success': entry is not None, 'op': entry and entry['op']})
+
+@app.route('/api/admin/pool_stats', methods=['GET'])
+def pool_stats():
     if 'admin' not in session: return jsonify({'error': '401'}), 401
-    txns = get_transactions()
     return jsonify({
-        'revenue': sum(float(x['amount'] or 0) for x in txns),
-        'total_bookings': len([t for t in txns if t['type']=='Booking']),
-        'recent_activity': txns[:10]
+        'supabase': supabase.http.stats_snapshot() if supabase and supabase.http else None,
+        'paystack': PAYSTACK_HTTP.stats_snapshot(),
+        'paystack_verifier': payment_verifier.stats(),
+        'storage': supabase.stats() if isinstance(supabase, LocalStore) else None,
+        'write_behind': write_behind.stats() if write_behind else None,
+        'admission': upstream_gate.stats() if upstream_gate else None,
+        'rate_limits': rate_limiter.stats() if rate_limiter else None
     })
 
+@app.route('/api/admin/cache_stats', methods=['GET'])
+def cache_stats():
+    if 'admin' not in session: return jsonify({'error': '401'}), 401
+    return jsonify({'spots': spots_cache.stats(), 'users': user_cache.stats()})
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def collect_app_metrics():
+    caches = [spots_cache.stats(), user_cache.stats()]
+    with _token_checks_lock:
+        checks = dict(_token_checks)
+    yield ('auth_token_checks_total', 'counter', 'Session access-token checks by outcome (verified locally, refreshed, rejected)',
+           [((('result', r),), n) for r, n in checks.items()])
+    yield ('cache_lookups_total', 'counter', 'Read-through cache lookups by result',
+           [((('cache', c['name']), ('result', r)), c[k]) for c in caches
+            for r, k in (('hit', 'hits'), ('miss', 'misses'), ('coalesced', 'coalesced'))])
+    yield ('cache_hit_ratio', 'gauge', 'Share of cache lookups served without a load',
+           [((('cache', c['name']),), c['hit_rate'] or 0) for c in caches])
+    yield ('cache_entries', 'gauge', 'Entries held by the cache', [((('cache', c['name']),), c['entries']) for c in caches])
+    pools = [p for p in ((supabase.http if supabase else None), PAYSTACK_HTTP) if p]
+    if isinstance(supabase, LocalStore):
+        local = supabase.stats()
+        yield ('storage_outbox', 'gauge', 'Writes queued in the local store, waiting to sync or failed',
+               [((('state', 'pending'),), local['pending']), ((('state', 'failed'),), local['failed'])])
+        yield ('storage_synced_total', 'counter', 'Queued writes replayed to Supabase', [((), local['synced'])])
+    if write_behind:
+        wb = write_behind.stats()
+        yield ('write_behind_pending', 'gauge', 'Rows spooled for write-behind and not yet stored upstream', [((), wb['pending'])])
+        yield ('write_behind_flushed_total', 'counter', 'Rows stored upstream by write-behind flushes', [((), wb['flushed'])])
+    snaps = [(p.name, p.stats_snapshot()) for p in pools]
+    yield ('http_pool_connections_opened_total', 'counter', 'TCP/TLS connections opened by each upstream pool',
+           [((('service', n),), s['opened']) for n, s in snaps])
+    yield ('http_pool_checkouts_total', 'counter', 'Connections handed to requests by each upstream pool',
+           [((('service', n),), s['checkouts']) for n, s in snaps])
+    yield ('http_pool_wait_seconds_total', 'counter', 'Time spent waiting on a full upstream pool',
+           [((('service', n),), s['wait_time_ms'] / 1000) for n, s in snaps])
+    if upstream_gate:
+        gate = upstream_gate.stats()
+        yield ('admission_in_flight', 'gauge', 'Upstream calls in flight on this worker', [((), gate['in_flight'])])
+        yield ('admission_admitted_total', 'counter', 'Upstream calls let through the admission gate by priority',
+               [((('priority', p),), n) for p, n in gate['admitted'].items()])
+        yield ('admission_shed_total', 'counter', 'Upstream calls shed with a 503 by priority',
+               [((('priority', p),), n) for p, n in gate['shed'].items()])
+    if rate_limiter:
+        limits = rate_limiter.stats()['rules']
+        yield ('rate_limited_total', 'counter', 'Requests answered 429 by rate limit rule',
+               [((('rule', name),), r['limited']) for name, r in limits.items()])
+    verifier = payment_verifier.stats()
+    yield ('paystack_verifier', 'gauge', 'Paystack verifier counters',
+           [((('stat', k),), v) for k, v in verifier.items()])
+    expiry = expiry_scheduler.stats()
+    yield ('session_expiry', 'gauge', 'Session expiry scheduler counters',
+           [((('stat', k),), v) for k, v in expiry.items()])
+
+metrics.add_collector(collect_app_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    token = request.headers.get('Authorization', '')
+    allowed = 'admin' in session or (METRICS_TOKEN and hmac.compare_digest(token, f"Bearer {METRICS_TOKEN}"))
+    if not allowed: return jsonify({'error': '401'}), 401
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/api/analytics', methods=['GET'])
+def analytics():
+    if 'admin' not in session: return jsonify({'error': '401'}), 401
+    summary, recent = fetch_all(get_analytics_summary, lambda: get_recent_transactions(10))
+    summary['recent_activity'] = recent
+    return jsonify(summary)
+
 @app.route('/api/user/profile', methods=['GET'])
 def profile():
     uid = session.get('user_id')
     if not uid: return jsonify({'error': 'Not logged in'}), 401
-    
-    u = get_user_by_id(uid)
+
+    cursor = request.args.get('cursor', type=int)
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    u, (txns, next_cursor), total = fetch_all(
+        lambda: get_user_by_id(uid),
+        lambda: get_user_transactions(uid, cursor, limit),
+        (lambda: count_user_bookings(uid)) if cursor is None else None)
     if not u:
         # Fallback if somehow missing
         u = {'id': uid, 'name': 'User', 'wallet_balance': 0.0, 'points': 0}
-        
-    txns = get_transactions()
-    u['history'] = [{'action': t['type'], 'amount': t['amount'], 'date': t['date'], 'spot': t.get('spot_name')} 
-                    for t in txns if t.get('user_id') == uid]
+
+    u['history'] = [{'id': t['id'], 'action': t['type'], 'amount': t['amount'], 'date': t['date'], 'spot': t.get('spot_name')}
+                    for t in txns]
+    u['next_cursor'] = next_cursor
+    if cursor is None:
+        u['total_bookings'] = total
     return jsonify(u)
 
 @app.route('/qrcode/<int:spot_id>')
@@ -595,9 +1963,29 @@ def qr(spot_id):
 
 @app.route('/receipt/<int:txn_id>')
 def receipt(txn_id):
-    txns = get_transactions()
-    t = next((x for x in txns if str(x['id']) == str(txn_id)), None)
+    t = get_transaction_by_id(txn_id)
     return render_template('receipt.html', txn=t) if t else "404", 404
 
+def start_storage_sync():
+    # Local-first only: replay queued writes to Supabase and refresh local tables
+    if not isinstance(supabase, LocalStore) or not supabase.remote: return
+    def pulled(tables):
+        spots_cache.invalidate()
+        user_cache.invalidate()
+    supabase.on_pull = pulled
+    supabase.start(socketio.start_background_task,
+                   interval=float(os.environ.get('STORAGE_SYNC_INTERVAL', 2)),
+                   pull_interval=float(os.environ.get('STORAGE_PULL_INTERVAL', 60)))
+
+def start_write_behind():
+    if not write_behind: return
+    write_behind.start(socketio.start_background_task)
+    atexit.register(write_behind.close)
+
+start_storage_sync()
+start_write_behind()
+start_session_expiry()
+
 if __name__ == '__main__':
-    socketio.run(app, debug=True, port=5000)
+    # Development server; production runs gunicorn on wsgi.py (see gunicorn.conf.py)
+    socketio.run(app, debug=os.environ.get('FLASK_DEBUG', '1') == '1', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,155 @@
+"""Concurrency vs latency: gunicorn gthread vs gevent against a slow upstream.
+
+    python benchmarks/async_bench.py [--latency-ms 50] [--levels 1,8,32,128,256]
+                                     [--seconds 4] [--path /api/user/profile]
+
+Starts benchmarks/fake_supabase.py in this process, delaying every upstream
+call by --latency-ms. For each server mode it starts gunicorn on wsgi.py
+with gunicorn.conf.py, then at each level in --levels runs that many
+clients, each sending --path back to back for --seconds. Modes:
+  gthread x8 sequential  8 threads, handler reads one after another (FANOUT_WORKERS=0)
+  gthread x8             8 threads, independent reads side by side
+  gthread x64            64 threads
+  gevent                 one greenlet per request
+/api/user/profile makes three independent upstream reads (user, history
+page, booking count). Rate limits are off and the admission gate is wide
+open, so only the serving model differs. Prints req/s, p50 and p99 for
+each mode and level.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from fake_supabase import FakeSupabase  # noqa: E402
+
+SECRET = 'bench-secret'
+MODES = [
+    ('gthread x8 sequential', {'ASYNC_MODE': 'threading', 'GUNICORN_THREADS': '8', 'FANOUT_WORKERS': '0'}),
+    ('gthread x8', {'ASYNC_MODE': 'threading', 'GUNICORN_THREADS': '8'}),
+    ('gthread x64', {'ASYNC_MODE': 'threading', 'GUNICORN_THREADS': '64'}),
+    ('gevent', {'ASYNC_MODE': 'gevent'}),
+]
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def session_cookie(values):
+    from flask import Flask
+    signer = Flask('bench')
+    signer.secret_key = SECRET
+    return signer.session_interface.get_signing_serializer(signer).dumps(values)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(fake, extra):
+    port = free_port()
+    env = dict(os.environ, SUPABASE_URL=fake.url, SUPABASE_KEY='bench', SECRET_KEY=SECRET, SESSION_EXPIRY='off',
+               RATE_LIMITS='off', METRICS='off', UPSTREAM_MAX_INFLIGHT='1000', HTTP_POOL_MAXSIZE='1000',
+               PORT=str(port), WEB_CONCURRENCY='1', **extra)
+    env.pop('PAYSTACK_SECRET_KEY', None)
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(url + '/login', timeout=1)
+            return proc, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def drive(url, path, cookie, clients, seconds):
+    stop = threading.Event()
+    lat, codes = [], Counter()
+    lock = threading.Lock()
+
+    def loop():
+        s = requests.Session()
+        s.cookies.set('session', cookie)
+        mine, mine_codes = [], Counter()
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                code = s.get(url + path, timeout=30).status_code
+            except requests.RequestException:
+                code = 'error'
+            mine.append(time.perf_counter() - start)
+            mine_codes[code] += 1
+        with lock:
+            lat.extend(mine)
+            codes.update(mine_codes)
+
+    threads = [threading.Thread(target=loop) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    stop.wait(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return len(lat) / (time.perf_counter() - start), pct(lat, .5), pct(lat, .99), codes
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--latency-ms', type=float, default=50.0)
+    ap.add_argument('--levels', default='1,8,32,128,256')
+    ap.add_argument('--seconds', type=float, default=4.0)
+    ap.add_argument('--path', default='/api/user/profile')
+    ap.add_argument('--modes', default=','.join(name for name, _ in MODES))
+    args = ap.parse_args()
+    levels = [int(v) for v in args.levels.split(',')]
+    wanted = args.modes.split(',')
+
+    fake = FakeSupabase(latency_ms=args.latency_ms).start()
+    store = fake.store
+    store.table('users').append({'id': 'u1', 'name': 'Ama', 'points': 0, 'tier': 'Bronze', 'wallet_balance': 50.0})
+    for i in range(40):
+        store.table('spots').append(store.new_row('spots', {'name': f"Spot {i}", 'price': 5.0, 'available': 10,
+                                                            'lat': 5.6 + i * 1e-3, 'lng': -0.18}))
+        store.table('transactions').append(store.new_row('transactions', {
+            'user_id': 'u1', 'spot_id': 1, 'type': 'Booking', 'amount': 5.0, 'spot_name': 'Spot 0',
+            'date': time.strftime('%Y-%m-%d'), 'timestamp': time.time()}))
+    cookie = session_cookie({'user_id': 'u1', 'last_active': time.time() + 86400, '_permanent': True})
+
+    print(f"GET {args.path}, {args.latency_ms} ms upstream latency, {args.seconds}s per level")
+    print(f"{'mode':22s} {'clients':>7s} {'req/s':>8s} {'p50 ms':>8s} {'p99 ms':>8s}  status")
+    for name, extra in MODES:
+        if name not in wanted:
+            continue
+        proc, url = start_server(fake, extra)
+        try:
+            for clients in levels:
+                rps, p50, p99, codes = drive(url, args.path, cookie, clients, args.seconds)
+                print(f"{name:22s} {clients:7d} {rps:8.0f} {p50 * 1000:8.1f} {p99 * 1000:8.1f}  {dict(codes)}")
+        finally:
+            proc.terminate()
+            proc.wait(10)
+    fake.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Map clusters: hierarchy build time, query latency and incremental updates.
+
+    python benchmarks/cluster_bench.py [--spots 100000] [--queries 2000]
+
+Spreads --spots spots over a ~35 km box around Accra, half of them packed
+into a few hot areas. Then:
+- times geo.ClusterIndex.rebuild() over them;
+- times query() for phone-sized viewports (about 400 x 800 px) at zooms
+  10-18;
+- times upsert()/remove() and checks that after a mix of them the index
+  matches a fresh rebuild;
+- times GET /api/spots/clusters through the Flask test client on a warm
+  cache. The endpoint runs against benchmarks/fake_supabase.py seeded
+  with the same spots.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from geo import ClusterIndex  # noqa: E402
+
+CENTER = (5.6037, -0.1870)
+SPAN = 0.16
+
+
+def make_spots(n, rng):
+    hot = [(CENTER[0] + rng.uniform(-SPAN, SPAN), CENTER[1] + rng.uniform(-SPAN, SPAN)) for _ in range(8)]
+    spots = []
+    for i in range(n):
+        if i % 2:
+            lat, lng = rng.choice(hot)
+            lat, lng = lat + rng.gauss(0, 0.01), lng + rng.gauss(0, 0.01)
+        else:
+            lat, lng = CENTER[0] + rng.uniform(-SPAN, SPAN), CENTER[1] + rng.uniform(-SPAN, SPAN)
+        spots.append({'id': i + 1, 'lat': lat, 'lng': lng, 'available': rng.randint(0, 20),
+                      'price': rng.choice([5.0, 8.0, 15.0, 45.0]), 'name': f"Spot {i}"})
+    return spots
+
+
+def viewport(rng, zoom):
+    # 400 x 800 px at 256 px tiles: degrees per pixel = 360 / (256 * 2**zoom)
+    per_px = 360.0 / (256 * 2 ** zoom)
+    lat, lng = CENTER[0] + rng.uniform(-SPAN, SPAN), CENTER[1] + rng.uniform(-SPAN, SPAN)
+    return lat - 400 * per_px, lng - 200 * per_px, lat + 400 * per_px, lng + 200 * per_px
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def same(a, b):
+    if len(a.levels) != len(b.levels):
+        return False
+    for la, lb in zip(a.levels, b.levels):
+        if la.keys() != lb.keys():
+            return False
+        for k, x in la.items():
+            y = lb[k]
+            if x[0] != y[0] or x[1] != y[1] or x[4:] != y[4:] or not math.isclose(x[2], y[2], abs_tol=1e-6):
+                return False
+    return True
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--spots', type=int, default=100000)
+    ap.add_argument('--queries', type=int, default=2000)
+    ap.add_argument('--updates', type=int, default=5000)
+    args = ap.parse_args()
+    rng = random.Random(11)
+    spots = make_spots(args.spots, rng)
+
+    index = ClusterIndex()
+    start = time.perf_counter()
+    index.rebuild(spots)
+    build = time.perf_counter() - start
+    cells = sum(len(level) for level in index.levels)
+    print(f"build: {args.spots} spots, {index.max_zoom + 1} levels, {cells} cells in {build * 1000:.0f} ms")
+
+    for zoom in (10, 12, 14, 16, 18):
+        took, sizes = [], []
+        for _ in range(args.queries):
+            box = viewport(rng, zoom)
+            start = time.perf_counter()
+            _, clusters = index.query(*box, zoom)
+            took.append(time.perf_counter() - start)
+            sizes.append(len(clusters))
+        print(f"query zoom {zoom:2d}: p50 {pct(took, .5) * 1e6:7.1f} us  p99 {pct(took, .99) * 1e6:7.1f} us  "
+              f"clusters p50 {pct(sizes, .5)} max {max(sizes)}")
+
+    by_id = {s['id']: s for s in spots}
+    start = time.perf_counter()
+    for i in range(args.updates):
+        sid = rng.randrange(1, args.spots + 1)
+        if i % 10 == 0 and sid in by_id:
+            index.remove(sid)
+            del by_id[sid]
+        else:
+            row = dict(by_id.get(sid) or spots[sid - 1])
+            row['available'] = rng.randint(0, 20)
+            if i % 3 == 0:
+                row['lat'] += rng.uniform(-0.01, 0.01)
+            index.upsert(row)
+            by_id[sid] = row
+    per_update = (time.perf_counter() - start) / args.updates
+    fresh = ClusterIndex()
+    fresh.rebuild(list(by_id.values()))
+    ok = same(index, fresh)
+    print(f"update: {per_update * 1e6:.1f} us per upsert/remove; matches a rebuild: {'ok' if ok else 'MISMATCH'}")
+
+    from fake_supabase import FakeSupabase
+    fake = FakeSupabase().start()
+    for s in spots:
+        fake.store.table('spots').append(fake.store.new_row('spots', dict(s)))
+    os.environ.update(SUPABASE_URL=fake.url, SUPABASE_KEY='bench', SESSION_EXPIRY='off', RATE_LIMITS='off')
+    import app
+    client = app.app.test_client()
+    client.get('/api/spots')
+    for zoom in (12, 15):
+        took = []
+        for _ in range(args.queries // 4):
+            s, w, n, e = viewport(rng, zoom)
+            start = time.perf_counter()
+            r = client.get(f"/api/spots/clusters?bbox={w},{s},{e},{n}&zoom={zoom}")
+            took.append(time.perf_counter() - start)
+        print(f"endpoint zoom {zoom}: p50 {pct(took, .5) * 1000:.2f} ms  p99 {pct(took, .99) * 1000:.2f} ms  "
+              f"({len(r.data)} bytes, vs {len(client.get('/api/spots').data)} for /api/spots)")
+    fake.stop()
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Pairs/second for the distance helpers in geo.py.
+
+    python benchmarks/distance_bench.py [--n 200000]
+
+Compares the original scalar haversine (float() coercion + try/except per
+pair) with haversine_many and distance_matrix, on both the NumPy path and
+the pure-Python fallback.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geo  # noqa: E402
+
+
+def legacy_haversine(lat1, lon1, lat2, lon2):
+    # Verbatim copy of the helper app.py used before geo.py existed
+    R = 6371000
+    try:
+        phi1 = math.radians(float(lat1))
+        phi2 = math.radians(float(lat2))
+        dphi = math.radians(float(lat2)-float(lat1))
+        dlam = math.radians(float(lon2)-float(lon1))
+        a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlam/2)**2
+        c = 2*math.atan2(math.sqrt(a),math.sqrt(1-a))
+        return R*c
+    except: return 9999999
+
+
+def rate(pairs, fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return round(pairs / best)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n', type=int, default=200000)
+    ap.add_argument('--matrix', type=int, default=500)
+    args = ap.parse_args()
+
+    rng = random.Random(7)
+    lats = [5.6 + rng.uniform(-0.2, 0.2) for _ in range(args.n)]
+    lngs = [-0.19 + rng.uniform(-0.2, 0.2) for _ in range(args.n)]
+    lat, lng = 5.6037, -0.1870
+    m = args.matrix
+
+    numpy_mod = geo.np
+    results = {'pairs': args.n, 'numpy': numpy_mod is not None}
+    results['legacy_scalar'] = rate(args.n, lambda: [legacy_haversine(lat, lng, a, b) for a, b in zip(lats, lngs)])
+    results['scalar_wrapper'] = rate(args.n, lambda: [geo.haversine(lat, lng, a, b) for a, b in zip(lats, lngs)])
+
+    geo.np = None
+    results['many_python'] = rate(args.n, lambda: geo.haversine_many(lat, lng, lats, lngs))
+    results['matrix_python'] = rate(m * m, lambda: geo.distance_matrix(lats[:m], lngs[:m], lats[:m], lngs[:m]))
+    geo.np = numpy_mod
+
+    if numpy_mod is not None:
+        alats, alngs = numpy_mod.asarray(lats), numpy_mod.asarray(lngs)
+        results['many_numpy'] = rate(args.n, lambda: geo.haversine_many(lat, lng, alats, alngs))
+        results['many_numpy_from_lists'] = rate(args.n, lambda: geo.haversine_many(lat, lng, lats, lngs))
+        results['matrix_numpy'] = rate(m * m, lambda: geo.distance_matrix(alats[:m], alngs[:m], alats[:m], alngs[:m]))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Session expiry: heap scheduler vs a periodic scan, plus an end-to-end run.
+
+    python benchmarks/expiry_bench.py [--sessions 100000] [--spread 5] [--tick 1]
+
+1. Scheduler only: --sessions expiries spread over --spread seconds. Compares
+   scheduler.ExpiryScheduler with a loop that scans every session each
+   --tick seconds, the usual cron-style approach. Reports CPU time, lateness
+   after each deadline, and idle CPU with everything due far in the future.
+2. End to end: seeds benchmarks/fake_supabase.py with sessions on 200 spots
+   that all run out within a couple of seconds. The app picks them up through
+   recover_session_expiry(), as it does on startup. The run checks that every
+   session is gone and every bay is back, and counts upstream requests.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_supabase import FakeSupabase  # noqa: E402
+from scheduler import ExpiryScheduler  # noqa: E402
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def bench_heap(deadlines):
+    late, done = [], threading.Event()
+
+    def on_expire(keys):
+        now = time.time()
+        late.extend(now - deadlines[k] for k in keys)
+        if len(late) >= len(deadlines):
+            done.set()
+
+    sched = ExpiryScheduler(on_expire, batch=500)
+    start = time.perf_counter()
+    for key, at in deadlines.items():
+        sched.schedule(key, at)
+    schedule_s = time.perf_counter() - start
+    cpu = time.process_time()
+    sched.start()
+    done.wait()
+    cpu = time.process_time() - cpu
+    sched.stop()
+    return schedule_s, cpu, late, sched.stats()['wakeups']
+
+
+def bench_scan(deadlines, tick):
+    pending = dict(deadlines)
+    late = []
+    cpu = time.process_time()
+    scans = 0
+    while pending:
+        time.sleep(tick)
+        now = time.time()
+        due = [k for k, at in pending.items() if at <= now]
+        scans += 1
+        for k in due:
+            late.append(now - pending.pop(k))
+    return time.process_time() - cpu, late, scans
+
+
+def idle_cpu(n, seconds=3):
+    sched = ExpiryScheduler(lambda keys: None)
+    far = time.time() + 3600
+    sched.load((i, far + i) for i in range(n))
+    sched.start()
+    cpu = time.process_time()
+    time.sleep(seconds)
+    cpu = time.process_time() - cpu
+    sched.stop()
+    return cpu
+
+
+def end_to_end(spots=200, per_spot=10):
+    fake = FakeSupabase().start()
+    os.environ['SUPABASE_URL'] = fake.url
+    os.environ['SUPABASE_KEY'] = 'bench'
+    import app
+
+    store = fake.store
+    for i in range(spots):
+        store.table('spots').append(store.new_row('spots', {
+            'name': f"Spot {i}", 'price': 5.0, 'available': 0, 'lat': 5.6 + i * 1e-3, 'lng': -0.18}))
+    now = time.time()
+    for s in store.table('spots'):
+        for j in range(per_spot):
+            store.table('sessions').append(store.new_row('sessions', {
+                'spot_id': s['id'], 'user_name': 'Guest', 'start_time': now,
+                'expiry_time': now + 1 + (j % 10) * 0.1}))
+    app.get_all_spots()
+    fake.reset_stats()
+    start = time.perf_counter()
+    app.recover_session_expiry()
+    total = spots * per_spot
+    deadline = time.time() + 30
+    while (store.table('sessions') or sum(s['available'] for s in store.table('spots')) < total) and time.time() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    restored = sum(s['available'] for s in store.table('spots'))
+    cached = sum(s['available'] for s in app.get_all_spots())
+    fake.stop()
+    return total, len(store.table('sessions')), restored, cached, elapsed, fake.stats()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sessions', type=int, default=100000)
+    ap.add_argument('--spread', type=float, default=5.0)
+    ap.add_argument('--tick', type=float, default=1.0)
+    args = ap.parse_args()
+
+    def deadlines():
+        base = time.time() + 1
+        return {i: base + args.spread * i / args.sessions for i in range(args.sessions)}
+
+    schedule_s, cpu, late, wakeups = bench_heap(deadlines())
+    print(f"heap:  scheduled {args.sessions} in {schedule_s * 1000:.0f} ms; drain cpu {cpu * 1000:.0f} ms, "
+          f"{wakeups} wakeups; late p50 {pct(late, .5) * 1000:.1f} ms p99 {pct(late, .99) * 1000:.1f} ms")
+    cpu, late, scans = bench_scan(deadlines(), args.tick)
+    print(f"scan:  every {args.tick:g}s; drain cpu {cpu * 1000:.0f} ms, {scans} scans; "
+          f"late p50 {pct(late, .5) * 1000:.1f} ms p99 {pct(late, .99) * 1000:.1f} ms")
+    print(f"idle:  {args.sessions} far-future expiries, cpu over 3 s: {idle_cpu(args.sessions) * 1000:.1f} ms")
+
+    total, left, restored, cached, elapsed, stats = end_to_end()
+    ok = left == 0 and restored == total and cached == total
+    print(f"app:   {total} sessions expired in {elapsed:.2f}s, {left} left; bays restored upstream {restored}, "
+          f"in cache {cached}; requests {stats}  {'ok' if ok else 'MISMATCH'}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Local stand-in for Paystack's transaction verify API and webhooks.
+
+    fake = FakePaystack(secret='sk_live_fake', latency_ms=500).start()
+    fake.add_charge('ref-1', 5000)            # GHS 50.00, in pesewas
+    os.environ['PAYSTACK_BASE_URL'] = fake.url
+    ...
+    fake.send_webhook(app_url + '/api/paystack/webhook', 'ref-1')
+    fake.verify_calls['ref-1']                # how often the app asked
+
+GET /transaction/verify/<ref> answers like Paystack: {"status": true,
+"data": {"status": "success", "reference": ..., "amount": ...}} for known
+charges and 404 otherwise, after an optional per-request delay.
+"""
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+class FakePaystack:
+    def __init__(self, secret='sk_live_fake', host='127.0.0.1', port=0, latency_ms=0.0):
+        self.secret = secret
+        self.latency = latency_ms / 1000.0
+        self.charges = {}          # ref -> transaction data
+        self.verify_calls = Counter()
+        self.errors = {}           # ref -> HTTP status to answer with instead (an outage, e.g. 503)
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_charge(self, ref, amount, status='success'):
+        self.charges[ref] = {'id': len(self.charges) + 1, 'reference': ref, 'amount': amount,
+                             'status': status, 'currency': 'GHS', 'paid_at': time.strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+    def sign(self, body):
+        return hmac.new(self.secret.encode(), body, hashlib.sha512).hexdigest()
+
+    def send_webhook(self, url, ref, secret=None, session=None):
+        body = json.dumps({'event': 'charge.success', 'data': self.charges[ref]}).encode()
+        signature = hmac.new((secret or self.secret).encode(), body, hashlib.sha512).hexdigest()
+        post = (session or requests).post
+        return post(url, data=body, headers={'Content-Type': 'application/json', 'X-Paystack-Signature': signature})
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                prefix = '/transaction/verify/'
+                if not self.path.startswith(prefix):
+                    return self._send(404, {'status': False, 'message': 'Not found'})
+                ref = self.path[len(prefix):]
+                with fake.lock:
+                    fake.verify_calls[ref] += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if self.headers.get('Authorization') != f"Bearer {fake.secret}":
+                    return self._send(401, {'status': False, 'message': 'Invalid key'})
+                if ref in fake.errors:
+                    return self._send(fake.errors[ref], {'message': 'Service unavailable'})
+                charge = fake.charges.get(ref)
+                if charge is None:
+                    return self._send(404, {'status': False, 'message': 'Transaction reference not found'})
+                return self._send(200, {'status': True, 'message': 'Verification successful', 'data': charge})
+
+            def _send(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
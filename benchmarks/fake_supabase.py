@@ -0,0 +1,587 @@
+"""Local stand-in for the Supabase REST (PostgREST) and auth endpoints.
+
+Implements the subset of PostgREST that app.py's TableLite speaks: select
+projection, eq/neq/gt/gte/lt/lte/in/is filters, order, limit/offset, Range
+headers, Prefer count / return / resolution (upsert with on_conflict),
+single-object responses and /rpc functions. Tables live in memory and can be
+seeded from the legacy JSON dumps in the repo root.
+
+    python benchmarks/fake_supabase.py --port 54321 [--latency-ms 20] [--seed]
+
+then run the app with SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=dev.
+Access tokens are HS256 JWTs signed with --jwt-secret (SUPABASE_JWT_SECRET
+for the app) and last --token-ttl seconds; refresh tokens can be swapped for
+new ones with grant_type=refresh_token.
+
+From Python:
+
+    fake = FakeSupabase(seed=True).start()
+    os.environ['SUPABASE_URL'] = fake.url
+    ...
+    fake.stats()   # upstream requests by (method, table or auth/<action>)
+    fake.stop()
+
+GET /__stats returns the same counters; POST /__reset clears them.
+"""
+import argparse
+import copy
+import functools
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from tokens import encode_hs256  # noqa: E402
+
+JWT_SECRET = 'fake-jwt-secret'
+RESERVED = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+INT_ID_TABLES = {'spots', 'transactions', 'sessions'}
+# Partial unique indexes from the migrations: table -> [(columns, applies_to(row))]
+UNIQUE = {
+    'transactions': [(('payment_ref',), lambda r: r.get('type') == 'Deposit')],
+}
+
+RPCS = {}
+
+
+def rpc(name):
+    def register(fn):
+        RPCS[name] = fn
+        return fn
+    return register
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _coerce(raw, sample):
+    if raw == 'null':
+        return None
+    if isinstance(sample, bool):
+        return raw == 'true'
+    if isinstance(sample, (int, float)):
+        try:
+            return float(raw)
+        except ValueError:
+            return raw
+    return raw
+
+
+def _split_in(raw):
+    # "(1,2,3)" / '("a","b")' -> list of strings
+    body = raw.strip()[1:-1]
+    out, cur, quoted, escape = [], '', False, False
+    for ch in body:
+        if escape:
+            cur += ch
+            escape = False
+        elif ch == '\\':
+            escape = True
+        elif ch == '"':
+            quoted = not quoted
+        elif ch == ',' and not quoted:
+            out.append(cur)
+            cur = ''
+        else:
+            cur += ch
+    if body:
+        out.append(cur)
+    return out
+
+
+@functools.lru_cache(maxsize=64)
+def _in_values(raw):
+    # _match runs once per row, so parse each in.(...) list once
+    values = _split_in(raw)
+    numbers = set()
+    for v in values:
+        try:
+            numbers.add(float(v))
+        except ValueError:
+            pass
+    return frozenset(values), frozenset(numbers)
+
+
+def _match(row, filters):
+    for column, cond in filters:
+        op, _, raw = cond.partition('.')
+        value = row.get(column)
+        if op == 'is':
+            want = {'null': None, 'true': True, 'false': False}.get(raw, raw)
+            if value is not want:
+                return False
+            continue
+        if op == 'in':
+            strings, numbers = _in_values(raw)
+            if str(value) not in strings and not (
+                    isinstance(value, (int, float)) and not isinstance(value, bool) and value in numbers):
+                return False
+            continue
+        target = _coerce(raw, value)
+        if op == 'eq':
+            ok = value == target or str(value) == raw
+        elif op == 'neq':
+            ok = not (value == target or str(value) == raw)
+        else:
+            if value is None or target is None:
+                return False
+            try:
+                ok = {'gt': value > target, 'gte': value >= target,
+                      'lt': value < target, 'lte': value <= target}[op]
+            except (KeyError, TypeError):
+                ok = False
+        if not ok:
+            return False
+    return True
+
+
+def _order(rows, spec):
+    for part in reversed(spec.split(',')):
+        bits = part.split('.')
+        column, desc = bits[0], 'desc' in bits[1:]
+        present = [r for r in rows if r.get(column) is not None]
+        missing = [r for r in rows if r.get(column) is None]
+        present.sort(key=lambda r: r[column], reverse=desc)
+        rows = present + missing
+    return rows
+
+
+def _project(rows, select):
+    if not select or select.strip() == '*':
+        return rows
+    cols = [c.strip() for c in select.split(',') if c.strip()]
+    return [{c: r.get(c) for c in cols} for r in rows]
+
+
+def _violates_unique(name, table, row):
+    for cols, applies in UNIQUE.get(name, ()):
+        if applies(row) and any(applies(r) and all(r.get(c) == row.get(c) for c in cols) for r in table):
+            return True
+    return False
+
+
+class Store:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables = {'spots': [], 'users': [], 'transactions': [], 'sessions': []}
+        self.next_id = {}
+
+    def table(self, name):
+        return self.tables.setdefault(name, [])
+
+    def new_row(self, name, row):
+        row = dict(row)
+        if name in INT_ID_TABLES and row.get('id') is None:
+            nid = self.next_id.get(name) or max([r['id'] for r in self.table(name) if isinstance(r.get('id'), int)] + [0]) + 1
+            row['id'] = nid
+            self.next_id[name] = nid + 1
+        elif name in INT_ID_TABLES:
+            self.next_id[name] = max(self.next_id.get(name, 0), int(row['id']) + 1)
+        if name != 'users':
+            row.setdefault('created_at', _now_iso())
+        return row
+
+    def seed_legacy(self):
+        """Load parking_data.json / users.json / transactions.json / active_sessions.json."""
+        def load(fname):
+            path = os.path.join(ROOT, fname)
+            if not os.path.exists(path):
+                return []
+            with open(path) as f:
+                return json.load(f)
+
+        with self.lock:
+            for s in load('parking_data.json'):
+                s = {k: v for k, v in s.items() if k != 'distance'}
+                self.table('spots').append(self.new_row('spots', s))
+            for u in load('users.json'):
+                self.table('users').append({'id': u['id'], 'name': u.get('name'), 'points': u.get('points', 0),
+                                            'tier': u.get('tier', 'Bronze'), 'wallet_balance': float(u.get('wallet_balance', 0) or 0)})
+            uid = self.tables['users'][0]['id'] if self.tables['users'] else None
+            for t in load('transactions.json'):
+                ts = t.get('timestamp') or time.time()
+                self.table('transactions').append(self.new_row('transactions', {
+                    'user_id': t.get('user_id', uid), 'type': t.get('type', 'Booking'),
+                    'amount': t.get('amount', t.get('price')), 'user_name': t.get('user_name'),
+                    'payment_ref': t.get('payment_ref'), 'timestamp': ts,
+                    'date': t.get('date') or time.strftime('%Y-%m-%d', time.localtime(ts)),
+                    'spot_id': t.get('spot_id'), 'spot_name': t.get('spot_name'),
+                    'vehicle_plate': t.get('vehicle_plate'),
+                    'created_at': datetime.fromtimestamp(ts, timezone.utc).isoformat()
+                }))
+            for sess in load('active_sessions.json'):
+                self.table('sessions').append(self.new_row('sessions', sess))
+        return self
+
+
+class FakeSupabase:
+    def __init__(self, host='127.0.0.1', port=0, seed=False, latency_ms=0.0, jwt_secret=JWT_SECRET, token_ttl=3600):
+        self.store = Store()
+        self.jwt_secret = jwt_secret
+        self.token_ttl = token_ttl
+        self.refresh_tokens = {}  # refresh token -> email
+        if seed:
+            self.store.seed_legacy()
+        self.latency = latency_ms / 1000.0
+        self.counts = Counter()
+        self.count_lock = threading.Lock()
+        self.users = {}  # email -> auth user
+        self.connections = set()  # open keep-alive sockets, closed by stop()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        # Also drop kept-alive connections, or their handler threads keep answering
+        self.server.shutdown()
+        self.server.server_close()
+        with self.count_lock:
+            for conn in list(self.connections):
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self.count_lock:
+            return {f"{m} {t}": n for (m, t), n in sorted(self.counts.items())}
+
+    def reset_stats(self):
+        with self.count_lock:
+            self.counts.clear()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with fake.count_lock:
+                    fake.connections.add(self.connection)
+
+            def finish(self):
+                with fake.count_lock:
+                    fake.connections.discard(self.connection)
+                super().finish()
+
+            def _send(self, status, body=None, headers=None):
+                payload = b'' if body is None else json.dumps(body, default=str).encode()
+                self.send_response(status)
+                if body is not None:
+                    ctype = 'application/vnd.pgrst.object+json' if 'pgrst.object' in self.headers.get('Accept', '') else 'application/json'
+                    self.send_header('Content-Type', ctype)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _body(self):
+                return self.payload
+
+            def _route(self, method):
+                # Always drain the body, or a keep-alive connection desyncs on early returns
+                n = int(self.headers.get('Content-Length') or 0)
+                self.payload = json.loads(self.rfile.read(n)) if n else None
+                parts = urlsplit(self.path)
+                query = parse_qsl(parts.query, keep_blank_values=True)
+                path = parts.path
+                if path == '/__stats':
+                    return self._send(200, fake.stats())
+                if path == '/__reset':
+                    fake.reset_stats()
+                    return self._send(200, {})
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if path.startswith('/auth/v1/'):
+                    return self._auth(path[len('/auth/v1/'):], dict(query))
+                if path.startswith('/rest/v1/rpc/'):
+                    name = path[len('/rest/v1/rpc/'):]
+                    with fake.count_lock:
+                        fake.counts[(method, 'rpc/' + name)] += 1
+                    fn = RPCS.get(name)
+                    if not fn:
+                        return self._send(404, {'message': f'function {name} not found'})
+                    try:
+                        with fake.store.lock:
+                            result = fn(fake.store, self._body() or {})
+                    except ValueError as e:
+                        return self._send(400, {'message': str(e)})
+                    return self._send(200, result)
+                if not path.startswith('/rest/v1/'):
+                    return self._send(404, {'message': 'not found'})
+                name = path[len('/rest/v1/'):]
+                with fake.count_lock:
+                    fake.counts[(method, name)] += 1
+                return self._table(method, name, query)
+
+            def _auth(self, action, query):
+                with fake.count_lock:
+                    fake.counts[('POST', 'auth/' + action)] += 1
+                body = self._body() or {}
+                email = body.get('email')
+                if action == 'signup':
+                    if email in fake.users:
+                        return self._send(400, {'msg': 'User already registered'})
+                    user = {'id': str(uuid.uuid4()), 'email': email}
+                    fake.users[email] = dict(user, password=body.get('password'))
+                    return self._send(200, {'user': user})
+                if action == 'token':
+                    if query.get('grant_type') == 'refresh_token':
+                        email = fake.refresh_tokens.pop(body.get('refresh_token'), None)
+                        user = fake.users.get(email)
+                        if not user:
+                            return self._send(400, {'error_description': 'Invalid Refresh Token'})
+                    else:
+                        user = fake.users.get(email)
+                        if not user or user['password'] != body.get('password'):
+                            return self._send(400, {'error_description': 'Invalid login credentials'})
+                    public = {'id': user['id'], 'email': email}
+                    now = int(time.time())
+                    refresh = uuid.uuid4().hex
+                    fake.refresh_tokens[refresh] = email
+                    token = encode_hs256({'sub': user['id'], 'email': email, 'aud': 'authenticated',
+                                          'role': 'authenticated', 'iat': now, 'exp': now + fake.token_ttl},
+                                         fake.jwt_secret)
+                    return self._send(200, {'access_token': token, 'token_type': 'bearer', 'refresh_token': refresh,
+                                            'expires_in': fake.token_ttl, 'expires_at': now + fake.token_ttl,
+                                            'user': public})
+                return self._send(404, {'message': 'not found'})
+
+            def _table(self, method, name, query):
+                store = fake.store
+                params = {k: v for k, v in query if k in RESERVED}
+                filters = [(k, v) for k, v in query if k not in RESERVED]
+                prefer = self.headers.get('Prefer', '')
+                want_rows = 'return=representation' in prefer
+                single = 'pgrst.object' in self.headers.get('Accept', '')
+
+                with store.lock:
+                    table = store.table(name)
+                    if method == 'GET':
+                        rows = [r for r in table if _match(r, filters)]
+                        if 'order' in params:
+                            rows = _order(rows, params['order'])
+                        total = len(rows)
+                        start = int(params.get('offset', 0))
+                        end = total
+                        if 'limit' in params:
+                            end = min(end, start + int(params['limit']))
+                        rng = self.headers.get('Range')
+                        if rng:
+                            a, _, b = rng.partition('-')
+                            start = max(start, int(a))
+                            if b:
+                                end = min(end, int(b) + 1)
+                        rows = copy.deepcopy(rows[start:end])
+                        rows = _project(rows, params.get('select'))
+                        shown = f"{start}-{start + len(rows) - 1}" if rows else '*'
+                        counted = str(total) if 'count=' in prefer else '*'
+                        headers = {'Content-Range': f"{shown}/{counted}"}
+                        if single:
+                            if len(rows) != 1:
+                                return self._send(406, {'message': 'JSON object requested, multiple (or no) rows returned'})
+                            return self._send(200, rows[0], headers)
+                        return self._send(206 if rng else 200, rows, headers)
+
+                    if method == 'POST':
+                        body = self._body()
+                        items = body if isinstance(body, list) else [body]
+                        merge = 'resolution=merge-duplicates' in prefer
+                        ignore = 'resolution=ignore-duplicates' in prefer
+                        keys = (params.get('on_conflict') or 'id').split(',')
+                        out = []
+                        by_key = None
+                        for item in items:
+                            existing = None
+                            if (merge or ignore) and all(item.get(k) is not None for k in keys):
+                                if by_key is None:
+                                    # built once per request so bulk upserts stay linear
+                                    by_key = {tuple(str(r.get(k)) for k in keys): r for r in reversed(table)}
+                                existing = by_key.get(tuple(str(item[k]) for k in keys))
+                            elif item.get('id') is not None and name != 'users':
+                                existing = next((r for r in table if r.get('id') == item['id']), None)
+                                if existing is not None:
+                                    return self._send(409, {'message': 'duplicate key value violates unique constraint'})
+                            elif name == 'users' and any(r.get('id') == item.get('id') for r in table):
+                                return self._send(409, {'message': 'duplicate key value violates unique constraint'})
+                            if existing is not None:
+                                if merge:
+                                    existing.update(item)
+                                    out.append(dict(existing))
+                                continue
+                            if _violates_unique(name, table, item):
+                                return self._send(409, {'message': 'duplicate key value violates unique constraint'})
+                            row = store.new_row(name, item)
+                            table.append(row)
+                            if by_key is not None:
+                                by_key.setdefault(tuple(str(row.get(k)) for k in keys), row)
+                            out.append(dict(row))
+                        if not want_rows:
+                            return self._send(201)
+                        if single:
+                            return self._send(201, out[0] if out else None)
+                        return self._send(201, _project(out, params.get('select')))
+
+                    if method == 'PATCH':
+                        body = self._body() or {}
+                        out = []
+                        for r in table:
+                            if _match(r, filters):
+                                r.update(body)
+                                out.append(dict(r))
+                        return self._send(200, _project(out, params.get('select'))) if want_rows else self._send(204)
+
+                    if method == 'DELETE':
+                        keep, out = [], []
+                        for r in table:
+                            (out if _match(r, filters) else keep).append(r)
+                        store.tables[name] = keep
+                        return self._send(200, _project(out, params.get('select'))) if want_rows else self._send(204)
+
+                return self._send(405, {'message': 'method not allowed'})
+
+            def do_GET(self):
+                self._route('GET')
+
+            def do_POST(self):
+                self._route('POST')
+
+            def do_PATCH(self):
+                self._route('PATCH')
+
+            def do_DELETE(self):
+                self._route('DELETE')
+
+        return Handler
+
+
+# --- RPC functions mirroring the SQL migrations ---
+
+@rpc('analytics_summary')
+def analytics_summary(store, params):
+    txns = store.table('transactions')
+    owners = {s['id']: s.get('owner_id') for s in store.table('spots')}
+
+    def group(key_fn):
+        out = {}
+        for t in txns:
+            k = key_fn(t)
+            if k is None:
+                continue
+            row = out.setdefault(k, {'key': k, 'revenue': 0.0, 'bookings': 0})
+            row['revenue'] += float(t.get('amount') or 0)
+            row['bookings'] += 1 if t.get('type') == 'Booking' else 0
+        return list(out.values())
+
+    return {
+        'revenue': sum(float(t.get('amount') or 0) for t in txns),
+        'total_bookings': sum(1 for t in txns if t.get('type') == 'Booking'),
+        'by_day': group(lambda t: t.get('date')),
+        'by_spot': group(lambda t: t.get('spot_id')),
+        'by_owner': group(lambda t: owners.get(t.get('spot_id'))),
+    }
+
+
+
+@rpc('reserve_spot')
+def reserve_spot(store, params):
+    # Runs under the store lock, which stands in for the row locks in SQL
+    spot = next((s for s in store.table('spots') if s['id'] == params['p_spot_id']), None)
+    if spot is None or (spot.get('available') or 0) < 1:
+        return {'ok': False, 'error': 'Unavailable'}
+    uid = params.get('p_user_id')
+    user = next((u for u in store.table('users') if u['id'] == uid), None)
+    ref = params.get('p_payment_ref')
+    if params.get('p_payment_method') == 'wallet':
+        if user is None:
+            return {'ok': False, 'error': 'User not found'}
+        if float(user.get('wallet_balance') or 0) < float(spot['price']):
+            return {'ok': False, 'error': 'Funds too low'}
+        user['wallet_balance'] = float(user['wallet_balance']) - float(spot['price'])
+        ref = f"WALLET-{int(time.time())}"
+    spot['available'] -= 1
+    now = time.time()
+    txn = store.new_row('transactions', {
+        'user_id': uid, 'spot_id': spot['id'], 'type': 'Booking', 'amount': spot['price'],
+        'spot_name': spot.get('name'), 'payment_ref': ref, 'date': time.strftime('%Y-%m-%d'),
+        'vehicle_plate': params.get('p_vehicle_plate'), 'timestamp': now
+    })
+    store.table('transactions').append(txn)
+    session = store.new_row('sessions', {
+        'spot_id': spot['id'], 'user_name': user['name'] if user else 'Guest',
+        'vehicle_plate': params.get('p_vehicle_plate'), 'start_time': now,
+        'expiry_time': now + int(params.get('p_duration_hours') or 1) * 3600,
+        'price': spot['price'], 'payment_ref': ref
+    })
+    store.table('sessions').append(session)
+    return {'ok': True, 'spot': dict(spot), 'transaction': dict(txn), 'session': dict(session),
+            'wallet_balance': user['wallet_balance'] if user else None}
+
+@rpc('settle_topup')
+def settle_topup(store, params):
+    ref = params['p_ref']
+    txns = store.table('transactions')
+    txn = next((t for t in txns if t.get('type') == 'Deposit' and t.get('payment_ref') == ref), None)
+    if txn is not None and txn.get('credited') is not False:
+        return {'status': 'duplicate'}
+    uid = txn['user_id'] if txn else params.get('p_user_id')
+    user = next((u for u in store.table('users') if u['id'] == uid), None)
+    if user is None:
+        raise ValueError(f"settle_topup: user {uid} not found")  # nothing written, as on rollback
+    if txn is None:
+        txn = store.new_row('transactions', {
+            'user_id': uid, 'type': 'Deposit', 'amount': float(params['p_amount']), 'payment_ref': ref,
+            'date': time.strftime('%Y-%m-%d'), 'timestamp': time.time(), 'credited': False})
+        txns.append(txn)
+    user['wallet_balance'] = float(user.get('wallet_balance') or 0) + float(txn['amount'])
+    txn['credited'] = True
+    return {'status': 'credited', 'transaction': dict(txn), 'wallet_balance': user['wallet_balance']}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=54321)
+    ap.add_argument('--latency-ms', type=float, default=0.0)
+    ap.add_argument('--seed', action='store_true', help='load the legacy JSON dumps')
+    ap.add_argument('--jwt-secret', default=JWT_SECRET)
+    ap.add_argument('--token-ttl', type=int, default=3600)
+    args = ap.parse_args()
+    fake = FakeSupabase(args.host, args.port, seed=args.seed, latency_ms=args.latency_ms,
+                        jwt_secret=args.jwt_secret, token_ttl=args.token_ttl)
+    print(f"Fake Supabase listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
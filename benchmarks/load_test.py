@@ -0,0 +1,234 @@
+"""Load test: request mixes against a local Supabase stand-in.
+
+    python benchmarks/load_test.py [--mix browse] [--requests 5000] [--concurrency 16]
+                                   [--subscribers 200] [--latency-ms 2] [--out results.json]
+                                   [--compare previous.json]
+
+Boots app against benchmarks/fake_supabase.py, seeded from parking_data.json,
+users.json and transactions.json, plus --users extra wallet users. It then
+sends --requests requests, drawn from the chosen mix, through the Flask test
+client from --concurrency threads. Meanwhile --subscribers Socket.IO test
+clients sit on viewports around the seeded spots. --latency-ms delays every
+upstream call to stand in for the round trip to Supabase.
+
+It reports throughput, p50/p95/p99 latency and status codes per operation.
+Upstream calls per request come from the app's own metrics, with the fake
+server's totals as a cross-check, plus the Socket.IO messages subscribers
+received. Everything runs in one process and needs no network or Supabase
+project.
+
+--out writes the results as JSON, tagged with the current commit. --compare
+prints the change against an earlier file, so two commits can be compared
+by running the same command on each.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from fake_supabase import FakeSupabase  # noqa: E402
+
+# operation -> weight; each operation is one HTTP request
+MIXES = {
+    'browse': {'spots': 55, 'nearby': 20, 'profile': 15, 'reserve': 8, 'analytics': 2},
+    'rush': {'spots': 30, 'nearby': 10, 'profile': 15, 'reserve': 45},
+    'admin': {'spots': 35, 'analytics': 40, 'profile': 25},
+}
+ENDPOINTS = {'spots': 'get_spots', 'nearby': 'nearby_spots', 'profile': 'profile',
+             'reserve': 'reserve_spot', 'analytics': 'analytics'}
+VIEW_H, VIEW_W = 0.012, 0.02
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def seed(fake, users, bays):
+    store = fake.store
+    for s in store.table('spots'):
+        s['available'] = bays  # enough bays that reserve mostly measures the booking path
+    for i in range(users):
+        store.table('users').append({'id': f"load{i}", 'name': f"Load {i}", 'points': 0,
+                                     'tier': 'Bronze', 'wallet_balance': 1e6})
+    return [(s['id'], s['lat'], s['lng']) for s in store.table('spots')]
+
+
+def client(app, **values):
+    c = app.app.test_client()
+    with c.session_transaction() as s:
+        s.update(values)
+        s['last_active'] = time.time()
+    return c
+
+
+def run(args):
+    fake = FakeSupabase(seed=True, latency_ms=args.latency_ms).start()
+    spots = seed(fake, args.users, args.bays)
+    os.environ.update(SUPABASE_URL=fake.url, SUPABASE_KEY='load', SESSION_EXPIRY='off', RATE_LIMITS='off')
+    os.environ.pop('PAYSTACK_SECRET_KEY', None)
+    import app
+
+    rng = random.Random(args.seed)
+    subscribers = []
+    for _ in range(args.subscribers):
+        _, lat, lng = rng.choice(spots)
+        c = app.socketio.test_client(app.app)
+        c.emit('subscribe_viewport', {'south': lat - VIEW_H / 2, 'north': lat + VIEW_H / 2,
+                                      'west': lng - VIEW_W / 2, 'east': lng + VIEW_W / 2})
+        subscribers.append(c)
+    for c in subscribers:
+        c.get_received()
+
+    mix = MIXES[args.mix]
+    ops, weights = zip(*mix.items())
+    plan = rng.choices(ops, weights, k=args.requests)
+    latencies = {op: [] for op in ops}
+    statuses = {op: Counter() for op in ops}
+    lock = threading.Lock()
+    cursor = iter(range(args.requests))
+
+    def worker(n):
+        user = client(app, user_id=f"load{n % args.users}")
+        admin = client(app, admin=True)
+        r = random.Random(args.seed + n)
+        local = []
+        while True:
+            with lock:
+                i = next(cursor, None)
+            if i is None:
+                break
+            op = plan[i]
+            spot_id, lat, lng = r.choice(spots)
+            start = time.perf_counter()
+            if op == 'spots':
+                resp = user.get('/api/spots')
+            elif op == 'nearby':
+                resp = user.get(f"/api/spots/nearby?lat={lat}&lng={lng}&radius=2000")
+            elif op == 'profile':
+                resp = user.get('/api/user/profile')
+            elif op == 'reserve':
+                resp = user.post(f"/api/reserve/{spot_id}", json={
+                    'vehicle_plate': 'GR-1234-24', 'duration': 1, 'payment_method': 'wallet'})
+            else:
+                resp = admin.get('/api/analytics')
+            local.append((op, time.perf_counter() - start, resp.status_code))
+        with lock:
+            for op, took, status in local:
+                latencies[op].append(took)
+                statuses[op][status] += 1
+
+    # warm the caches and connection pool so runs compare steady state
+    warm = client(app, user_id='load0')
+    warm.get('/api/spots')
+    fake.reset_stats()
+    app.metrics.request_upstream.clear()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    received = sum(len(c.get_received()) for c in subscribers)
+    upstream_total = sum(fake.stats().values())
+    per_route = {}
+    for (endpoint, service), (calls, _) in app.metrics.request_upstream.items():
+        per_route.setdefault(endpoint, {})[service] = calls
+    fake.stop()
+
+    result = {
+        'commit': git_rev(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(args.requests / elapsed, 1),
+        'upstream_calls': upstream_total,
+        'upstream_per_request': round(upstream_total / args.requests, 3),
+        'socketio': {'subscribers': args.subscribers, 'messages': received,
+                     'per_subscriber': round(received / args.subscribers, 2) if args.subscribers else 0},
+        'operations': {},
+    }
+    for op in ops:
+        lat = latencies[op]
+        n = len(lat)
+        calls = per_route.get(ENDPOINTS[op], {}).get('supabase', 0)
+        result['operations'][op] = {
+            'requests': n,
+            'status': {str(k): v for k, v in sorted(statuses[op].items())},
+            'p50_ms': round(pct(lat, .50) * 1000, 3),
+            'p95_ms': round(pct(lat, .95) * 1000, 3),
+            'p99_ms': round(pct(lat, .99) * 1000, 3),
+            'mean_ms': round(sum(lat) / n * 1000, 3) if n else 0.0,
+            'upstream_per_request': round(calls / n, 3) if n else 0.0,
+        }
+    return result
+
+
+def report(result, previous=None):
+    print(f"commit {result['commit']}  mix {result['config']['mix']}  {result['config']['requests']} requests "
+          f"x{result['config']['concurrency']} threads, {result['config']['latency_ms']} ms upstream latency")
+    print(f"{'op':10s} {'n':>6s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'upstream':>9s}  status")
+    for op, o in result['operations'].items():
+        line = (f"{op:10s} {o['requests']:6d} {o['p50_ms']:8.2f} {o['p95_ms']:8.2f} {o['p99_ms']:8.2f} "
+                f"{o['upstream_per_request']:9.2f}  {o['status']}")
+        before = previous and previous['operations'].get(op)
+        if before and before['p95_ms']:
+            line += f"  p95 {(o['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+    line = (f"throughput {result['throughput_rps']} req/s, {result['upstream_per_request']} upstream calls/request, "
+            f"{result['socketio']['messages']} socket messages to {result['socketio']['subscribers']} subscribers")
+    if previous:
+        line += (f"  (was {previous['throughput_rps']} req/s, {previous['upstream_per_request']} calls/request"
+                 f" at {previous['commit']})")
+    print(line)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--mix', choices=sorted(MIXES), default='browse')
+    ap.add_argument('--requests', type=int, default=5000)
+    ap.add_argument('--concurrency', type=int, default=16)
+    ap.add_argument('--subscribers', type=int, default=200)
+    ap.add_argument('--users', type=int, default=100)
+    ap.add_argument('--bays', type=int, default=100000)
+    ap.add_argument('--latency-ms', type=float, default=2.0)
+    ap.add_argument('--seed', type=int, default=7)
+    ap.add_argument('--out')
+    ap.add_argument('--compare')
+    args = ap.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    result = run(args)
+    report(result, previous)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+    errors = sum(n for o in result['operations'].values() for s, n in o['status'].items() if s.startswith('5'))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
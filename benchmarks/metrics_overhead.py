@@ -0,0 +1,89 @@
+"""Per-request cost of the metrics hooks.
+
+    python benchmarks/metrics_overhead.py [--requests 5000] [--rounds 5]
+
+Runs the app twice in child processes, once with METRICS=on and once with
+METRICS=off, against benchmarks/fake_supabase.py. Each run times --requests
+calls through the Flask test client to two routes:
+- GET /api/spots, served from the spots cache with no upstream call, so
+  nearly all of the difference is the hooks themselves;
+- GET /api/admin/sessions, which makes one Supabase call per request and
+  so also pays for the upstream timing.
+The best of --rounds is kept for each. The on run also checks that the
+Server-Timing header and /metrics output are there.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+ROUTES = ('/api/spots', '/api/admin/sessions')
+
+
+def worker(n, rounds):
+    from fake_supabase import FakeSupabase
+    fake = FakeSupabase().start()
+    for i in range(200):
+        fake.store.table('spots').append(fake.store.new_row('spots', {
+            'name': f"Spot {i}", 'price': 5.0, 'available': 3, 'lat': 5.6 + i * 1e-3, 'lng': -0.18}))
+    os.environ.update(SUPABASE_URL=fake.url, SUPABASE_KEY='bench', SESSION_EXPIRY='off', RATE_LIMITS='off')
+    import app
+
+    client = app.app.test_client()
+    with client.session_transaction() as s:
+        s['admin'] = True
+        s['last_active'] = time.time()
+    result = {}
+    for route in ROUTES:
+        client.get(route)
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(n):
+                client.get(route)
+            took = (time.perf_counter() - start) / n
+            best = took if best is None else min(best, took)
+        result[route] = best
+    r = client.get('/api/admin/sessions')
+    result['server_timing'] = r.headers.get('Server-Timing')
+    body = client.get('/metrics').get_data(as_text=True)
+    result['metrics_lines'] = len(body.splitlines())
+    fake.stop()
+    print(json.dumps(result))
+
+
+def run(mode, n, rounds):
+    env = dict(os.environ, METRICS=mode)
+    out = subprocess.run([sys.executable, __file__, '--worker', '--requests', str(n), '--rounds', str(rounds)],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=5000)
+    ap.add_argument('--rounds', type=int, default=5)
+    ap.add_argument('--worker', action='store_true')
+    args = ap.parse_args()
+    if args.worker:
+        return worker(args.requests, args.rounds)
+
+    on = run('on', args.requests, args.rounds)
+    off = run('off', args.requests, args.rounds)
+    for route in ROUTES:
+        diff = (on[route] - off[route]) * 1e6
+        print(f"{route:22s} off {off[route] * 1e6:7.1f} us  on {on[route] * 1e6:7.1f} us  "
+              f"overhead {diff:+6.1f} us ({diff / (off[route] * 1e6) * 100:+.1f}%)")
+    print(f"Server-Timing: {on['server_timing']}")
+    print(f"/metrics: {on['metrics_lines']} lines (off: {off['metrics_lines']})")
+    return 0 if on['server_timing'] and not off['server_timing'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Undo history, spot cache and Socket.IO events across several app workers.
+
+    python benchmarks/multiworker_demo.py [--workers 3] [--state sqlite|local]
+
+Starts benchmarks/fake_supabase.py plus N copies of the app on consecutive
+ports, all sharing one SHARED_STATE_URL (a temporary SQLite file), the way
+gunicorn workers on one host would. It then makes writes, undos and redos
+on different workers and checks after each step that every worker serves
+the same spots list. It also checks that a Socket.IO client on the last
+worker got a data_update for each change. Run it with --state local to see
+the per-process behaviour: each worker keeps its own history and cache.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+import socketio
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from fake_supabase import FakeSupabase  # noqa: E402
+
+BASE_PORT = 5310
+
+
+def serve_worker(port):
+    sys.path.insert(0, ROOT)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    import app
+    app.socketio.run(app.app, host='127.0.0.1', port=port, allow_unsafe_werkzeug=True, log_output=False)
+
+
+def wait_up(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/api/spots", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"worker on :{port} did not start")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--workers', type=int, default=3)
+    ap.add_argument('--state', choices=['sqlite', 'local'], default='sqlite')
+    ap.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.worker:
+        return serve_worker(args.worker)
+
+    fake = FakeSupabase(seed=True).start()
+    tmp = tempfile.mkdtemp()
+    # SHARED_STATE_POLL=0: each step checks the workers agree straight after a write
+    env = dict(os.environ, SUPABASE_URL=fake.url, SUPABASE_KEY='demo', ADMIN_USER='admin', ADMIN_PASS='demo',
+               SHARED_STATE_POLL='0')
+    env.pop('SHARED_STATE_URL', None)
+    if args.state == 'sqlite':
+        env['SHARED_STATE_URL'] = f"sqlite:///{os.path.join(tmp, 'shared.db')}"
+
+    ports = [BASE_PORT + i for i in range(args.workers)]
+    procs = [subprocess.Popen([sys.executable, __file__, '--worker', str(p)], env=env, cwd=ROOT) for p in ports]
+    failures = 0
+    try:
+        for p in ports:
+            wait_up(p)
+
+        # One admin login; the session cookie is signed with the shared SECRET_KEY
+        http = requests.Session()
+        http.post(f"http://127.0.0.1:{ports[0]}/login", data={'username': 'admin', 'password': 'demo'}, allow_redirects=False)
+        cookie = '; '.join(f"{k}={v}" for k, v in http.cookies.items())
+
+        events = []
+        sio = socketio.Client()
+        sio.on('data_update', lambda data: events.append(data['type']))
+        sio.connect(f"http://127.0.0.1:{ports[-1]}", headers={'Cookie': cookie}, transports=['polling'])
+
+        def worker(i):
+            return f"http://127.0.0.1:{ports[i % len(ports)]}"
+
+        def views():
+            return [sorted(s['id'] for s in http.get(worker(i) + '/api/spots').json()) for i in range(len(ports))]
+
+        def check(step, expect_event):
+            nonlocal failures
+            seen = views()
+            consistent = all(v == seen[0] for v in seen)
+            truth = sorted(r['id'] for r in fake.store.tables['spots'])
+            deadline = time.time() + 2
+            while expect_event and expect_event not in events and time.time() < deadline:
+                time.sleep(0.05)
+            got_event = expect_event is None or expect_event in events
+            ok = consistent and seen[0] == truth and got_event
+            failures += not ok
+            print(f"{'ok ' if ok else 'BAD'} {step:<38} upstream={truth} "
+                  f"workers={'same' if consistent else seen} event={'yes' if got_event else 'missing'}")
+            events.clear()
+
+        views()  # warm every worker's cache
+        check('start', None)
+        created = http.post(worker(0) + '/api/spots', json={'name': 'Demo', 'lat': 5.6, 'lng': -0.18}).json()
+        check(f"worker 0 adds spot {created['id']}", 'spot_added')
+        victim = views()[1][0]
+        http.delete(worker(1) + f"/api/spots/{victim}")
+        check(f"worker 1 deletes spot {victim}", 'spot_deleted')
+        r = http.post(worker(2) + '/api/admin/undo').json()
+        check(f"worker 2 undo -> {r.get('op')}", 'undo' if r.get('success') else None)
+        r = http.post(worker(0) + '/api/admin/undo').json()
+        check(f"worker 0 undo -> {r.get('op')}", 'undo' if r.get('success') else None)
+        r = http.post(worker(1) + '/api/admin/redo').json()
+        check(f"worker 1 redo -> {r.get('op')}", 'redo' if r.get('success') else None)
+        sio.disconnect()
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+        fake.stop()
+    print(f"{failures} inconsistent step(s) with {args.workers} workers, state={args.state}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
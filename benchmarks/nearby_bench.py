@@ -0,0 +1,82 @@
+"""Spatial index vs linear haversine scan for nearby-spot queries.
+
+    python benchmarks/nearby_bench.py [--sizes 1000 100000 1000000] [--queries 200]
+
+Spots are scattered uniformly over a ~35 km box around Accra; each query
+asks for the 20 nearest spots within 2 km of a random point.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo import haversine, SpotIndex  # noqa: E402
+
+CENTER = (5.6037, -0.1870)
+SPAN = 0.16
+
+
+def make_spots(n, rng):
+    return [{'id': i, 'lat': CENTER[0] + rng.uniform(-SPAN, SPAN),
+             'lng': CENTER[1] + rng.uniform(-SPAN, SPAN), 'vehicle_type': 'car'}
+            for i in range(n)]
+
+
+def linear(spots, lat, lng, radius, limit):
+    hits = []
+    for s in spots:
+        d = haversine(lat, lng, s['lat'], s['lng'])
+        if d <= radius:
+            hits.append((d, s))
+    hits.sort(key=lambda x: x[0])
+    return hits[:limit]
+
+
+def timed(fn, points):
+    start = time.perf_counter()
+    out = [fn(lat, lng) for lat, lng in points]
+    return (time.perf_counter() - start) / len(points), out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    ap.add_argument('--queries', type=int, default=200)
+    ap.add_argument('--radius', type=float, default=2000)
+    ap.add_argument('--limit', type=int, default=20)
+    args = ap.parse_args()
+
+    rng = random.Random(42)
+    results = []
+    for n in args.sizes:
+        spots = make_spots(n, rng)
+        points = [(CENTER[0] + rng.uniform(-SPAN, SPAN), CENTER[1] + rng.uniform(-SPAN, SPAN))
+                  for _ in range(args.queries)]
+
+        index = SpotIndex()
+        start = time.perf_counter()
+        index.rebuild(spots)
+        build = time.perf_counter() - start
+
+        idx_t, idx_out = timed(lambda la, ln: index.nearby(la, ln, args.radius, args.limit), points)
+        # Linear scans get slow quickly; sample fewer points at large sizes
+        lin_points = points[:max(3, min(len(points), 2000000 // n))]
+        lin_t, lin_out = timed(lambda la, ln: linear(spots, la, ln, args.radius, args.limit), lin_points)
+
+        agree = all([s['id'] for _, s in a] == [s['id'] for _, s in b]
+                    for a, b in zip(idx_out, lin_out))
+        row = {'spots': n, 'build_ms': round(build * 1000, 2),
+               'index_query_ms': round(idx_t * 1000, 4),
+               'linear_query_ms': round(lin_t * 1000, 4),
+               'speedup': round(lin_t / idx_t, 1) if idx_t else None,
+               'results_match': agree}
+        results.append(row)
+        print(json.dumps(row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Concurrent bookings on one spot: the old six-call path vs reserve().
+
+    python benchmarks/reserve_stress.py [--attempts 400] [--bays 50] [--threads 64] [--latency-ms 2]
+
+Seeds benchmarks/fake_supabase.py with a single spot that has --bays free
+bays, plus --users wallet users who can each afford two bookings. It then
+fires --attempts wallet bookings at the spot from --threads threads, in
+three modes:
+
+  legacy    read spot, read user, debit wallet, decrement bay, insert txn, insert session
+  fallback  reserve() without the reserve_spot RPC (conditional updates + per-spot lock)
+  rpc       reserve() calling the reserve_spot RPC (one atomic call)
+
+Afterwards it checks the upstream tables: bookings vs bays, wallet debits vs
+booking count, and sessions vs bookings. It also reports bookings per second.
+Exits non-zero if the fallback or rpc mode oversells or mis-debits.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import fake_supabase  # noqa: E402
+
+PRICE = 10.0
+
+
+def seed(fake, bays, users):
+    store = fake.store
+    store.tables = {'spots': [], 'users': [], 'transactions': [], 'sessions': []}
+    store.next_id.clear()
+    store.table('spots').append(store.new_row('spots', {
+        'name': 'Last Bay', 'price': PRICE, 'available': bays, 'lat': 5.6, 'lng': -0.18,
+        'vehicle_type': 'car', 'owner_id': 'admin'}))
+    for i in range(users):
+        store.table('users').append({'id': f"u{i}", 'name': f"Driver {i}", 'points': 0,
+                                     'tier': 'Bronze', 'wallet_balance': PRICE * 2})
+    return store.tables['spots'][0]['id']
+
+
+def legacy_reserve(app, spot_id, uid):
+    # reserve_spot() as it was: six independent calls, no locking
+    spot = app.get_spot_by_id(spot_id)
+    if not spot or spot['available'] < 1: return False
+    user = app.get_user_by_id(uid)
+    if float(user['wallet_balance']) < spot['price']: return False
+    app.update_user(uid, {'wallet_balance': float(user['wallet_balance']) - spot['price']})
+    app.update_spot(spot_id, {'available': spot['available'] - 1})
+    app.create_transaction({'user_id': uid, 'spot_id': spot_id, 'type': 'Booking', 'amount': spot['price'],
+                            'spot_name': spot['name'], 'payment_ref': 'WALLET', 'date': time.strftime("%Y-%m-%d"),
+                            'timestamp': time.time()})
+    app.create_session({'spot_id': spot_id, 'user_name': user['name'], 'start_time': time.time(),
+                        'expiry_time': time.time() + 3600, 'price': spot['price'], 'payment_ref': 'WALLET'})
+    return True
+
+
+def run(app, fake, mode, args):
+    spot_id = seed(fake, args.bays, args.users)
+    app.spots_cache.invalidate()
+    app.user_cache.invalidate()
+    app._reserve_rpc = True
+    rpc = fake_supabase.RPCS.pop('reserve_spot', None) if mode == 'fallback' else None
+
+    def book(i):
+        uid = f"u{i % args.users}"
+        with app.app.test_request_context():
+            if mode == 'legacy':
+                return legacy_reserve(app, spot_id, uid)
+            spot = app.get_spot_by_id(spot_id)
+            if not spot or spot['available'] < 1: return False
+            return app.reserve(spot, uid, 'GR-1234-24', 1, 'wallet')['ok']
+
+    fake.reset_stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        accepted = sum(pool.map(book, range(args.attempts)))
+    elapsed = time.perf_counter() - start
+    if rpc:
+        fake_supabase.RPCS['reserve_spot'] = rpc
+
+    store = fake.store
+    bookings = sum(1 for t in store.table('transactions') if t['type'] == 'Booking')
+    sessions = len(store.table('sessions'))
+    debited = sum(PRICE * 2 - float(u['wallet_balance']) for u in store.table('users'))
+    left = store.table('spots')[0]['available']
+    ok = (bookings <= args.bays and left == args.bays - bookings and sessions == bookings
+          and abs(debited - bookings * PRICE) < 1e-6 and accepted == bookings)
+    print(f"{mode:>9} {accepted:>8} {bookings:>8} {args.bays - left:>6} {sessions:>8} {debited / PRICE:>8.0f} "
+          f"{bookings / elapsed:>9.1f} {sum(fake.stats().values()) / max(accepted, 1):>9.1f}  {'ok' if ok else 'OVERSOLD/INCONSISTENT'}")
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--attempts', type=int, default=400)
+    ap.add_argument('--bays', type=int, default=50)
+    ap.add_argument('--users', type=int, default=40)
+    ap.add_argument('--threads', type=int, default=64)
+    ap.add_argument('--latency-ms', type=float, default=2.0)
+    args = ap.parse_args()
+
+    fake = fake_supabase.FakeSupabase(latency_ms=args.latency_ms).start()
+    os.environ['SUPABASE_URL'] = fake.url
+    os.environ['SUPABASE_KEY'] = 'bench'
+    os.environ.setdefault('HTTP_POOL_MAXSIZE', str(args.threads))
+    import app
+
+    print(f"{args.attempts} attempts, {args.bays} bays, {args.users} users x 2 bookings of credit, {args.threads} threads")
+    print(f"{'mode':>9} {'accepted':>8} {'bookings':>8} {'bays':>6} {'sessions':>8} {'debits':>8} {'booked/s':>9} {'req/book':>9}")
+    results = {mode: run(app, fake, mode, args) for mode in ('legacy', 'fallback', 'rpc')}
+    fake.stop()
+    return 0 if results['fallback'] and results['rpc'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Socket.IO fan-out cost: viewport rooms vs the old broadcast-to-everyone.
+
+    python benchmarks/socket_fanout.py [--clients 1000] [--updates 500]
+
+Connects many in-process Socket.IO test clients, each subscribed to a
+street-level viewport somewhere in a ~35 km box around Accra, then pushes
+spot updates through app.emit_data_update and counts what every client
+receives. The same updates are then sent with a plain broadcast for
+comparison. No Supabase access is needed.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+CENTER = (5.6037, -0.1870)
+SPAN = 0.16
+VIEW_H, VIEW_W = 0.012, 0.02   # roughly zoom 15 on a phone
+
+
+def drain(clients):
+    msgs = size = 0
+    for c in clients:
+        for packet in c.get_received():
+            msgs += 1
+            size += len(json.dumps(packet['args']))
+    return msgs, size
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--clients', type=int, default=1000)
+    ap.add_argument('--spots', type=int, default=2000)
+    ap.add_argument('--updates', type=int, default=500)
+    args = ap.parse_args()
+    rng = random.Random(3)
+
+    spots = [{'id': i, 'lat': CENTER[0] + rng.uniform(-SPAN, SPAN),
+              'lng': CENTER[1] + rng.uniform(-SPAN, SPAN), 'available': 5}
+             for i in range(args.spots)]
+    with app.app.test_request_context():
+        app._record_spot_changes(spots, log=False)  # seed known rows
+
+    clients = []
+    start = time.perf_counter()
+    for _ in range(args.clients):
+        c = app.socketio.test_client(app.app)
+        lat = CENTER[0] + rng.uniform(-SPAN, SPAN)
+        lng = CENTER[1] + rng.uniform(-SPAN, SPAN)
+        c.emit('subscribe_viewport', {'south': lat - VIEW_H / 2, 'north': lat + VIEW_H / 2,
+                                      'west': lng - VIEW_W / 2, 'east': lng + VIEW_W / 2})
+        clients.append(c)
+    connect_s = time.perf_counter() - start
+    drain(clients)
+
+    updates = [dict(rng.choice(spots)) for _ in range(args.updates)]
+    for u in updates:
+        u['available'] = rng.randint(0, 9)
+
+    # Viewport rooms
+    start = time.perf_counter()
+    for u in updates:
+        with app.app.test_request_context():
+            app._record_spot_changes([dict(u)])
+            app.emit_data_update('spot_updated')
+    rooms_s = time.perf_counter() - start
+    rooms_msgs, rooms_bytes = drain(clients)
+
+    # Old behaviour: every client hears about every update
+    start = time.perf_counter()
+    for u in updates:
+        app.socketio.emit('data_update', {'type': 'spot_updated', 'rev': 0, 'resync': False,
+                                          'changes': [{'op': 'upsert', 'id': u['id'], 'fields': {'available': u['available']}}]})
+    bcast_s = time.perf_counter() - start
+    bcast_msgs, bcast_bytes = drain(clients)
+
+    for c in clients:
+        c.disconnect()
+
+    print(json.dumps({
+        'clients': args.clients, 'updates': args.updates,
+        'subscribe_ms_per_client': round(connect_s * 1000 / args.clients, 3),
+        'rooms': {'messages': rooms_msgs, 'bytes': rooms_bytes,
+                  'emit_ms_per_update': round(rooms_s * 1000 / args.updates, 3)},
+        'broadcast': {'messages': bcast_msgs, 'bytes': bcast_bytes,
+                      'emit_ms_per_update': round(bcast_s * 1000 / args.updates, 3)},
+        'message_reduction': round(bcast_msgs / rooms_msgs, 1) if rooms_msgs else None
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""GET /api/spots: jsonify per request vs pre-serialized payloads.
+
+    python benchmarks/spots_payload_bench.py [--spots 2000] [--requests 2000]
+
+Seeds benchmarks/fake_supabase.py with --spots spots that look like the real
+rows, image URLs included. Every variant is served from the warm spots
+cache, so only serialization, compression and transfer size differ.
+Compares:
+  before        jsonify(get_all_spots()), what the route did before
+  identity      pre-serialized body, no compression
+  gzip          Accept-Encoding: gzip
+  map fields    ?fields=id,lat,lng,available,price with gzip
+  304           If-None-Match with the ETag from a previous response
+Reports bytes on the wire and requests/second through the Flask test
+client. It also checks that the bodies decode to the same rows and that a
+write changes the ETag.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_supabase import FakeSupabase  # noqa: E402
+
+
+def seed(fake, n):
+    rng = random.Random(5)
+    for i in range(n):
+        fake.store.table('spots').append(fake.store.new_row('spots', {
+            'name': f"Spot {i}", 'price': rng.choice([5.0, 8.0, 15.0, 45.0]), 'available': rng.randint(0, 20),
+            'lat': 5.6 + rng.uniform(-0.15, 0.15), 'lng': -0.18 + rng.uniform(-0.15, 0.15),
+            'image_url': f"https://images.example.com/parking/{rng.getrandbits(64):016x}/large-photo-{i}.jpg",
+            'trust_level': 3, 'vehicle_type': 'car', 'qr_code_id': f"PW-{rng.getrandbits(32):08X}",
+            'unavailable_dates': [], 'unavailable_days': [], 'unavailable_reason': '', 'amenities': ['cctv'],
+            'is_premium': rng.random() < 0.2, 'owner_lat': None, 'owner_lng': None, 'owner_id': 'admin'}))
+
+
+def bench(client, path, headers, n):
+    r = client.get(path, headers=headers)
+    size = len(r.data)
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get(path, headers=headers)
+    return r, size, n / (time.perf_counter() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--spots', type=int, default=2000)
+    ap.add_argument('--requests', type=int, default=2000)
+    args = ap.parse_args()
+
+    fake = FakeSupabase().start()
+    seed(fake, args.spots)
+    os.environ.update(SUPABASE_URL=fake.url, SUPABASE_KEY='bench', SESSION_EXPIRY='off', METRICS='off', RATE_LIMITS='off')
+    import app
+    import payload
+
+    app.app.add_url_rule('/bench/spots_before', 'spots_before', lambda: app.jsonify(app.get_all_spots()))
+    client = app.app.test_client()
+    client.get('/api/spots')
+
+    first = client.get('/api/spots', headers={'Accept-Encoding': 'gzip'})
+    variants = [
+        ('before', '/bench/spots_before', {'Accept-Encoding': 'gzip'}),
+        ('identity', '/api/spots', {}),
+        ('gzip', '/api/spots', {'Accept-Encoding': 'gzip'}),
+        ('map fields', '/api/spots?fields=id,lat,lng,available,price', {'Accept-Encoding': 'gzip'}),
+        ('304', '/api/spots', {'Accept-Encoding': 'gzip', 'If-None-Match': first.headers['ETag']}),
+    ]
+    print(f"{args.spots} spots, {args.requests} requests per variant, encoder: "
+          f"{'orjson' if payload.orjson else 'json'}, brotli: {'yes' if payload.brotli else 'no'}")
+    base = None
+    for name, path, headers in variants:
+        r, size, rps = bench(client, path, headers, args.requests)
+        base = base or (size, rps)
+        print(f"{name:11s} {r.status_code}  {size:9d} bytes ({size / base[0] * 100:5.1f}%)  {rps:8.0f} req/s "
+              f"(x{rps / base[1]:.1f})")
+
+    failures = []
+    before = json.loads(client.get('/bench/spots_before').data)
+    after = json.loads(gzip.decompress(first.data))
+    if sorted(before, key=lambda s: s['id']) != sorted(after, key=lambda s: s['id']):
+        failures.append('gzip body differs from jsonify output')
+    spot = app.get_all_spots()[0]
+    with app.app.test_request_context():
+        app.update_spot(spot['id'], {'available': spot['available'] + 1})
+    r = client.get('/api/spots', headers={'Accept-Encoding': 'gzip', 'If-None-Match': first.headers['ETag']})
+    if r.status_code != 200 or r.headers['ETag'] == first.headers['ETag']:
+        failures.append('ETag unchanged after a write')
+    fake.stop()
+    for f in failures:
+        print(f"BAD {f}")
+    print(f"{len(failures)} failed check(s)")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Surge test: bookings under a flood of map, profile and analytics reads.
+
+    python benchmarks/surge_bench.py [--flood 48] [--bookers 4] [--seconds 5]
+                                     [--limit 8] [--latency-ms 40]
+
+Runs against benchmarks/fake_supabase.py, with --latency-ms delay on every
+upstream call and a --limit connection pool. --flood threads loop over
+GET /api/spots (cache TTL 0), /api/user/profile and /api/analytics. At the
+same time, --bookers threads book bays with their wallets through
+POST /api/reserve/<id>. This runs twice:
+  off  no admission gate: every call queues for a pooled connection
+  on   admission.AdmissionGate with --limit slots
+Rate limits are off for both runs. For each run it reports p50/p99 and
+status codes for bookings and for flood requests, plus the gate's counters.
+Then it checks:
+- with the gate on, every booking succeeds and booking p99 beats the run
+  without it;
+- shed requests answer 503 with Retry-After;
+- with rate limits back on, one client hammering /api/spots gets its burst
+  through and then 429s with Retry-After, while another client is still
+  served.
+Exits non-zero if any check fails.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_supabase import FakeSupabase  # noqa: E402
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def client(app, **values):
+    c = app.app.test_client()
+    with c.session_transaction() as s:
+        s.update(values)
+        s['last_active'] = time.time()
+    return c
+
+
+def seed(fake, bookers, bays):
+    store = fake.store
+    store.tables = {'spots': [], 'users': [], 'transactions': [], 'sessions': []}
+    store.next_id.clear()
+    for i in range(20):
+        store.table('spots').append(store.new_row('spots', {
+            'name': f"Spot {i}", 'price': 5.0, 'available': bays, 'lat': 5.6 + i * 1e-3, 'lng': -0.18}))
+    for i in range(bookers + 1):
+        store.table('users').append({'id': f"u{i}", 'name': f"Driver {i}", 'points': 0,
+                                     'tier': 'Bronze', 'wallet_balance': 1e6})
+    for i in range(200):
+        store.table('transactions').append(store.new_row('transactions', {
+            'user_id': f"u{i % (bookers + 1)}", 'spot_id': 1, 'type': 'Booking', 'amount': 5.0,
+            'spot_name': 'Spot 0', 'date': time.strftime('%Y-%m-%d'), 'timestamp': time.time()}))
+    return [s['id'] for s in store.table('spots')]
+
+
+def run(app, fake, gate, args):
+    spot_ids = seed(fake, args.bookers, 100000)
+    app.spots_cache.invalidate()
+    app.remote.http.gate = gate
+    stop = threading.Event()
+    results = {'booking': [], 'flood': []}
+    lock = threading.Lock()
+
+    def record(kind, r, took):
+        with lock:
+            results[kind].append((r.status_code, took, r.headers.get('Retry-After')))
+
+    def flood(i):
+        c = client(app, user_id=f"u{args.bookers}", admin=True)
+        paths = ('/api/spots', '/api/user/profile', '/api/analytics')
+        n = i
+        while not stop.is_set():
+            start = time.perf_counter()
+            r = c.get(paths[n % len(paths)])
+            record('flood', r, time.perf_counter() - start)
+            n += 1
+
+    def book(i):
+        c = client(app, user_id=f"u{i}")
+        n = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            r = c.post(f"/api/reserve/{spot_ids[n % len(spot_ids)]}",
+                       json={'payment_method': 'wallet', 'vehicle_plate': 'GR-1234-24', 'duration': 1})
+            record('booking', r, time.perf_counter() - start)
+            n += 1
+            stop.wait(args.pause)
+
+    threads = [threading.Thread(target=flood, args=(i,)) for i in range(args.flood)]
+    threads += [threading.Thread(target=book, args=(i,)) for i in range(args.bookers)]
+    for t in threads:
+        t.start()
+    stop.wait(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return results
+
+
+def summary(rows):
+    codes = Counter(code for code, _, _ in rows)
+    lat = [t for _, t, _ in rows]
+    return (f"{len(rows):6d} requests  p50 {pct(lat, .5) * 1000:7.1f} ms  p99 {pct(lat, .99) * 1000:7.1f} ms  "
+            f"{dict(sorted(codes.items()))}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--flood', type=int, default=48)
+    ap.add_argument('--bookers', type=int, default=4)
+    ap.add_argument('--seconds', type=float, default=5.0)
+    ap.add_argument('--limit', type=int, default=8)
+    ap.add_argument('--latency-ms', type=float, default=40.0)
+    ap.add_argument('--pause', type=float, default=0.1, help='seconds each booker waits between bookings')
+    args = ap.parse_args()
+
+    fake = FakeSupabase(latency_ms=args.latency_ms).start()
+    os.environ.update(SUPABASE_URL=fake.url, SUPABASE_KEY='bench', SESSION_EXPIRY='off', METRICS='off',
+                      SPOTS_CACHE_TTL='0', HTTP_POOL_MAXSIZE=str(args.limit), UPSTREAM_MAX_INFLIGHT=str(args.limit))
+    os.environ.pop('PAYSTACK_SECRET_KEY', None)
+    import app
+    from admission import AdmissionGate
+
+    failures = []
+
+    def check(name, ok, detail=''):
+        print(f"{'ok ' if ok else 'BAD'} {name} {detail}")
+        if not ok: failures.append(name)
+
+    limiter, app.rate_limiter = app.rate_limiter, None
+    print(f"{args.flood} flood threads, {args.bookers} bookers, {args.limit} upstream slots, "
+          f"{args.latency_ms} ms upstream latency, {args.seconds}s per run")
+    runs = {}
+    for label in ('off', 'on'):
+        gate = None
+        if label == 'on':
+            gate = AdmissionGate(args.limit, waits=app.upstream_gate.waits, priority=app.upstream_priority)
+        runs[label] = run(app, fake, gate, args)
+        print(f"gate {label}")
+        print(f"  bookings {summary(runs[label]['booking'])}")
+        print(f"  flood    {summary(runs[label]['flood'])}")
+        if gate:
+            stats = gate.stats()
+            print(f"  admitted {stats['admitted']}  shed {stats['shed']}  peak {stats['peak']}")
+            check('gate never exceeds its limit', stats['peak'] <= args.limit, f"peak={stats['peak']}")
+
+    on, off = runs['on'], runs['off']
+    booked = [code for code, _, _ in on['booking']]
+    check('every booking succeeds with the gate on', booked and all(code == 200 for code in booked),
+          str(dict(Counter(booked))))
+    p99_on, p99_off = pct([t for _, t, _ in on['booking']], .99), pct([t for _, t, _ in off['booking']], .99)
+    check('booking p99 lower with the gate on', p99_on < p99_off,
+          f"{p99_on * 1000:.1f} ms vs {p99_off * 1000:.1f} ms")
+    shed = [(code, retry) for code, _, retry in on['flood'] if code == 503]
+    check('flood is shed with 503 + Retry-After', shed and all(retry for _, retry in shed), f"{len(shed)} shed")
+
+    # Rate limits: one client over its burst, another unaffected
+    app.rate_limiter = limiter
+    app.remote.http.gate = None
+    app.spots_cache.ttl = 30
+    rate, burst = limiter.rules['read']
+    greedy = client(app, user_id='greedy')
+    greedy.get('/api/spots')
+    start = time.monotonic()
+    codes = [greedy.get('/api/spots') for _ in range(int(burst) + 20)]
+    allowance = burst + rate * (time.monotonic() - start)
+    limited = [r for r in codes if r.status_code == 429]
+    served = len(codes) - len(limited)
+    check('client over its burst gets 429 + Retry-After',
+          limited and served <= allowance and all(r.headers.get('Retry-After') for r in limited),
+          f"{served} served (allowance {allowance:.1f}), {len(limited)} limited")
+    check('other clients still served', client(app, user_id='polite').get('/api/spots').status_code == 200)
+
+    fake.stop()
+    print(f"{len(failures)} failed check(s)")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Undo latency: full-table snapshots with per-row restore vs per-operation diffs.
+
+    python benchmarks/undo_bench.py [--sizes 100,1000,10000] [--latency-ms 1]
+
+For each table size, seeds benchmarks/fake_supabase.py with that many spots,
+deletes one spot through the app helpers and undoes it twice: once the old
+way (snapshot the whole table beforehand, then PATCH/POST/DELETE row by row
+to match it) and once with push_undo()/undo_last(). Reports wall time and
+upstream requests for each. --latency-ms adds a per-request delay to stand
+in for the network round trip to Supabase.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_supabase import FakeSupabase  # noqa: E402
+
+CENTER = (5.6037, -0.1870)
+
+
+def legacy_snapshot(app):
+    return app.get_all_spots()
+
+
+def legacy_restore(app, snapshot):
+    # restore_snapshot() as it was before diff-based history
+    current_ids = {s['id'] for s in app.get_all_spots()}
+    snapshot_ids = {s['id'] for s in snapshot}
+    for spot in snapshot:
+        clean = spot.copy()
+        if 'created_at' in clean: del clean['created_at']
+        if spot['id'] in current_ids:
+            app.update_spot(spot['id'], clean)
+        else:
+            app.create_spot(clean)
+    for cid in current_ids:
+        if cid not in snapshot_ids:
+            app.delete_spot_db(cid)
+
+
+def seed(fake, n, rng):
+    rows = fake.store.tables['spots'] = []
+    fake.store.next_id.clear()
+    for _ in range(n):
+        rows.append(fake.store.new_row('spots', {
+            'name': 'Spot', 'price': 5.0, 'available': 3, 'trust_level': 3,
+            'lat': CENTER[0] + rng.uniform(-0.1, 0.1), 'lng': CENTER[1] + rng.uniform(-0.1, 0.1),
+            'vehicle_type': 'car', 'amenities': [], 'image_url': '', 'is_premium': False,
+            'qr_code_id': 'PW-BENCH', 'owner_id': 'admin'
+        }))
+
+
+def requests_made(fake):
+    return sum(fake.stats().values())
+
+
+def run(app, fake, n, rng):
+    out = {}
+    for mode in ('legacy', 'diff'):
+        seed(fake, n, rng)
+        app.spots_cache.invalidate()
+        app.get_all_spots()
+        victim = rng.choice(app.get_all_spots())['id']
+        fake.reset_stats()
+
+        start = time.perf_counter()
+        if mode == 'legacy':
+            snap = legacy_snapshot(app)
+        else:
+            before = app.get_spot_by_id(victim)
+        app.delete_spot_db(victim)
+        if mode == 'diff':
+            app.push_undo('spot_deleted', before=[before])
+        record_s = time.perf_counter() - start
+        record_reqs = requests_made(fake)
+
+        fake.reset_stats()
+        start = time.perf_counter()
+        if mode == 'legacy':
+            legacy_restore(app, snap)
+        else:
+            app.undo_last()
+        undo_s = time.perf_counter() - start
+        # The legacy path re-inserts deleted rows under a fresh id (create_spot drops it)
+        assert len(fake.store.tables['spots']) == n, 'undo did not restore the row'
+        out[mode] = (record_s, record_reqs, undo_s, requests_made(fake))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='100,1000,10000')
+    ap.add_argument('--latency-ms', type=float, default=1.0)
+    args = ap.parse_args()
+
+    fake = FakeSupabase(latency_ms=args.latency_ms).start()
+    os.environ['SUPABASE_URL'] = fake.url
+    os.environ['SUPABASE_KEY'] = 'bench'
+    import app
+    rng = random.Random(7)
+
+    print(f"{'spots':>7} {'mode':>7} {'record ms':>10} {'reqs':>6} {'undo ms':>10} {'reqs':>6}")
+    with app.app.test_request_context():
+        for n in [int(x) for x in args.sizes.split(',')]:
+            for mode, (rec_s, rec_q, undo_s, undo_q) in run(app, fake, n, rng).items():
+                print(f"{n:>7} {mode:>7} {rec_s * 1000:>10.1f} {rec_q:>6} {undo_s * 1000:>10.1f} {undo_q:>6}")
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
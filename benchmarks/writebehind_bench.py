@@ -0,0 +1,141 @@
+"""Booking latency with write-behind inserts on and off.
+
+    python benchmarks/writebehind_bench.py [--bookings 400] [--threads 16] [--latency-ms 5]
+
+Books --bookings bays through reserve() against benchmarks/fake_supabase.py,
+once with each transaction/session inserted on the request path and once
+through writebehind.WriteBehindQueue. The reserve_spot RPC is removed, so
+bookings take the fallback path that makes those inserts. Reports per-booking
+latency and upstream requests per booking (after the queue has flushed).
+Then checks:
+- every booking has exactly one transaction and one session upstream;
+- rows spooled by a queue that never flushed (a crashed worker) are sent
+  by the next queue opened on the same file;
+- resending a batch that already landed inserts nothing.
+Exits non-zero if any check fails.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import fake_supabase  # noqa: E402
+
+PRICE = 5.0
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def seed(fake, spots, users):
+    store = fake.store
+    store.tables = {'spots': [], 'users': [], 'transactions': [], 'sessions': []}
+    store.next_id.clear()
+    for i in range(spots):
+        store.table('spots').append(store.new_row('spots', {
+            'name': f"Spot {i}", 'price': PRICE, 'available': 10000, 'lat': 5.6 + i * 1e-3, 'lng': -0.18}))
+    for i in range(users):
+        store.table('users').append({'id': f"u{i}", 'name': f"Driver {i}", 'points': 0,
+                                     'tier': 'Bronze', 'wallet_balance': 1e6})
+    return [s['id'] for s in store.table('spots')]
+
+
+def run(app, fake, queue, args):
+    spot_ids = seed(fake, args.spots, args.users)
+    app.spots_cache.invalidate()
+    app.write_behind = queue
+    if queue:
+        queue.start()
+
+    def book(i):
+        with app.app.test_request_context():
+            start = time.perf_counter()
+            spot = app.get_spot_by_id(spot_ids[i % len(spot_ids)])
+            ok = app.reserve(spot, f"u{i % args.users}", 'GR-1234-24', 1, 'wallet')['ok']
+            return ok, time.perf_counter() - start
+
+    app.get_all_spots()
+    fake.reset_stats()
+    with ThreadPoolExecutor(args.threads) as pool:
+        results = list(pool.map(book, range(args.bookings)))
+    left = queue.close() if queue else 0
+    app.write_behind = None
+    calls = sum(fake.stats().values())
+    lat = [t for _, t in results]
+    booked = sum(ok for ok, _ in results)
+    store = fake.store
+    txns = [t for t in store.table('transactions') if t['type'] == 'Booking']
+    sessions = store.table('sessions')
+    consistent = (booked == args.bookings and left == 0 and len(txns) == booked and len(sessions) == booked
+                  and len({t['id'] for t in txns}) == len(txns))
+    return {'booked': booked, 'p50': pct(lat, .5), 'p95': pct(lat, .95), 'calls': calls / max(booked, 1),
+            'txns': len(txns), 'sessions': len(sessions), 'consistent': consistent,
+            'stats': queue.stats() if queue else None}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--bookings', type=int, default=400)
+    ap.add_argument('--threads', type=int, default=16)
+    ap.add_argument('--spots', type=int, default=50)
+    ap.add_argument('--users', type=int, default=200)
+    ap.add_argument('--latency-ms', type=float, default=5.0)
+    ap.add_argument('--batch', type=int, default=100)
+    ap.add_argument('--delay', type=float, default=0.05)
+    args = ap.parse_args()
+
+    fake = fake_supabase.FakeSupabase(latency_ms=args.latency_ms).start()
+    os.environ.update(SUPABASE_URL=fake.url, SUPABASE_KEY='bench', SESSION_EXPIRY='off',
+                      HTTP_POOL_MAXSIZE=str(args.threads * 2))
+    fake_supabase.RPCS.pop('reserve_spot', None)
+    import app
+    from writebehind import WriteBehindQueue
+
+    tmp = tempfile.mkdtemp()
+    failures = []
+
+    def check(name, ok, detail=''):
+        print(f"{'ok ' if ok else 'BAD'} {name} {detail}")
+        if not ok: failures.append(name)
+
+    print(f"{args.bookings} bookings, {args.threads} threads, {args.latency_ms} ms upstream latency")
+    for label, queue in (('off', None),
+                         ('on', WriteBehindQueue(os.path.join(tmp, 'spool.db'), app._insert_rows,
+                                                 batch=args.batch, delay=args.delay))):
+        r = run(app, fake, queue, args)
+        print(f"write-behind {label:3s}  p50 {r['p50'] * 1000:6.1f} ms  p95 {r['p95'] * 1000:6.1f} ms  "
+              f"{r['calls']:.2f} upstream requests/booking  {r['stats'] or ''}")
+        check(f"write-behind {label}: one transaction and session per booking", r['consistent'],
+              f"booked={r['booked']} txns={r['txns']} sessions={r['sessions']}")
+
+    # A worker that spooled rows and died before flushing
+    seed(fake, 1, 1)
+    path = os.path.join(tmp, 'crash.db')
+    crashed = WriteBehindQueue(path, app._insert_rows)
+    rows = [crashed.add('sessions', {'spot_id': 1, 'user_name': 'Ghost', 'start_time': time.time(),
+                                     'expiry_time': time.time() + 3600}) for _ in range(25)]
+    recovered = WriteBehindQueue(path, app._insert_rows, delay=0.01).start()
+    deadline = time.time() + 10
+    while recovered.pending() and time.time() < deadline:
+        time.sleep(0.05)
+    recovered.close()
+    check('spooled rows survive a crash', len(fake.store.table('sessions')) == 25,
+          f"sessions={len(fake.store.table('sessions'))}")
+    app._insert_rows('sessions', rows)
+    check('resent batch is ignored', len(fake.store.table('sessions')) == 25)
+
+    fake.stop()
+    print(f"{len(failures)} failed check(s)")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""Streaming CSV/NDJSON for bulk spot imports and admin exports.
+
+read_records() decodes an upload one line at a time, so an import never
+holds the whole body. spot_row() turns one new-spot record into a complete
+spots row: every row carries the same keys, which PostgREST bulk inserts
+need, and fields the record leaves out get the same defaults as POST
+/api/spots. Records with an id give partial rows, for updates.
+ndjson_lines() and csv_lines() encode rows as they arrive from a paginated
+read, so an export runs in constant memory however many rows it covers.
+
+In CSV, list columns (amenities, unavailable_*) are JSON arrays; a plain
+string is also accepted on import and split on ';'.
+"""
+import csv
+import io
+import json
+import math
+import uuid
+
+from payload import dumps
+
+SPOT_COLUMNS = ('id', 'name', 'price', 'available', 'lat', 'lng', 'image_url', 'trust_level', 'vehicle_type',
+                'amenities', 'is_premium', 'qr_code_id', 'owner_id', 'unavailable_dates', 'unavailable_days',
+                'unavailable_reason', 'created_at')
+TRANSACTION_COLUMNS = ('id', 'created_at', 'date', 'timestamp', 'type', 'amount', 'user_id', 'user_name',
+                       'spot_id', 'spot_name', 'payment_ref', 'vehicle_plate')
+LIST_COLUMNS = frozenset(['amenities', 'unavailable_dates', 'unavailable_days'])
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def detect_format(fmt, content_type):
+    """'csv' or 'ndjson' from ?format= or the Content-Type; None if neither says."""
+    if fmt:
+        return fmt if fmt in FORMATS else None
+    ctype = (content_type or '').split(';', 1)[0].strip().lower()
+    if ctype in ('text/csv', 'application/csv'):
+        return 'csv'
+    if ctype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/json'):
+        return 'ndjson'
+    return None
+
+
+def _lines(stream):
+    first = True
+    for raw in stream:
+        line = raw.decode('utf-8')
+        if first:
+            line, first = line.lstrip('\ufeff'), False
+        yield line
+
+
+def read_records(stream, fmt):
+    """Yield (line number, record or None, error or None) for each record in `stream`."""
+    if fmt == 'csv':
+        reader = csv.DictReader(_lines(stream))
+        try:
+            for rec in reader:
+                if None in rec:
+                    yield reader.line_num, None, 'more values than header columns'
+                    continue
+                yield reader.line_num, rec, None
+        except csv.Error as e:
+            yield reader.line_num, None, f"invalid CSV: {e}"
+        return
+    for n, line in enumerate(_lines(stream), 1):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError as e:
+            yield n, None, f"invalid JSON: {e}"
+            continue
+        if not isinstance(rec, dict):
+            yield n, None, 'each line must be a JSON object'
+            continue
+        yield n, rec, None
+
+
+def _value(rec, key):
+    v = rec.get(key)
+    return None if v is None or (isinstance(v, str) and not v.strip()) else v
+
+
+def _number(rec, key, cast, default, lo=None, hi=None):
+    v = _value(rec, key)
+    if v is None:
+        if default is None:
+            raise ValueError(f"{key} is required")
+        return default
+    try:
+        v = cast(v.strip() if isinstance(v, str) else v)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be a number")
+    if isinstance(v, float) and not math.isfinite(v):
+        raise ValueError(f"{key} must be a number")
+    if (lo is not None and v < lo) or (hi is not None and v > hi):
+        raise ValueError(f"{key} out of range")
+    return v
+
+
+def _int(v):
+    if isinstance(v, bool):
+        raise ValueError
+    if isinstance(v, float):
+        if not v.is_integer():
+            raise ValueError
+        return int(v)
+    return int(v)
+
+
+def _list(rec, key):
+    v = _value(rec, key)
+    if v is None:
+        return []
+    if isinstance(v, str):
+        v = v.strip()
+        if v.startswith('['):
+            try:
+                v = json.loads(v)
+            except ValueError:
+                raise ValueError(f"{key} is not a valid JSON array")
+        else:
+            return [part.strip() for part in v.split(';') if part.strip()]
+    if not isinstance(v, list):
+        raise ValueError(f"{key} must be a list")
+    return v
+
+
+def _bool(rec, key):
+    v = _value(rec, key)
+    if isinstance(v, str):
+        return v.strip().lower() in ('1', 'true', 'yes', 'y', 't')
+    return bool(v)
+
+
+def spot_row(rec, owner='admin'):
+    """(row, None) for a valid record, else (None, error message).
+
+    A record with an id updates that spot: the row holds the id and only
+    the fields the record fills in (a blank CSV cell counts as left out),
+    so the rest of the spot keeps its values.
+    """
+    update = _value(rec, 'id') is not None
+    try:
+        row = {
+            'name': str(_value(rec, 'name') or 'Unnamed')[:200],
+            'price': _number(rec, 'price', float, 0.0, lo=0),
+            'available': _number(rec, 'available', _int, 1, lo=0),
+            'lat': _number(rec, 'lat', float, 0.0 if update else None, -90, 90),
+            'lng': _number(rec, 'lng', float, 0.0 if update else None, -180, 180),
+            'trust_level': _number(rec, 'trust_level', _int, 3, lo=0),
+            'image_url': str(_value(rec, 'image_url') or ''),
+            'vehicle_type': str(_value(rec, 'vehicle_type') or 'car'),
+            'amenities': _list(rec, 'amenities'),
+            'is_premium': _bool(rec, 'is_premium'),
+            'qr_code_id': str(_value(rec, 'qr_code_id') or f"PW-{str(uuid.uuid4())[:8].upper()}"),
+            'owner_id': str(_value(rec, 'owner_id') or owner),
+            'unavailable_dates': _list(rec, 'unavailable_dates'),
+            'unavailable_days': _list(rec, 'unavailable_days'),
+            'unavailable_reason': str(_value(rec, 'unavailable_reason') or '')
+        }
+        if update:
+            row = {'id': _number(rec, 'id', _int, None, lo=1),
+                   **{k: v for k, v in row.items() if _value(rec, k) is not None}}
+    except ValueError as e:
+        return None, str(e)
+    return row, None
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield dumps(row) + b'\n'
+
+
+def csv_lines(rows, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def line(values):
+        writer.writerow(values)
+        out = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return out.encode()
+
+    yield line(columns)
+    for row in rows:
+        yield line([json.dumps(row.get(c)) if c in LIST_COLUMNS or isinstance(row.get(c), (list, dict))
+                    else ('' if row.get(c) is None else row.get(c)) for c in columns])
@@ -0,0 +1,221 @@
+from collections import deque
+import threading
+import time
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ReadThroughCache:
+    """Keyed TTL cache with single-flight loading.
+
+    Concurrent misses for the same key share one call to the loader; the
+    other callers block on it and count as "coalesced". Loaders signal a
+    failed upstream read by returning None, which is handed back to the
+    callers but never stored. A loader that raises (e.g. shed by the
+    admission gate at its caller's priority) fails only its own caller:
+    the others retry the load themselves.
+
+    With a `shared` backend (see shared_state.py) every patch/invalidate
+    bumps this cache's version counter and logs the key it touched (the
+    last `shared_keys` of them are kept). A worker that notices the version
+    moved drops just those keys before serving the next lookup, or all its
+    entries if the log doesn't account for every bump (a whole-cache
+    invalidate, or more writes than the log keeps). The counter is checked
+    at most every `poll` seconds.
+    """
+
+    def __init__(self, name, ttl=30.0, shared=None, poll=0.0, shared_keys=100):
+        self.name = name
+        self.ttl = ttl
+        self.shared = shared
+        self.poll = poll
+        self.shared_keys = shared_keys
+        self.next_poll = 0.0
+        self.seen_version = shared.version('cache:' + name) if shared else 0
+        self.remote_invalidations = 0
+        self.lock = threading.Lock()
+        self.entries = {}      # key -> (expires_at, value)
+        self.flights = {}      # key -> _Flight
+        self.generation = 0    # bumped by invalidate(); stale loads are dropped
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def _sync(self, now):
+        # Pick up patches/invalidations made by other workers
+        if self.shared is None or now < self.next_poll:
+            return
+        self.next_poll = now + self.poll
+        version = self.shared.version('cache:' + self.name)
+        if version != self.seen_version:
+            self._drop_changed(self.seen_version, version)
+
+    def _drop_changed(self, seen, version, own=None):
+        # Drop the keys bumps seen+1..version touched (our own bump `own`
+        # aside), or every entry when the key log can't tell us
+        wanted = set(range(seen + 1, version + 1)) - {own}
+        logged = {v: key for v, key in self.shared.items('cache-keys:' + self.name) if v in wanted}
+        with self.lock:
+            if version <= self.seen_version:
+                return  # another thread caught up first
+            self.seen_version = version
+            self.generation += 1
+            if own is None:
+                self.remote_invalidations += 1
+            if len(logged) < len(wanted) or None in logged.values():
+                self.entries.clear()
+            else:
+                for key in logged.values():
+                    self.entries.pop(key, None)
+
+    def _announce(self, key=None):
+        # Tell other workers our copy changed. If someone else also wrote
+        # since we last looked, drop what they touched too.
+        if self.shared is None:
+            return
+        version = self.shared.bump('cache:' + self.name)
+        self.shared.push('cache-keys:' + self.name, [version, key], maxlen=self.shared_keys)
+        with self.lock:
+            seen = self.seen_version
+            if version == seen + 1:
+                self.seen_version = version
+                return
+        self._drop_changed(seen, version, own=version)
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        self._sync(now)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            flight = self.flights.get(key)
+            if flight:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = self.flights[key] = _Flight()
+                generation = self.generation
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                return self.get(key, loader)
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self.lock:
+                self.flights.pop(key, None)
+                if flight.error is None and flight.value is not None and generation == self.generation:
+                    self.entries[key] = (time.monotonic() + self.ttl, flight.value)
+            flight.done.set()
+
+        if flight.error:
+            raise flight.error
+        return flight.value
+
+    def peek(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry[1] if entry and entry[0] > time.monotonic() else None
+
+    def patch(self, key, fn):
+        """Replace a fresh entry with fn(value), keeping its expiry.
+
+        Loads already in flight are discarded, since they may predate the
+        write being applied. Missing or expired entries are left alone.
+        """
+        with self.lock:
+            self.generation += 1
+            entry = self.entries.get(key)
+            patched = bool(entry and entry[0] > time.monotonic())
+            if patched:
+                self.entries[key] = (entry[0], fn(entry[1]))
+        self._announce(key)
+        return patched
+
+    def invalidate(self, key=None):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+        self._announce(key)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'name': self.name,
+                'ttl': self.ttl,
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'invalidations': self.invalidations,
+                'remote_invalidations': self.remote_invalidations,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 4) if lookups else None
+            }
+
+
+class ChangeLog:
+    """Bounded, revision-numbered log of row changes.
+
+    Revisions start at the process start time in milliseconds so they keep
+    increasing across restarts. With a `shared` backend they come from one
+    counter every worker bumps, so no two workers hand out the same number.
+    Each worker's log holds only the changes it saw, so since() serves only
+    revisions this log issued. A client holding any other revision gets None
+    and must resync: one that is too old, from the future, or from another
+    worker's log.
+    """
+
+    def __init__(self, maxlen=1000, shared=None, name='changes'):
+        self.shared = shared
+        self.name = name
+        self.lock = threading.Lock()
+        self.rev = shared.bump(name) if shared else int(time.time() * 1000)
+        self.floor = self.rev   # newest revision no longer in the log
+        self.entries = deque(maxlen=maxlen)
+
+    def append(self, changes):
+        with self.lock:
+            # Taken under the lock so our entries stay in revision order
+            rev = self.shared.bump(self.name, len(changes)) if self.shared else self.rev + len(changes)
+            for i, change in enumerate(changes):
+                change['rev'] = rev - len(changes) + 1 + i
+                if len(self.entries) == self.entries.maxlen:
+                    self.floor = self.entries[0]['rev']
+                self.entries.append(change)
+            self.rev = rev
+            return self.rev
+
+    def since(self, rev):
+        with self.lock:
+            out = []
+            for change in reversed(self.entries):
+                if change['rev'] <= rev:
+                    if change['rev'] != rev:
+                        return None
+                    break
+                out.append(change)
+            else:
+                if rev != self.floor:
+                    return None
+            out.reverse()
+            return out
@@ -0,0 +1,383 @@
+import heapq
+import math
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # pure-Python fallback below
+    np = None
+
+EARTH_RADIUS_M = 6371000
+METERS_PER_DEG_LAT = 111195.0
+
+
+# --- Batched distances (array in / array out) ---
+# With NumPy installed these return float64 arrays; otherwise plain lists.
+# Inputs must already be numeric: unlike haversine() nothing is coerced.
+
+def _haversine_many_py(lat, lng, lats, lngs):
+    phi1 = math.radians(lat)
+    cos1 = math.cos(phi1)
+    rad, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+    two_r = 2 * EARTH_RADIUS_M
+    out = []
+    for la, ln in zip(lats, lngs):
+        phi2 = rad(la)
+        a = sin((phi2 - phi1) / 2) ** 2 + cos1 * cos(phi2) * sin(rad(ln - lng) / 2) ** 2
+        out.append(two_r * asin(sqrt(min(a, 1.0))))
+    return out
+
+
+def haversine_many(lat, lng, lats, lngs):
+    """Distances in metres from one point to each of (lats[i], lngs[i])."""
+    if np is None:
+        return _haversine_many_py(float(lat), float(lng), lats, lngs)
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+    phi1, lam1 = math.radians(lat), math.radians(lng)
+    a = np.sin((lats - phi1) / 2) ** 2 + math.cos(phi1) * np.cos(lats) * np.sin((lngs - lam1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distance_matrix(lats_a, lngs_a, lats_b, lngs_b):
+    """len(a) x len(b) matrix of distances in metres."""
+    if np is None:
+        return [_haversine_many_py(float(la), float(ln), lats_b, lngs_b) for la, ln in zip(lats_a, lngs_a)]
+    pa = np.radians(np.asarray(lats_a, dtype=np.float64))[:, None]
+    la = np.radians(np.asarray(lngs_a, dtype=np.float64))[:, None]
+    pb = np.radians(np.asarray(lats_b, dtype=np.float64))[None, :]
+    lb = np.radians(np.asarray(lngs_b, dtype=np.float64))[None, :]
+    a = np.sin((pb - pa) / 2) ** 2 + np.cos(pa) * np.cos(pb) * np.sin((lb - la) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Scalar convenience wrapper; bad input yields a huge distance, not an error
+    try:
+        phi1, phi2 = math.radians(float(lat1)), math.radians(float(lat2))
+        dlam = math.radians(float(lon2) - float(lon1))
+    except (TypeError, ValueError):
+        return 9999999
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def bounding_box(lat, lng, radius_m):
+    """(min_lat, max_lat, min_lng, max_lng) enclosing a circle of radius_m."""
+    dlat = radius_m / METERS_PER_DEG_LAT
+    dlng = radius_m / (METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6))
+    return (lat - dlat, lat + dlat, lng - dlng, lng + dlng)
+
+
+def grid_cell(lat, lng, cell_deg):
+    """(row, col) of the cell_deg x cell_deg grid square containing a point."""
+    lat, lng = float(lat), float(lng)
+    if not (math.isfinite(lat) and math.isfinite(lng)):
+        raise ValueError('coordinates must be finite')
+    return (int(math.floor(lat / cell_deg)), int(math.floor(lng / cell_deg)))
+
+
+def grid_cells_in_bbox(south, west, north, east, cell_deg, max_cells=None):
+    """Grid cells overlapping a bounding box, or None if there are more than max_cells."""
+    r0, c0 = grid_cell(south, west, cell_deg)
+    r1, c1 = grid_cell(north, east, cell_deg)
+    if r1 < r0 or c1 < c0:
+        return []
+    if max_cells is not None and (r1 - r0 + 1) * (c1 - c0 + 1) > max_cells:
+        return None
+    return [(r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+
+
+class SpotIndex:
+    """Uniform lat/lng grid over spots for radius + k-nearest queries.
+
+    Spots are bucketed into square cells of `cell_deg` degrees. A query
+    walks rings of cells outward from the query cell and stops as soon as
+    no unvisited ring can hold anything closer than the current k-th best.
+    Rows are stored by reference; callers must not mutate them.
+    """
+
+    def __init__(self, cell_deg=0.01):
+        self.cell_deg = cell_deg
+        self.lock = threading.Lock()
+        self.cells = {}   # (row, col) -> {spot_id: spot}
+        self.where = {}   # spot_id -> (row, col)
+
+    def _cell(self, lat, lng):
+        return grid_cell(lat, lng, self.cell_deg)
+
+    def __len__(self):
+        return len(self.where)
+
+    def rebuild(self, spots):
+        cells, where = {}, {}
+        for spot in spots:
+            try:
+                key = self._cell(float(spot['lat']), float(spot['lng']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            cells.setdefault(key, {})[spot['id']] = spot
+            where[spot['id']] = key
+        with self.lock:
+            self.cells, self.where = cells, where
+
+    def upsert(self, spot):
+        try:
+            key = self._cell(float(spot['lat']), float(spot['lng']))
+        except (KeyError, TypeError, ValueError):
+            self.remove(spot.get('id'))
+            return
+        with self.lock:
+            old = self.where.get(spot['id'])
+            if old is not None and old != key:
+                self._drop(spot['id'], old)
+            self.cells.setdefault(key, {})[spot['id']] = spot
+            self.where[spot['id']] = key
+
+    def remove(self, spot_id):
+        with self.lock:
+            key = self.where.pop(spot_id, None)
+            if key is not None:
+                self._drop(spot_id, key)
+
+    def _drop(self, spot_id, key):
+        bucket = self.cells.get(key)
+        if bucket is not None:
+            bucket.pop(spot_id, None)
+            if not bucket:
+                del self.cells[key]
+
+    def _ring(self, center, r):
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    def nearby(self, lat, lng, radius_m, limit=20, predicate=None):
+        """Return up to `limit` (distance_m, spot) pairs within `radius_m`, nearest first."""
+        center = self._cell(lat, lng)
+        # Smallest edge of a cell in metres around the query latitude; any
+        # cell r rings away is at least (r - 1) edges from the query point.
+        edge_m = self.cell_deg * METERS_PER_DEG_LAT * max(math.cos(math.radians(min(abs(lat) + self.cell_deg * 2, 89.9))), 1e-6)
+        # Cells outside the radius' bounding box can't match: the walk skips
+        # them and stops once it has covered the box
+        box = bounding_box(lat, lng, radius_m)
+        (r0, c0), (r1, c1) = self._cell(box[0], box[2]), self._cell(box[1], box[3])
+        max_ring = min(int(radius_m // edge_m) + 1, max(center[0] - r0, r1 - center[0], center[1] - c0, c1 - center[1]))
+        best = []  # max-heap of (-distance, spot_id, spot)
+        with self.lock:
+            cells = self.cells
+            total = len(self.where)
+            seen = 0
+            for r in range(max_ring + 1):
+                if len(best) >= limit and -best[0][0] <= (r - 1) * edge_m:
+                    break
+                if seen >= total:
+                    break
+                # Score the whole ring with one batched distance call
+                ring = []
+                for key in self._ring(center, r):
+                    bucket = cells.get(key)
+                    if bucket:
+                        seen += len(bucket)
+                        if r0 <= key[0] <= r1 and c0 <= key[1] <= c1:
+                            ring.extend(bucket.values() if predicate is None else filter(predicate, bucket.values()))
+                if not ring:
+                    continue
+                score = haversine_many if len(ring) >= 64 else _haversine_many_py  # NumPy setup cost dominates tiny rings
+                dists = score(lat, lng, [float(s['lat']) for s in ring], [float(s['lng']) for s in ring])
+                for d, spot in zip(dists, ring):
+                    if d > radius_m:
+                        continue
+                    d = float(d)
+                    if len(best) < limit:
+                        heapq.heappush(best, (-d, spot['id'], spot))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, spot['id'], spot))
+        return [(-nd, spot) for nd, _, spot in sorted(best, key=lambda x: -x[0])]
+
+    def within(self, south, west, north, east, limit=None):
+        """Spots inside a bounding box; past `limit`, the ones nearest its centre.
+
+        Returns (spots, truncated).
+        """
+        with self.lock:
+            cells = self.cells
+            keys = grid_cells_in_bbox(south, west, north, east, self.cell_deg, max_cells=len(cells))
+            buckets = cells.values() if keys is None else filter(None, map(cells.get, keys))
+            found = [s for bucket in buckets for s in bucket.values()
+                     if south <= float(s['lat']) <= north and west <= float(s['lng']) <= east]
+        if limit is None or len(found) <= limit:
+            return sorted(found, key=lambda s: s['id']), False
+        lat, lng = (south + north) / 2, (west + east) / 2
+        dists = haversine_many(lat, lng, [float(s['lat']) for s in found], [float(s['lng']) for s in found])
+        nearest = sorted(zip(dists, (s['id'] for s in found), found), key=lambda x: x[:2])[:limit]
+        return [spot for _, _, spot in nearest], True
+
+
+class ClusterIndex:
+    """Per-zoom grid aggregates of spots for drawing map clusters.
+
+    Level z splits the world into cells of 360 / (2**z * per_tile) degrees,
+    so at `per_tile` = 4 a cluster covers about 64 px of a 256 px map tile
+    at that zoom. Each cell keeps the spot count, free bays, price range
+    and the sum of coordinates for its centroid. Cells at one level are
+    exactly four cells of the level below (floor division by two), so the
+    hierarchy is built from the finest level up. An upsert or removal then
+    touches one cell per level.
+    """
+
+    def __init__(self, max_zoom=16, per_tile=4):
+        self.max_zoom = max_zoom
+        self.per_tile = per_tile
+        self.lock = threading.Lock()
+        self.levels = [{} for _ in range(max_zoom + 1)]  # z -> {(row, col): [count, available, sum_lat, sum_lng, min_price, max_price, spot_id]}
+        self.members = {}  # finest (row, col) -> {spot_id: (lat, lng, available, price)}
+        self.where = {}    # spot_id -> finest (row, col)
+
+    def cell_deg(self, zoom):
+        return 360.0 / (2 ** zoom * self.per_tile)
+
+    def __len__(self):
+        return len(self.where)
+
+    @staticmethod
+    def _entry(spot):
+        try:
+            lat, lng = float(spot['lat']), float(spot['lng'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not (math.isfinite(lat) and math.isfinite(lng)):
+            return None
+        try:
+            price = float(spot.get('price'))
+        except (TypeError, ValueError):
+            price = None
+        return lat, lng, int(spot.get('available') or 0), price
+
+    @staticmethod
+    def _summarize(entries):
+        # entries: (spot_id, (lat, lng, available, price)) pairs of one finest-level cell
+        count = avail = 0
+        sum_lat = sum_lng = 0.0
+        prices = []
+        only = None
+        for spot_id, (lat, lng, available, price) in entries:
+            count += 1
+            avail += available
+            sum_lat += lat
+            sum_lng += lng
+            if price is not None: prices.append(price)
+            only = spot_id
+        return [count, avail, sum_lat, sum_lng, min(prices, default=None), max(prices, default=None),
+                only if count == 1 else None]
+
+    @staticmethod
+    def _merge(children):
+        count = avail = 0
+        sum_lat = sum_lng = 0.0
+        lo = hi = only = None
+        for c in children:
+            count += c[0]
+            avail += c[1]
+            sum_lat += c[2]
+            sum_lng += c[3]
+            if c[4] is not None: lo = c[4] if lo is None else min(lo, c[4])
+            if c[5] is not None: hi = c[5] if hi is None else max(hi, c[5])
+            only = c[6]
+        return [count, avail, sum_lat, sum_lng, lo, hi, only if count == 1 else None]
+
+    def rebuild(self, spots):
+        finest = self.cell_deg(self.max_zoom)
+        members, where = {}, {}
+        for spot in spots:
+            entry = self._entry(spot)
+            if entry is None:
+                continue
+            key = (int(math.floor(entry[0] / finest)), int(math.floor(entry[1] / finest)))
+            members.setdefault(key, {})[spot['id']] = entry
+            where[spot['id']] = key
+        levels = [None] * (self.max_zoom + 1)
+        levels[self.max_zoom] = {key: self._summarize(bucket.items()) for key, bucket in members.items()}
+        for z in range(self.max_zoom - 1, -1, -1):
+            groups = {}
+            for (r, c), cell in levels[z + 1].items():
+                groups.setdefault((r >> 1, c >> 1), []).append(cell)
+            levels[z] = {key: self._merge(children) for key, children in groups.items()}
+        with self.lock:
+            self.levels, self.members, self.where = levels, members, where
+
+    def _refresh(self, key):
+        # Recompute the finest cell `key` and its ancestors from their children
+        bucket = self.members.get(key)
+        levels = self.levels
+        if bucket:
+            levels[self.max_zoom][key] = self._summarize(bucket.items())
+        else:
+            levels[self.max_zoom].pop(key, None)
+        r, c = key
+        for z in range(self.max_zoom - 1, -1, -1):
+            r, c = r >> 1, c >> 1
+            below = levels[z + 1]
+            children = [below[k] for k in ((2 * r, 2 * c), (2 * r + 1, 2 * c), (2 * r, 2 * c + 1), (2 * r + 1, 2 * c + 1))
+                        if k in below]
+            if children:
+                levels[z][(r, c)] = self._merge(children)
+            else:
+                levels[z].pop((r, c), None)
+
+    def upsert(self, spot):
+        entry = self._entry(spot)
+        if entry is None:
+            self.remove(spot.get('id'))
+            return
+        finest = self.cell_deg(self.max_zoom)
+        key = (int(math.floor(entry[0] / finest)), int(math.floor(entry[1] / finest)))
+        with self.lock:
+            old = self.where.get(spot['id'])
+            if old is not None and old != key:
+                self.members[old].pop(spot['id'], None)
+                if not self.members[old]:
+                    del self.members[old]
+                self._refresh(old)
+            self.members.setdefault(key, {})[spot['id']] = entry
+            self.where[spot['id']] = key
+            self._refresh(key)
+
+    def remove(self, spot_id):
+        with self.lock:
+            key = self.where.pop(spot_id, None)
+            if key is None:
+                return
+            bucket = self.members.get(key)
+            if bucket is not None:
+                bucket.pop(spot_id, None)
+                if not bucket:
+                    del self.members[key]
+            self._refresh(key)
+
+    def query(self, south, west, north, east, zoom, limit=None):
+        """Clusters at `zoom` whose cell overlaps the box, as dicts; zooms past max_zoom use the finest level."""
+        z = max(0, min(int(zoom), self.max_zoom))
+        deg = self.cell_deg(z)
+        r0, c0 = int(math.floor(south / deg)), int(math.floor(west / deg))
+        r1, c1 = int(math.floor(north / deg)), int(math.floor(east / deg))
+        out = []
+        with self.lock:
+            level = self.levels[z]
+            if (r1 - r0 + 1) * (c1 - c0 + 1) <= len(level):
+                cells = ((k, level[k]) for k in ((r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)) if k in level)
+            else:
+                cells = ((k, v) for k, v in level.items() if r0 <= k[0] <= r1 and c0 <= k[1] <= c1)
+            for _, (count, avail, sum_lat, sum_lng, lo, hi, only) in cells:
+                out.append({'lat': sum_lat / count, 'lng': sum_lng / count, 'count': count, 'available': avail,
+                            'price_min': lo, 'price_max': hi, 'id': only})
+                if limit is not None and len(out) >= limit:
+                    break
+        return z, out
@@ -0,0 +1,27 @@
+"""gunicorn settings for wsgi.py; every value can be overridden from the environment.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import os
+
+env = os.environ.get
+
+os.environ.setdefault('ASYNC_MODE', 'gevent')
+ASYNC_MODE = os.environ['ASYNC_MODE']
+
+bind = env('GUNICORN_BIND', f"0.0.0.0:{env('PORT', 8000)}")
+workers = int(env('WEB_CONCURRENCY', 1))
+if ASYNC_MODE == 'gevent':
+    # gevent's worker plus a WebSocket handler; plain 'gevent' would leave
+    # Socket.IO on long-polling
+    worker_class = 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'
+    # Requests one worker serves at once; upstream calls beyond
+    # UPSTREAM_MAX_INFLIGHT wait at the admission gate
+    worker_connections = int(env('GUNICORN_WORKER_CONNECTIONS', 1000))
+else:
+    worker_class = 'gthread'
+    threads = int(env('GUNICORN_THREADS', 32))
+timeout = int(env('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(env('GUNICORN_GRACEFUL_TIMEOUT', 30))  # lets write-behind flush on shutdown
+keepalive = int(env('GUNICORN_KEEPALIVE', 5))
+accesslog = env('GUNICORN_ACCESS_LOG') or None
@@ -0,0 +1,134 @@
+from bisect import bisect_left
+import threading
+
+# Seconds; roughly Prometheus' defaults with more resolution at the fast end
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in pairs)
+
+
+class Metrics:
+    """In-process counters and histograms rendered in Prometheus text format.
+
+    Everything is keyed by a small, fixed set of labels (route endpoint
+    names, table names, event names) so cardinality stays bounded. Values
+    owned by other objects (cache stats, pool stats, ...) are pulled at
+    scrape time through collectors registered with add_collector().
+    """
+
+    def __init__(self, prefix='parkwell'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.requests = {}       # (endpoint, method, status) -> count
+        self.latency = {}        # (endpoint, method) -> Histogram
+        self.request_upstream = {}  # (endpoint, service) -> [calls, seconds]
+        self.upstream = {}       # (service, target, verb, status) -> count
+        self.upstream_time = {}  # (service, target, verb) -> Histogram
+        self.emits = {}          # event -> [emits, rooms, recipients]
+        self.collectors = []
+
+    def observe_request(self, endpoint, method, status, seconds, upstream=None):
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            hist = self.latency.get((endpoint, method))
+            if hist is None:
+                hist = self.latency[(endpoint, method)] = Histogram()
+            hist.observe(seconds)
+            for service, (calls, spent) in (upstream or {}).items():
+                acc = self.request_upstream.setdefault((endpoint, service), [0, 0.0])
+                acc[0] += calls
+                acc[1] += spent
+
+    def observe_upstream(self, service, target, verb, status, seconds):
+        with self.lock:
+            key = (service, target, verb, status)
+            self.upstream[key] = self.upstream.get(key, 0) + 1
+            hist = self.upstream_time.get((service, target, verb))
+            if hist is None:
+                hist = self.upstream_time[(service, target, verb)] = Histogram()
+            hist.observe(seconds)
+
+    def observe_emit(self, event, rooms, recipients):
+        with self.lock:
+            acc = self.emits.setdefault(event, [0, 0, 0])
+            acc[0] += 1
+            acc[1] += rooms
+            acc[2] += recipients
+
+    def add_collector(self, fn):
+        # fn() -> iterable of (name, type, help, [((label, value), ...), value])
+        self.collectors.append(fn)
+
+    def _histogram(self, out, name, help_text, series):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} histogram")
+        for labels, hist in series:
+            base = _labels(labels)
+            sep = ',' if base else ''
+            running = 0
+            for le, n in zip(hist.buckets, hist.counts):
+                running += n
+                out.append(f'{name}_bucket{{{base}{sep}le="{le}"}} {running}')
+            out.append(f'{name}_bucket{{{base}{sep}le="+Inf"}} {hist.count}')
+            out.append(f"{name}_sum{{{base}}} {hist.sum:.6f}")
+            out.append(f"{name}_count{{{base}}} {hist.count}")
+
+    @staticmethod
+    def _simple(out, name, kind, help_text, series):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            out.append(f"{name}{{{_labels(labels)}}} {value}")
+
+    def render(self):
+        p = self.prefix
+        out = []
+        with self.lock:
+            self._simple(out, f"{p}_requests_total", 'counter', 'HTTP requests by route endpoint and status',
+                         [((('endpoint', e), ('method', m), ('status', s)), n) for (e, m, s), n in sorted(self.requests.items())])
+            self._histogram(out, f"{p}_request_duration_seconds", 'Time spent handling HTTP requests',
+                            [((('endpoint', e), ('method', m)), h) for (e, m), h in sorted(self.latency.items())])
+            self._simple(out, f"{p}_request_upstream_calls_total", 'counter', 'Upstream calls made while serving requests, by route',
+                         [((('endpoint', e), ('service', s)), v[0]) for (e, s), v in sorted(self.request_upstream.items())])
+            self._simple(out, f"{p}_request_upstream_seconds_total", 'counter', 'Time requests spent waiting on upstream calls, by route',
+                         [((('endpoint', e), ('service', s)), f"{v[1]:.6f}") for (e, s), v in sorted(self.request_upstream.items())])
+            self._simple(out, f"{p}_upstream_requests_total", 'counter', 'Upstream HTTP calls by service, table/target, verb and status',
+                         [((('service', s), ('target', t), ('verb', v), ('status', c)), n) for (s, t, v, c), n in sorted(self.upstream.items(), key=str)])
+            self._histogram(out, f"{p}_upstream_duration_seconds", 'Upstream HTTP call latency',
+                            [((('service', s), ('target', t), ('verb', v)), h) for (s, t, v), h in sorted(self.upstream_time.items())])
+            emits = sorted(self.emits.items())
+            self._simple(out, f"{p}_socketio_emits_total", 'counter', 'Socket.IO emits by event',
+                         [((('event', e),), v[0]) for e, v in emits])
+            self._simple(out, f"{p}_socketio_emit_rooms_total", 'counter', 'Rooms targeted by Socket.IO emits',
+                         [((('event', e),), v[1]) for e, v in emits])
+            self._simple(out, f"{p}_socketio_emit_recipients_total", 'counter', 'Clients on this worker reached by Socket.IO emits',
+                         [((('event', e),), v[2]) for e, v in emits])
+        for collect in self.collectors:
+            try:
+                metrics = list(collect())
+            except Exception as e:
+                out.append(f"# collector error: {e}")
+                continue
+            for name, kind, help_text, series in metrics:
+                self._simple(out, f"{p}_{name}", kind, help_text, series)
+        return '\n'.join(out) + '\n'
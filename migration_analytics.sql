@@ -0,0 +1,35 @@
+-- Run this in your Supabase SQL Editor to let /api/analytics aggregate in the database
+-- instead of downloading the whole transactions table.
+
+create or replace function analytics_summary()
+returns json
+language sql
+stable
+as $$
+  select json_build_object(
+    'revenue', (select coalesce(sum(amount), 0) from transactions),
+    'total_bookings', (select count(*) from transactions where type = 'Booking'),
+    'by_day', (
+      select coalesce(json_agg(d), '[]'::json) from (
+        select date as key, sum(amount) as revenue, count(*) filter (where type = 'Booking') as bookings
+        from transactions where date is not null group by date order by date
+      ) d
+    ),
+    'by_spot', (
+      select coalesce(json_agg(s), '[]'::json) from (
+        select spot_id as key, sum(amount) as revenue, count(*) filter (where type = 'Booking') as bookings
+        from transactions where spot_id is not null group by spot_id
+      ) s
+    ),
+    'by_owner', (
+      select coalesce(json_agg(o), '[]'::json) from (
+        select sp.owner_id as key, sum(t.amount) as revenue, count(*) filter (where t.type = 'Booking') as bookings
+        from transactions t join spots sp on sp.id = t.spot_id
+        where sp.owner_id is not null group by sp.owner_id
+      ) o
+    )
+  );
+$$;
+
+-- Speeds up the recent-activity query (order by created_at desc limit 10)
+create index if not exists transactions_created_at_idx on transactions (created_at desc);
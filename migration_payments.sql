@@ -0,0 +1,70 @@
+-- Run this in your Supabase SQL Editor so a top-up reference can only be credited once,
+-- even when two workers (or a webhook and a client retry) settle it at the same time.
+
+-- Older versions could record one reference more than once, which would
+-- stop the index below from being built. The first Deposit per reference
+-- stays the claim. Each later one keeps its row and amount, but its
+-- payment_ref gets ':dup:<id>' appended, and the count is reported. Each
+-- one is a wallet credited twice; list them with
+--   select * from transactions where type = 'Deposit' and payment_ref like '%:dup:%';
+do $$
+declare
+  v_count int;
+begin
+  update transactions t set payment_ref = t.payment_ref || ':dup:' || t.id
+  where t.type = 'Deposit' and t.payment_ref is not null
+    and exists (select 1 from transactions o
+                where o.type = 'Deposit' and o.payment_ref = t.payment_ref and o.id < t.id);
+  get diagnostics v_count = row_count;
+  if v_count > 0 then
+    raise notice 'migration_payments: % duplicate deposit(s) renamed to <ref>:dup:<id>, review them', v_count;
+  end if;
+end $$;
+
+create unique index if not exists transactions_deposit_ref_key
+  on transactions (payment_ref) where type = 'Deposit';
+
+-- The Deposit row is the claim on a reference; `credited` says whether the
+-- wallet has been paid for it. A claim left uncredited (the credit failed)
+-- is finished by the next attempt instead of being treated as done.
+alter table transactions add column if not exists credited boolean;
+update transactions set credited = true where type = 'Deposit' and credited is null;
+
+-- Claim and credit in one database transaction. Without it the app falls
+-- back to the `credited` flag and separate conditional updates.
+create or replace function settle_topup(
+  p_user_id text,
+  p_ref text,
+  p_amount numeric
+)
+returns json
+language plpgsql
+as $$
+declare
+  v_txn transactions;
+  v_user users;
+begin
+  insert into transactions (user_id, type, amount, payment_ref, date, timestamp, credited)
+  values (p_user_id, 'Deposit', p_amount, p_ref, to_char(now(), 'YYYY-MM-DD'), extract(epoch from now()), false)
+  on conflict (payment_ref) where type = 'Deposit' do nothing;
+
+  select * into v_txn from transactions where payment_ref = p_ref and type = 'Deposit' for update;
+  if v_txn.credited then
+    return json_build_object('status', 'duplicate');
+  end if;
+
+  update users set wallet_balance = coalesce(wallet_balance, 0) + v_txn.amount
+    where id = v_txn.user_id returning * into v_user;
+  if not found then
+    -- Rolls back the claim too, so a later attempt starts clean
+    raise exception 'settle_topup: user % not found', v_txn.user_id;
+  end if;
+  update transactions set credited = true where id = v_txn.id returning * into v_txn;
+
+  return json_build_object(
+    'status', 'credited',
+    'transaction', row_to_json(v_txn),
+    'wallet_balance', v_user.wallet_balance
+  );
+end;
+$$;
@@ -0,0 +1,62 @@
+-- Run this in your Supabase SQL Editor to make /api/reserve a single atomic call.
+-- Without it the app falls back to conditional (compare-and-set) updates.
+
+create or replace function reserve_spot(
+  p_spot_id bigint,
+  p_user_id text,
+  p_vehicle_plate text,
+  p_duration_hours int,
+  p_payment_method text,
+  p_payment_ref text
+)
+returns json
+language plpgsql
+as $$
+declare
+  v_spot spots;
+  v_user users;
+  v_txn transactions;
+  v_session sessions;
+  v_ref text := p_payment_ref;
+  v_now numeric := extract(epoch from now());
+begin
+  -- Lock order is always spot, then user, so concurrent calls can't deadlock
+  select * into v_spot from spots where id = p_spot_id for update;
+  if not found or v_spot.available < 1 then
+    return json_build_object('ok', false, 'error', 'Unavailable');
+  end if;
+
+  if p_payment_method = 'wallet' then
+    select * into v_user from users where id = p_user_id for update;
+    if not found then
+      return json_build_object('ok', false, 'error', 'User not found');
+    end if;
+    if v_user.wallet_balance < v_spot.price then
+      return json_build_object('ok', false, 'error', 'Funds too low');
+    end if;
+    update users set wallet_balance = wallet_balance - v_spot.price
+      where id = p_user_id returning * into v_user;
+    v_ref := 'WALLET-' || floor(v_now)::bigint;
+  end if;
+
+  update spots set available = available - 1 where id = p_spot_id returning * into v_spot;
+
+  insert into transactions (user_id, spot_id, type, amount, spot_name, payment_ref, date, vehicle_plate, timestamp)
+  values (p_user_id, p_spot_id, 'Booking', v_spot.price, v_spot.name, v_ref,
+          to_char(now(), 'YYYY-MM-DD'), p_vehicle_plate, v_now)
+  returning * into v_txn;
+
+  insert into sessions (spot_id, user_name, vehicle_plate, start_time, expiry_time, price, payment_ref)
+  values (p_spot_id, coalesce((select name from users where id = p_user_id), 'Guest'), p_vehicle_plate, v_now,
+          v_now + coalesce(p_duration_hours, 1) * 3600, v_spot.price, v_ref)
+  returning * into v_session;
+
+  return json_build_object(
+    'ok', true,
+    'spot', row_to_json(v_spot),
+    'transaction', row_to_json(v_txn),
+    'session', row_to_json(v_session),
+    'wallet_balance', v_user.wallet_balance
+  );
+end;
+$$;
@@ -0,0 +1,92 @@
+"""Pre-serialized, pre-compressed JSON bodies with strong ETags.
+
+A Payload is built once per snapshot and projection. It is then handed out
+as-is: identity, gzip, or brotli (when the `brotli` package is installed),
+each compressed the first time a client asks for it. The ETag is a hash
+of the JSON bytes, so every worker holding the same rows hands out the
+same tag. Compressed variants add a suffix, and the suffix is ignored
+when matching If-None-Match.
+
+orjson is used for encoding when installed; otherwise json.dumps with
+compact separators.
+"""
+import gzip
+import hashlib
+import json
+import threading
+
+try:
+    import orjson
+except ImportError:  # optional, only faster
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+SUFFIX = {'gzip': '-gz', 'br': '-br'}
+MIN_COMPRESS = 1024  # smaller bodies aren't worth the CPU or the extra header
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def negotiate(accept_encoding):
+    # Prefer brotli, then gzip; ignores q-values other than an explicit q=0
+    offered = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        offered[name.strip().lower()] = params.replace(' ', '') not in ('q=0', 'q=0.0')
+    if brotli is not None and offered.get('br'):
+        return 'br'
+    if offered.get('gzip'):
+        return 'gzip'
+    return None
+
+
+class Payload:
+    def __init__(self, obj):
+        self.body = dumps(obj)
+        self.etag = hashlib.blake2b(self.body, digest_size=12).hexdigest()
+        self.variants = {}
+        self.lock = threading.Lock()
+
+    def _coding(self, encoding):
+        return encoding if encoding and len(self.body) >= MIN_COMPRESS else None
+
+    def tag(self, encoding):
+        coding = self._coding(encoding)
+        return f'"{self.etag}{SUFFIX[coding]}"' if coding else f'"{self.etag}"'
+
+    def encoded(self, encoding):
+        """(bytes, Content-Encoding or None) for the negotiated encoding."""
+        coding = self._coding(encoding)
+        if coding is None:
+            return self.body, None
+        with self.lock:
+            data = self.variants.get(coding)
+            if data is None:
+                data = brotli.compress(self.body, quality=5) if coding == 'br' else gzip.compress(self.body, 6)
+                self.variants[coding] = data
+        return data, coding
+
+    def matches(self, if_none_match):
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag == '*':
+                return True
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            tag = tag.strip('"')
+            for suffix in SUFFIX.values():
+                if tag.endswith(suffix):
+                    tag = tag[:-len(suffix)]
+            if tag == self.etag:
+                return True
+        return False
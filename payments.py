@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import hashlib
+import hmac
+import threading
+import time
+
+SUCCESS = 'success'
+FAILED = 'failed'
+PENDING = 'pending'
+
+
+class PaystackVerifier:
+    """Paystack reference verification off the request thread.
+
+    Lookups run on a small worker pool; a request waits at most `wait`
+    seconds and otherwise gets PENDING back while the lookup carries on in
+    the background. Concurrent checks of one reference share a single
+    lookup. Outcomes are cached per reference: successes for `ttl` seconds,
+    failures only for `failure_ttl` (the payment may still be settling),
+    and network errors or Paystack error replies (5xx, 429) not at all:
+    those come back PENDING, since they say nothing about the payment.
+    Webhook events feed the same cache via record().
+    """
+
+    def __init__(self, secret, http, base_url='https://api.paystack.co', workers=8, ttl=3600.0, failure_ttl=10.0):
+        self.secret = secret
+        self.http = http
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='paystack')
+        self.lock = threading.Lock()
+        self.results = {}   # ref -> (expires_at, status, data)
+        self.flights = {}   # ref -> Future
+        self.lookups = 0
+        self.cache_hits = 0
+        self.pending = 0
+        self.webhooks = 0
+
+    def _fetch(self, ref):
+        r = self.http.get(f"{self.base_url}/transaction/verify/{ref}",
+                          headers={"Authorization": f"Bearer {self.secret}"})
+        if r.status_code in (400, 404):
+            # Paystack's own answer for a reference it doesn't know; anything
+            # else non-200 (5xx, 429, a proxy page) says nothing about the payment
+            try:
+                known = r.json().get('status') is False
+            except ValueError:
+                known = False
+            return (FAILED, None) if known else (PENDING, None)
+        if r.status_code != 200:
+            return PENDING, None
+        data = r.json().get('data') or {}
+        return (SUCCESS, data) if data.get('status') == 'success' else (FAILED, None)
+
+    def _run(self, ref):
+        try:
+            status, data = self._fetch(ref)
+        except Exception:
+            status, data = PENDING, None # Timeout / network error: unknown, not failed
+        with self.lock:
+            self.flights.pop(ref, None)
+            if status != PENDING:
+                self._store(ref, status, data)
+        return status, data
+
+    def _store(self, ref, status, data):
+        now = time.monotonic()
+        if len(self.results) > 10000:
+            self.results = {k: v for k, v in self.results.items() if v[0] > now}
+        self.results[ref] = (now + (self.ttl if status == SUCCESS else self.failure_ttl), status, data)
+
+    def verify(self, ref, wait=3.0):
+        """(status, data): SUCCESS with Paystack's transaction data, FAILED, or PENDING."""
+        if not ref:
+            return FAILED, None
+        with self.lock:
+            cached = self.results.get(ref)
+            if cached and cached[0] > time.monotonic():
+                self.cache_hits += 1
+                return cached[1], cached[2]
+            future = self.flights.get(ref)
+            if future is None:
+                self.lookups += 1
+                future = self.flights[ref] = self.pool.submit(self._run, ref)
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeout:
+            with self.lock:
+                self.pending += 1
+            return PENDING, None
+
+    def record(self, ref, data):
+        # A signed charge.success webhook is as good as a lookup
+        with self.lock:
+            self.webhooks += 1
+            self._store(ref, SUCCESS, data)
+
+    def check_signature(self, body, signature):
+        # Paystack signs the raw request body with HMAC-SHA512 of the secret key
+        if not self.secret or not signature:
+            return False
+        expected = hmac.new(self.secret.encode(), body, hashlib.sha512).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'lookups': self.lookups,
+                'cache_hits': self.cache_hits,
+                'pending': self.pending,
+                'webhooks': self.webhooks,
+                'in_flight': len(self.flights),
+                'cached': len(self.results)
+            }
@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class ExpiryScheduler:
+    """Min-heap of (expires_at, seq, key) drained by a single background thread.
+
+    The thread sleeps until the earliest deadline (or until something
+    earlier is scheduled), then hands every key that is due to
+    `on_expire(keys)` in batches of at most `batch` keys. Rescheduling or
+    cancelling a key doesn't touch the heap: the latest deadline per key is
+    kept in `deadlines` and stale heap entries are skipped when popped.
+    `on_expire` runs on the scheduler thread; if it raises, the batch is
+    retried after `retry` seconds. After each round the thread waits at
+    least `resolution` seconds, so a steady stream of deadlines is handled
+    in batches rather than one wakeup per key (keys run up to that late).
+    """
+
+    def __init__(self, on_expire, batch=500, retry=5.0, resolution=0.05, clock=time.time):
+        self.on_expire = on_expire
+        self.batch = batch
+        self.retry = retry
+        self.resolution = resolution
+        self.clock = clock
+        self.cond = threading.Condition()
+        self.heap = []
+        self.deadlines = {}   # key -> expires_at
+        self.seq = itertools.count() # tie-breaker, so keys never get compared
+        self.thread = None
+        self.stopped = False
+        self.expired = 0
+        self.wakeups = 0
+
+    def __len__(self):
+        with self.cond:
+            return len(self.deadlines)
+
+    def schedule(self, key, expires_at):
+        with self.cond:
+            self.deadlines[key] = expires_at
+            heapq.heappush(self.heap, (expires_at, next(self.seq), key))
+            if self.heap[0][2] == key:
+                self.cond.notify()
+
+    def cancel(self, key):
+        with self.cond:
+            self.deadlines.pop(key, None)
+
+    def load(self, items):
+        """Merge (key, expires_at) pairs into the queue, e.g. rows read on startup.
+
+        Keys scheduled since the rows were read stay queued. A key already
+        queued keeps the later of its two deadlines: a retry scheduled
+        after a failed expiry outlives the row's own time, while a deadline
+        moved out elsewhere replaces ours.
+        """
+        with self.cond:
+            fresh = [(key, at) for key, at in items if key not in self.deadlines or at > self.deadlines[key]]
+            for key, at in fresh:
+                self.deadlines[key] = at
+            entries = [(at, next(self.seq), key) for key, at in fresh]
+            if len(entries) > len(self.heap):
+                self.heap.extend(entries)
+                heapq.heapify(self.heap)
+            else:
+                for entry in entries:
+                    heapq.heappush(self.heap, entry)
+            self.cond.notify()
+
+    def pop_due(self, now, limit=None):
+        """Remove and return up to `limit` keys whose deadline is <= now."""
+        out = []
+        with self.cond:
+            heap, deadlines = self.heap, self.deadlines
+            while heap and heap[0][0] <= now and (limit is None or len(out) < limit):
+                at, _, key = heapq.heappop(heap)
+                if deadlines.get(key) == at:
+                    del deadlines[key]
+                    out.append(key)
+        return out
+
+    def next_deadline(self):
+        with self.cond:
+            while self.heap and self.deadlines.get(self.heap[0][2]) != self.heap[0][0]:
+                heapq.heappop(self.heap) # drop stale entries so we don't wake up for them
+            return self.heap[0][0] if self.heap else None
+
+    def start(self, spawn=None):
+        # spawn(fn) starts fn in the background; socketio.start_background_task
+        # keeps this on the right kind of thread under eventlet/gevent
+        if self.thread is None:
+            self.thread = (spawn or self._spawn_thread)(self._run)
+        return self
+
+    @staticmethod
+    def _spawn_thread(fn):
+        t = threading.Thread(target=fn, name='expiry-scheduler', daemon=True)
+        t.start()
+        return t
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.stopped:
+                    deadline = self.next_deadline()
+                    delay = None if deadline is None else deadline - self.clock()
+                    if delay is not None and delay <= 0:
+                        break
+                    self.cond.wait(delay)
+                if self.stopped:
+                    return
+                self.wakeups += 1
+            while True:
+                keys = self.pop_due(self.clock(), self.batch)
+                if not keys:
+                    break
+                try:
+                    self.on_expire(keys)
+                    self.expired += len(keys)
+                except Exception as e:
+                    print(f"Session expiry failed, retrying in {self.retry}s: {e}")
+                    retry_at = self.clock() + self.retry
+                    for key in keys:
+                        self.schedule(key, retry_at)
+                    break
+            with self.cond:
+                if not self.stopped and self.resolution:
+                    self.cond.wait(self.resolution)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'scheduled': len(self.deadlines),
+                'heap': len(self.heap),
+                'expired': self.expired,
+                'wakeups': self.wakeups
+            }
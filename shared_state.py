@@ -0,0 +1,234 @@
+"""State that has to agree across worker processes.
+
+Under gunicorn every worker is its own process, so module-level lists and
+in-process caches drift apart. The backends here hold the little state that
+must be shared: bounded stacks (admin undo/redo history, the keys each
+cache invalidated) and version counters (cache invalidation). Pick one with SHARED_STATE_URL:
+
+    (unset)                 in-process only, fine for a single worker
+    sqlite:///path/to.db    a file every worker on the host opens
+    redis://host:6379/0     Redis (needs the `redis` package)
+
+Values pushed onto stacks must be JSON-serialisable.
+
+SQLiteQueueManager is a Socket.IO client manager that relays emits between
+workers through the same SQLite file, for hosts without a message queue.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from socketio import PubSubManager
+
+try:
+    import redis
+except ImportError:  # only needed for redis:// URLs
+    redis = None
+
+
+class LocalState:
+    """Single-process backend; what the app used before sharing existed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stacks = {}
+        self.versions = {}
+
+    def push(self, key, item, maxlen=None, clear=()):
+        # Append, trim from the bottom to maxlen, and empty the `clear` stacks, atomically
+        with self.lock:
+            stack = self.stacks.setdefault(key, [])
+            stack.append(json.loads(json.dumps(item)))
+            if maxlen is not None and len(stack) > maxlen:
+                del stack[:len(stack) - maxlen]
+            for other in clear:
+                self.stacks.pop(other, None)
+
+    def pop(self, key):
+        with self.lock:
+            stack = self.stacks.get(key)
+            return stack.pop() if stack else None
+
+    def length(self, key):
+        with self.lock:
+            return len(self.stacks.get(key, ()))
+
+    def items(self, key):
+        # The whole stack, bottom first
+        with self.lock:
+            return json.loads(json.dumps(self.stacks.get(key, [])))
+
+    def bump(self, name, by=1):
+        with self.lock:
+            self.versions[name] = self.versions.get(name, 0) + by
+            return self.versions[name]
+
+    def version(self, name):
+        with self.lock:
+            return self.versions.get(name, 0)
+
+
+class SQLiteState:
+    """Shared backend on a local SQLite file (WAL mode, one connection per thread)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self._tx() as db:
+            db.execute("create table if not exists stacks (key text, seq integer primary key autoincrement, value text)")
+            db.execute("create index if not exists stacks_key on stacks (key, seq)")
+            db.execute("create table if not exists versions (name text primary key, value integer not null)")
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def _tx(self):
+        return _Immediate(self._conn())
+
+    def push(self, key, item, maxlen=None, clear=()):
+        with self._tx() as db:
+            db.execute("insert into stacks (key, value) values (?, ?)", (key, json.dumps(item)))
+            if maxlen is not None:
+                db.execute("delete from stacks where key = ? and seq not in "
+                           "(select seq from stacks where key = ? order by seq desc limit ?)", (key, key, maxlen))
+            for other in clear:
+                db.execute("delete from stacks where key = ?", (other,))
+
+    def pop(self, key):
+        with self._tx() as db:
+            row = db.execute("select seq, value from stacks where key = ? order by seq desc limit 1", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("delete from stacks where seq = ?", (row[0],))
+            return json.loads(row[1])
+
+    def length(self, key):
+        return self._conn().execute("select count(*) from stacks where key = ?", (key,)).fetchone()[0]
+
+    def items(self, key):
+        rows = self._conn().execute("select value from stacks where key = ? order by seq", (key,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def bump(self, name, by=1):
+        with self._tx() as db:
+            db.execute("insert into versions (name, value) values (?, ?) "
+                       "on conflict (name) do update set value = value + excluded.value", (name, by))
+            return db.execute("select value from versions where name = ?", (name,)).fetchone()[0]
+
+    def version(self, name):
+        row = self._conn().execute("select value from versions where name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+
+class _Immediate:
+    # BEGIN IMMEDIATE takes the write lock up front, so read-then-write
+    # sequences (pop, bump) can't interleave with another worker's
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("begin immediate")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("rollback" if exc_type else "commit")
+
+
+class RedisState:
+    """Shared backend on Redis lists and counters."""
+
+    def __init__(self, url, prefix='parkwell:'):
+        if redis is None:
+            raise RuntimeError("SHARED_STATE_URL is a redis:// URL but the redis package is not installed")
+        self.r = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def push(self, key, item, maxlen=None, clear=()):
+        pipe = self.r.pipeline(transaction=True)
+        pipe.rpush(self.prefix + key, json.dumps(item))
+        if maxlen is not None:
+            pipe.ltrim(self.prefix + key, -maxlen, -1)
+        for other in clear:
+            pipe.delete(self.prefix + other)
+        pipe.execute()
+
+    def pop(self, key):
+        raw = self.r.rpop(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def length(self, key):
+        return self.r.llen(self.prefix + key)
+
+    def items(self, key):
+        return [json.loads(raw) for raw in self.r.lrange(self.prefix + key, 0, -1)]
+
+    def bump(self, name, by=1):
+        return int(self.r.incrby(self.prefix + 'v:' + name, by))
+
+    def version(self, name):
+        return int(self.r.get(self.prefix + 'v:' + name) or 0)
+
+
+def from_url(url):
+    if not url:
+        return LocalState()
+    if url.startswith('sqlite:///'):
+        return SQLiteState(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisState(url)
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+class SQLiteQueueManager(PubSubManager):
+    """Socket.IO pub/sub over a SQLite table, polled every `poll` seconds.
+
+    Lets emits from one worker reach clients connected to another without
+    running Redis. Messages are kept for `retention` seconds.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path, channel='flask-socketio', write_only=False, poll=0.05, retention=60):
+        super().__init__(channel=channel, write_only=write_only)
+        self.path = path
+        self.poll = poll
+        self.retention = retention
+        self.local = threading.local()
+        db = self._conn()
+        db.execute("create table if not exists socketio_queue "
+                   "(id integer primary key autoincrement, channel text, created real, payload text)")
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("pragma journal_mode=wal")
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def _publish(self, data):
+        now = time.time()
+        db = self._conn()
+        db.execute("insert into socketio_queue (channel, created, payload) values (?, ?, ?)",
+                   (self.channel, now, self.json.dumps(data)))
+        if int(now) % 10 == 0:
+            db.execute("delete from socketio_queue where created < ?", (now - self.retention,))
+
+    def _listen(self):
+        db = self._conn()
+        last = db.execute("select coalesce(max(id), 0) from socketio_queue").fetchone()[0]
+        while True:
+            rows = db.execute("select id, payload from socketio_queue where id > ? and channel = ? order by id",
+                              (last, self.channel)).fetchall()
+            for row_id, payload in rows:
+                last = row_id
+                yield payload
+            if not rows:
+                self.server.sleep(self.poll)
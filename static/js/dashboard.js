@@ -1,5 +1,6 @@
 // --- Global State ---
 window.currentSpots = {};
+let spotsRev = null; // Revision of currentSpots, from X-Spots-Revision / delta events
 let revenueChart = null;
 
 // --- Initialization ---
@@ -24,8 +25,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     socket.on('data_update', (msg) => {
         console.log('Real-time update received:', msg);
-        loadSpots();
-        loadAnalytics();
+        applySpotUpdate(msg);
+        // Only money-moving events change the analytics figures
+        if (['reservation', 'cancellation', 'undo', 'redo'].includes(msg.type)) loadAnalytics();
     });
 
     // --- Event Listeners (that need DOM) ---
@@ -44,7 +46,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
 function loadSpots() {
     fetch('/api/spots')
-        .then(r => r.json())
+        .then(r => {
+            const rev = r.headers.get('X-Spots-Revision');
+            if (rev !== null) spotsRev = parseInt(rev, 10);
+            return r.json();
+        })
         .then(spots => {
             const el = document.getElementById('totalSpots');
             if (el) el.innerText = spots.length;
@@ -60,6 +66,48 @@ function loadSpots() {
         .catch(err => console.error("Failed to load spots:", err));
 }
 
+// Apply a data_update delta to currentSpots; fall back to a full reload when we can't
+function applySpotUpdate(msg) {
+    if (msg.resync || !Array.isArray(msg.changes) || spotsRev === null) return loadSpots();
+    if (msg.changes.length === 0) return;
+    if (msg.changes[0].rev > spotsRev + 1) {
+        // Missed some events: ask for just what changed since our revision
+        return fetch('/api/spots?since=' + spotsRev)
+            .then(r => r.json())
+            .then(data => {
+                if (data.full || !applySpotChanges(data.changes)) return loadSpots();
+                spotsRev = Math.max(spotsRev, data.rev);
+                renderCurrentSpots();
+            });
+    }
+    if (!applySpotChanges(msg.changes)) return loadSpots();
+    renderCurrentSpots();
+}
+
+function applySpotChanges(changes) {
+    for (const change of changes) {
+        if (change.rev <= spotsRev) continue; // Already applied
+        if (change.op === 'remove') {
+            delete window.currentSpots[change.id];
+        } else if (window.currentSpots[change.id]) {
+            Object.assign(window.currentSpots[change.id], change.fields);
+        } else if (change.fields.lat !== undefined) {
+            window.currentSpots[change.id] = Object.assign({}, change.fields); // New spot, full row
+        } else {
+            return false;
+        }
+        spotsRev = change.rev;
+    }
+    return true;
+}
+
+function renderCurrentSpots() {
+    const spots = Object.values(window.currentSpots);
+    const el = document.getElementById('totalSpots');
+    if (el) el.innerText = spots.length;
+    renderList(spots);
+}
+
 function loadAnalytics() {
     fetch('/api/analytics')
         .then(r => r.json())
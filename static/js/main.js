@@ -13,13 +13,23 @@ document.addEventListener('DOMContentLoaded', () => {
         updateInterval: 100          // Delay tile update slightly to bundle requests
     }).addTo(map);
 
-    let allSpots = [];
+    let allSpots = []; // Spots in the current map view (plus our booked one)
     let markers = {};
+    // Below this zoom, or when the view holds more than SPOTS_PER_VIEW spots,
+    // the map shows server-side clusters (/api/spots/clusters) instead of one
+    // zone per spot; the list still shows the SPOTS_PER_VIEW nearest the centre
+    const SPOT_MIN_ZOOM = 15;
+    const SPOTS_PER_VIEW = 200;
+    let viewTruncated = false;
+    let viewRequest = 0;
+    let clusterLayer = null;
+    let clusterRequest = 0;
     let userLocation = null;
     let userMarker = null;
     let currentRouteLayer = null;
     let isNavigating = false;
     let navTargetSpot = null;
+    let socket = null;
 
     // Custom Icons
     const userIcon = L.divIcon({
@@ -53,6 +63,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         userMarker.bindPopup("You are here");
                         map.setView([latitude, longitude], 17); // Closer zoom for nav
                         fetchSpots(); // Initial fetch
+                        autoRoute();
                     }
 
                     // FOLLOW MODE 
@@ -94,104 +105,269 @@ document.addEventListener('DOMContentLoaded', () => {
             fetchSpots();
         }
 
+        openDeepLink();
+
         // Real-Time Updates (Socket.IO)
-        const socket = io();
+        // We only receive events for the map cells in view, so re-subscribe
+        // (and load the spots in the new view) whenever the map moves.
+        socket = io();
+        socket.on('connect', () => {
+            subscribeViewport();
+            if (spotsRev !== null) catchUpSpots(); // Reconnected: may have missed events
+        });
         socket.on('data_update', (msg) => {
             console.log("Live update:", msg);
-            fetchSpots();
+            applySpotUpdate(msg);
+        });
+
+        let moveTimer = null;
+        map.on('moveend', () => {
+            clearTimeout(moveTimer);
+            moveTimer = setTimeout(() => {
+                subscribeViewport();
+                fetchSpots();
+            }, 300);
+        });
+    }
+
+    function subscribeViewport() {
+        if (!socket || !socket.connected) return;
+        const b = map.getBounds();
+        const session = JSON.parse(localStorage.getItem('activeSession'));
+        socket.emit('subscribe_viewport', {
+            south: b.getSouth(), west: b.getWest(), north: b.getNorth(), east: b.getEast(),
+            spot_ids: session ? [session.spotId] : [] // Follow our booked spot even off-screen
         });
     }
 
     // 2. Fetch Data
-    function fetchSpots() {
-        fetch('/api/spots')
+    let spotsRev = null; // Revision allSpots is fully synced to (view fetch / catch-up)
+    let spotRevs = {};   // Last change revision applied per spot id
+
+    // Apply a data_update delta in place; fall back to a full fetch when we can't.
+    // Events are filtered to our viewport, so revisions have gaps by design:
+    // spotsRev only moves on view fetches and catch-ups.
+    function applySpotUpdate(msg) {
+        if (msg.resync || !Array.isArray(msg.changes) || spotsRev === null) return fetchSpots();
+        if (msg.changes.length === 0) return;
+        if (!applySpotChanges(msg.changes)) return fetchSpots();
+        refreshSpots();
+    }
+
+    function applySpotChanges(changes) {
+        for (const change of changes) {
+            if (change.rev <= (spotRevs[change.id] || spotsRev)) continue; // Already applied
+            if (change.op === 'remove') {
+                allSpots = allSpots.filter(s => s.id != change.id);
+                clearActiveSession(change.id);
+            } else {
+                const spot = allSpots.find(s => s.id == change.id);
+                if (spot) Object.assign(spot, change.fields);
+                else if (change.fields.lat !== undefined) allSpots.push(Object.assign({}, change.fields)); // New spot, full row
+                else return false;
+            }
+            spotRevs[change.id] = change.rev;
+        }
+        return true;
+    }
+
+    function catchUpSpots() {
+        fetch(`/api/spots?since=${spotsRev}&bbox=${map.getBounds().toBBoxString()}&limit=${SPOTS_PER_VIEW}`)
             .then(r => r.json())
-            .then(spots => {
-                // If we have user location, calculate real distances & sort
-                if (userLocation) {
-                    spots.forEach(spot => {
-                        spot._realDistance = getDistanceFromLatLonInKm(
-                            userLocation.lat, userLocation.lng,
-                            spot.lat, spot.lng
-                        );
-                        // Format for display (e.g., "1.2 km")
-                        spot.distance = spot._realDistance.toFixed(1) + " km";
+            .then(data => {
+                if (data.full) {
+                    spotRevs = {};
+                    spotsRev = data.rev;
+                    viewTruncated = data.truncated;
+                    withBookedSpot(data.spots).then(spots => {
+                        allSpots = spots;
+                        refreshSpots();
                     });
-
-                    // Sort by nearest
-                    spots.sort((a, b) => a._realDistance - b._realDistance);
+                } else if (applySpotChanges(data.changes)) {
+                    spotsRev = Math.max(spotsRev, data.rev);
+                    if (data.changes.length) refreshSpots();
+                } else {
+                    fetchSpots();
                 }
+            });
+    }
 
-                allSpots = spots;
-
-                // --- SELF-HEALING: Verify Active Session ---
-                const currentSession = JSON.parse(localStorage.getItem('activeSession'));
-                if (currentSession) {
-                    const spotStillExists = spots.find(s => s.id == currentSession.spotId);
-                    if (!spotStillExists) {
-                        console.warn("Active session spot no longer exists (Deleted by Admin). Auto-clearing.");
-                        // Clear Session
-                        if (window.sessionInterval) clearInterval(window.sessionInterval);
-                        clearInterval(window.sessionInterval);
-                        const widget = document.getElementById('sessionWidget');
-                        if (widget) widget.remove();
-                        localStorage.removeItem('activeSession');
-
-                        // Small non-blocking toast instead of alert to not annoy if it happens in background
-                        // But for now, alert is safer to ensure they know why it vanished
-                        // alert("Notice: Your active session was closed because the parking spot was removed.");
-                    }
-                }
+    // Recompute distances / order for allSpots and re-render
+    function refreshSpots() {
+        const spots = allSpots;
+        // If we have user location, calculate real distances & sort
+        if (userLocation) {
+            spots.forEach(spot => {
+                spot._realDistance = getDistanceFromLatLonInKm(
+                    userLocation.lat, userLocation.lng,
+                    spot.lat, spot.lng
+                );
+                // Format for display (e.g., "1.2 km")
+                spot.distance = spot._realDistance.toFixed(1) + " km";
+            });
+
+            // Sort by nearest
+            spots.sort((a, b) => a._realDistance - b._realDistance);
+        }
 
-                renderSpots(spots);
-
-                // AUTO-ROUTING LOGIC
-                if (userLocation && !window.hasAutoRouted && spots.length > 0) {
-                    window.hasAutoRouted = true;
-                    const nearest = spots.find(s => s.available > 0);
-                    if (nearest) {
-                        // Show visible notification or just center
-                        // Let's create a non-intrusive toast
-                        const toast = document.createElement('div');
-                        toast.innerHTML = `
-                            <div style="background: #10b981; color: white; padding: 12px 16px; border-radius: 8px; font-weight: 600; font-family: 'Inter', sans-serif; box-shadow: 0 4px 12px rgba(0,0,0,0.2); display: flex; align-items: center; gap: 8px;">
-                                <ion-icon name="location"></ion-icon>
-                                Nearest Spot Found: ${nearest.name}
+        renderSpots(spots);
+        renderClusters();
+    }
+
+    // --- SELF-HEALING: Verify Active Session ---
+    // allSpots only covers the map view, so the booked spot is looked up on
+    // its own when it is elsewhere; a 404 means it was deleted by an admin.
+    function withBookedSpot(spots) {
+        const session = JSON.parse(localStorage.getItem('activeSession'));
+        if (!session || spots.some(s => s.id == session.spotId)) return Promise.resolve(spots);
+        return fetch('/api/spots/' + session.spotId).then(r => {
+            if (r.status === 404) {
+                clearActiveSession(session.spotId);
+                return spots;
+            }
+            return r.ok ? r.json().then(spot => spots.concat([spot])) : spots;
+        }, () => spots);
+    }
+
+    function clearActiveSession(spotId) {
+        const currentSession = JSON.parse(localStorage.getItem('activeSession'));
+        if (!currentSession || currentSession.spotId != spotId) return;
+        console.warn("Active session spot no longer exists (Deleted by Admin). Auto-clearing.");
+        // Clear Session
+        if (window.sessionInterval) clearInterval(window.sessionInterval);
+        clearInterval(window.sessionInterval);
+        const widget = document.getElementById('sessionWidget');
+        if (widget) widget.remove();
+        localStorage.removeItem('activeSession');
+
+        // Small non-blocking toast instead of alert to not annoy if it happens in background
+        // But for now, alert is safer to ensure they know why it vanished
+        // alert("Notice: Your active session was closed because the parking spot was removed.");
+    }
+
+    function isClustered() {
+        return map.getZoom() < SPOT_MIN_ZOOM || viewTruncated;
+    }
+
+    function renderClusters() {
+        if (!isClustered()) {
+            if (clusterLayer) { map.removeLayer(clusterLayer); clusterLayer = null; }
+            return;
+        }
+        const request = ++clusterRequest;
+        fetch(`/api/spots/clusters?bbox=${map.getBounds().toBBoxString()}&zoom=${map.getZoom()}`)
+            .then(r => r.json())
+            .then(data => {
+                if (request !== clusterRequest) return; // The map moved again meanwhile
+                const layer = L.layerGroup();
+                data.clusters.forEach(c => {
+                    if (c.count === 1) {
+                        // Same privacy zone as an individual spot
+                        L.circle([c.lat, c.lng], {
+                            color: '#6366f1', fillColor: '#6366f1', fillOpacity: 0.15,
+                            radius: 120, weight: 1, dashArray: '4, 4'
+                        }).bindPopup(`
+                            <div style="color: black; min-width: 200px; font-family: 'Inter', sans-serif;">
+                                <div style="font-weight: 800; margin-bottom: 8px;"><span style="font-style:italic; opacity:0.8;">🔒 Protected Zone</span></div>
+                                <div style="margin-bottom: 12px; color: #4b5563; font-size: 0.9rem;">${c.available} Spaces • GH₵ ${c.price_min}/hr</div>
+                                <button onclick="reserveSpot(${c.id}, ${c.price_min})" style="width: 100%; background: #000; color: white; border: none; padding: 10px; border-radius: 6px; font-weight: 700; cursor: pointer;">
+                                    RESERVE TO UNLOCK
+                                </button>
                             </div>
-                        `;
-                        toast.style.cssText = "position: absolute; top: 20px; left: 50%; transform: translateX(-50%); z-index: 9999; animation: slideDown 0.5s ease-out;";
-                        document.body.appendChild(toast);
-
-                        // Auto-center and open popup
-                        setTimeout(() => {
-                            map.setView([nearest.lat, nearest.lng], 16);
-                            if (markers[nearest.id]) markers[nearest.id].openPopup();
-                            // Optional: Highlight card?
-                            toast.remove();
-                        }, 2500);
+                        `).addTo(layer);
+                        return;
                     }
-                }
+                    const size = c.count < 10 ? 34 : c.count < 100 ? 40 : 48;
+                    const price = c.price_min === c.price_max ? `GH₵ ${c.price_min}` : `GH₵ ${c.price_min}–${c.price_max}`;
+                    L.marker([c.lat, c.lng], {
+                        icon: L.divIcon({
+                            className: 'spot-cluster',
+                            html: `<div style="width: ${size}px; height: ${size}px; border-radius: 50%; background: rgba(99, 102, 241, 0.85); border: 2px solid white; color: white; font-weight: 700; display: flex; align-items: center; justify-content: center; box-shadow: 0 2px 8px rgba(0,0,0,0.3);">${c.count}</div>`,
+                            iconSize: [size, size],
+                            iconAnchor: [size / 2, size / 2]
+                        }),
+                        title: `${c.count} spots • ${c.available} spaces • ${price}/hr`
+                    }).on('click', () => map.setView([c.lat, c.lng], Math.min(map.getZoom() + 2, map.getMaxZoom())))
+                      .addTo(layer);
+                });
+                if (clusterLayer) map.removeLayer(clusterLayer);
+                clusterLayer = layer.addTo(map);
+            });
+    }
 
-                // Check for Deep Link (QR Code Scan)
-                const urlParams = new URLSearchParams(window.location.search);
-                const deepLinkSpotId = urlParams.get('spot_id');
-
-                if (deepLinkSpotId) {
-                    const spot = spots.find(s => s.id == deepLinkSpotId);
-                    if (spot) {
-                        // Wait a bit for map to settle
-                        setTimeout(() => {
-                            map.setView([spot.lat, spot.lng], 18);
-                            if (markers[spot.id]) markers[spot.id].openPopup();
-
-                            // Auto-open booking modal as requested
-                            reserveSpot(spot.id, spot.price);
-                        }, 500);
-                    }
+    // Load the spots in the current map view
+    function fetchSpots() {
+        const request = ++viewRequest;
+        fetch(`/api/spots?bbox=${map.getBounds().toBBoxString()}&limit=${SPOTS_PER_VIEW}`)
+            .then(r => {
+                const rev = r.headers.get('X-Spots-Revision');
+                const truncated = r.headers.get('X-Spots-Truncated') === 'true';
+                return r.json().then(spots => ({ rev, truncated, spots }));
+            })
+            .then(view => withBookedSpot(view.spots).then(spots => Object.assign(view, { spots })))
+            .then(view => {
+                if (request !== viewRequest) return; // The map moved again meanwhile
+                if (view.rev !== null) spotsRev = parseInt(view.rev, 10);
+                spotRevs = {};
+                viewTruncated = view.truncated;
+                allSpots = view.spots;
+                refreshSpots();
+            });
+    }
+
+    // AUTO-ROUTING LOGIC
+    function autoRoute() {
+        if (!userLocation || window.hasAutoRouted) return;
+        window.hasAutoRouted = true;
+        fetch(`/api/spots/nearby?lat=${userLocation.lat}&lng=${userLocation.lng}&radius=50000&limit=20`)
+            .then(r => r.json())
+            .then(spots => {
+                const nearest = spots.find(s => s.available > 0);
+                if (nearest) {
+                    // Show visible notification or just center
+                    // Let's create a non-intrusive toast
+                    const toast = document.createElement('div');
+                    toast.innerHTML = `
+                        <div style="background: #10b981; color: white; padding: 12px 16px; border-radius: 8px; font-weight: 600; font-family: 'Inter', sans-serif; box-shadow: 0 4px 12px rgba(0,0,0,0.2); display: flex; align-items: center; gap: 8px;">
+                            <ion-icon name="location"></ion-icon>
+                            Nearest Spot Found: ${nearest.name}
+                        </div>
+                    `;
+                    toast.style.cssText = "position: absolute; top: 20px; left: 50%; transform: translateX(-50%); z-index: 9999; animation: slideDown 0.5s ease-out;";
+                    document.body.appendChild(toast);
+
+                    // Auto-center and open popup
+                    setTimeout(() => {
+                        map.setView([nearest.lat, nearest.lng], 16);
+                        map.once('moveend', () => setTimeout(() => { if (markers[nearest.id]) markers[nearest.id].openPopup(); }, 800));
+                        // Optional: Highlight card?
+                        toast.remove();
+                    }, 2500);
                 }
             });
     }
 
+    // Check for Deep Link (QR Code Scan)
+    function openDeepLink() {
+        const urlParams = new URLSearchParams(window.location.search);
+        const deepLinkSpotId = urlParams.get('spot_id');
+        if (!deepLinkSpotId) return;
+
+        fetch('/api/spots/' + encodeURIComponent(deepLinkSpotId))
+            .then(r => r.ok ? r.json() : null)
+            .then(spot => {
+                if (!spot) return;
+                // Wait a bit for map to settle
+                setTimeout(() => {
+                    map.setView([spot.lat, spot.lng], 18);
+                    if (markers[spot.id]) markers[spot.id].openPopup();
+
+                    // Auto-open booking modal as requested
+                    reserveSpot(spot.id, spot.price);
+                }, 500);
+            });
+    }
+
     function renderSpots(spots) {
         const listEl = document.getElementById('spotsList');
         listEl.innerHTML = '';
@@ -206,6 +382,7 @@ document.addEventListener('DOMContentLoaded', () => {
         // Clear Markers
         Object.values(markers).forEach(m => map.removeLayer(m));
         markers = {};
+        const clustered = isClustered();
 
         // Date Logic for Availability
         const nowLocal = new Date();
@@ -219,86 +396,90 @@ document.addEventListener('DOMContentLoaded', () => {
             const activeSession = JSON.parse(localStorage.getItem('activeSession'));
             const isBookedByUser = activeSession && activeSession.spotId == spot.id;
 
-            let marker;
-            let typeColor = '#6366f1';
-            let typeIconName = 'car-sport';
-            if (spot.vehicle_type === 'bike') { typeColor = '#f59e0b'; typeIconName = 'bicycle'; }
-            if (spot.vehicle_type === 'truck') { typeColor = '#10b981'; typeIconName = 'bus'; }
-
-            if (isBookedByUser) {
-                // --- COMMITMENT MODE: EXACT PIN ---
-                const iconHtml = `
-                    <div style="background-color: ${typeColor}; width: 34px; height: 34px; border-radius: 50%; display: flex; align-items: center; justify-content: center; border: 2px solid white; box-shadow: 0 0 15px ${typeColor}; animation: bounce 1.5s infinite;">
-                        <ion-icon name="flag" style="color: black; font-size: 1.4rem;"></ion-icon>
-                    </div>`;
-
-                const customIcon = L.divIcon({
-                    className: 'custom-pin',
-                    html: iconHtml,
-                    iconSize: [34, 34],
-                    iconAnchor: [17, 34],
-                    popupAnchor: [0, -34]
-                });
+            // With many spots, server-side clusters stand in for individual zones
+            // (the booked spot keeps its exact pin)
+            if (!clustered || isBookedByUser) {
+                let marker;
+                let typeColor = '#6366f1';
+                let typeIconName = 'car-sport';
+                if (spot.vehicle_type === 'bike') { typeColor = '#f59e0b'; typeIconName = 'bicycle'; }
+                if (spot.vehicle_type === 'truck') { typeColor = '#10b981'; typeIconName = 'bus'; }
+
+                if (isBookedByUser) {
+                    // --- COMMITMENT MODE: EXACT PIN ---
+                    const iconHtml = `
+                        <div style="background-color: ${typeColor}; width: 34px; height: 34px; border-radius: 50%; display: flex; align-items: center; justify-content: center; border: 2px solid white; box-shadow: 0 0 15px ${typeColor}; animation: bounce 1.5s infinite;">
+                            <ion-icon name="flag" style="color: black; font-size: 1.4rem;"></ion-icon>
+                        </div>`;
+
+                    const customIcon = L.divIcon({
+                        className: 'custom-pin',
+                        html: iconHtml,
+                        iconSize: [34, 34],
+                        iconAnchor: [17, 34],
+                        popupAnchor: [0, -34]
+                    });
 
-                marker = L.marker([spot.lat, spot.lng], { icon: customIcon }).addTo(map);
-            } else {
-                // --- DISCOVERY MODE: PRIVACY ZONE ---
-                // Render a circle representing the "Area/Zone"
-                marker = L.circle([spot.lat, spot.lng], {
-                    color: typeColor,
-                    fillColor: typeColor,
-                    fillOpacity: 0.15,
-                    radius: 120, // 120m radius fuzz
-                    weight: 1,
-                    dashArray: '4, 4'
-                }).addTo(map);
-            }
+                    marker = L.marker([spot.lat, spot.lng], { icon: customIcon }).addTo(map);
+                } else {
+                    // --- DISCOVERY MODE: PRIVACY ZONE ---
+                    // Render a circle representing the "Area/Zone"
+                    marker = L.circle([spot.lat, spot.lng], {
+                        color: typeColor,
+                        fillColor: typeColor,
+                        fillOpacity: 0.15,
+                        radius: 120, // 120m radius fuzz
+                        weight: 1,
+                        dashArray: '4, 4'
+                    }).addTo(map);
+                }
 
-            // --- NAME PROTECTION ---
-            const displayName = isBookedByUser ? spot.name : `<span style="font-style:italic; opacity:0.8;">🔒 Protected Zone</span>`;
+                // --- NAME PROTECTION ---
+                const displayName = isBookedByUser ? spot.name : `<span style="font-style:italic; opacity:0.8;">🔒 Protected Zone</span>`;
 
-            // Popup Content
-            // Popup Content
-            marker.bindPopup(`
-                <div style="color: black; text-align: left; min-width: 220px; font-family: 'Inter', sans-serif; overflow: hidden; border-radius: 8px;">
+                // Popup Content
+                // Popup Content
+                marker.bindPopup(`
+                    <div style="color: black; text-align: left; min-width: 220px; font-family: 'Inter', sans-serif; overflow: hidden; border-radius: 8px;">
                     
-                    ${spot.image_url ? `
-                    <div style="height: 100px; margin: -14px -20px 12px -20px; position: relative;">
-                         <img src="${spot.image_url}" style="width: 100%; height: 100%; object-fit: cover;">
-                         <div style="position: absolute; bottom: 0; left: 0; width: 100%; height: 40px; background: linear-gradient(to top, white, transparent);"></div>
-                    </div>
-                    ` : ''}
-
-                    <div style="display: flex; align-items: center; justify-content: space-between; margin-bottom: 8px;">
-                        <div style="font-weight: 800; font-size: 1.1rem; line-height: 1.2;">${displayName}</div>
-                        <div style="background: ${isBookedByUser ? '#d1fae5' : '#f3f4f6'}; color: ${isBookedByUser ? '#065f46' : '#6b7280'}; font-size: 0.7rem; font-weight: 700; padding: 2px 6px; border-radius: 4px; text-transform: uppercase;">
-                            ${isBookedByUser ? 'UNLOCKED' : 'HIDDEN'}
+                        ${spot.image_url ? `
+                        <div style="height: 100px; margin: -14px -20px 12px -20px; position: relative;">
+                             <img src="${spot.image_url}" style="width: 100%; height: 100%; object-fit: cover;">
+                             <div style="position: absolute; bottom: 0; left: 0; width: 100%; height: 40px; background: linear-gradient(to top, white, transparent);"></div>
                         </div>
-                    </div>
-                    
-                    <div style="display: flex; align-items: center; gap: 8px; margin-bottom: 12px; color: #4b5563; font-size: 0.9rem;">
-                         <ion-icon name="${typeIconName}"></ion-icon> 
-                         <span>${spot.available} Spaces • GH₵ ${spot.price}/hr</span>
-                    </div>
+                        ` : ''}
 
-                    ${isBookedByUser ? `
-                        <div style="margin-bottom: 12px; padding: 8px; background: #ecfdf5; border-radius: 6px; border: 1px solid #10b981; font-size: 0.8rem; color: #065f46;">
-                            📍 Exact location revealed.
+                        <div style="display: flex; align-items: center; justify-content: space-between; margin-bottom: 8px;">
+                            <div style="font-weight: 800; font-size: 1.1rem; line-height: 1.2;">${displayName}</div>
+                            <div style="background: ${isBookedByUser ? '#d1fae5' : '#f3f4f6'}; color: ${isBookedByUser ? '#065f46' : '#6b7280'}; font-size: 0.7rem; font-weight: 700; padding: 2px 6px; border-radius: 4px; text-transform: uppercase;">
+                                ${isBookedByUser ? 'UNLOCKED' : 'HIDDEN'}
+                            </div>
                         </div>
-                        <button onclick="startAppNavigation({lat:${spot.lat}, lng:${spot.lng}, name:'${spot.name.replace(/'/g, "\\'")}'})" style="width: 100%; background: #10b981; color: white; border: none; padding: 10px; border-radius: 6px; font-weight: 700; cursor: pointer;">
-                            NAVIGATE TO ENTRANCE
-                        </button>
-                    ` : `
-                        <div style="margin-bottom: 12px; font-size: 0.8rem; color: #6b7280; font-style: italic;">
-                            <ion-icon name="lock-closed" style="vertical-align: middle;"></ion-icon> Exact name & location hidden.
+                    
+                        <div style="display: flex; align-items: center; gap: 8px; margin-bottom: 12px; color: #4b5563; font-size: 0.9rem;">
+                             <ion-icon name="${typeIconName}"></ion-icon> 
+                             <span>${spot.available} Spaces • GH₵ ${spot.price}/hr</span>
                         </div>
-                        <button onclick="reserveSpot(${spot.id}, ${spot.price})" style="width: 100%; background: #000; color: white; border: none; padding: 10px; border-radius: 6px; font-weight: 700; cursor: pointer;">
-                            RESERVE TO UNLOCK
-                        </button>
-                    `}
-                </div>
-            `);
-            markers[spot.id] = marker;
+
+                        ${isBookedByUser ? `
+                            <div style="margin-bottom: 12px; padding: 8px; background: #ecfdf5; border-radius: 6px; border: 1px solid #10b981; font-size: 0.8rem; color: #065f46;">
+                                📍 Exact location revealed.
+                            </div>
+                            <button onclick="startAppNavigation({lat:${spot.lat}, lng:${spot.lng}, name:'${spot.name.replace(/'/g, "\\'")}'})" style="width: 100%; background: #10b981; color: white; border: none; padding: 10px; border-radius: 6px; font-weight: 700; cursor: pointer;">
+                                NAVIGATE TO ENTRANCE
+                            </button>
+                        ` : `
+                            <div style="margin-bottom: 12px; font-size: 0.8rem; color: #6b7280; font-style: italic;">
+                                <ion-icon name="lock-closed" style="vertical-align: middle;"></ion-icon> Exact name & location hidden.
+                            </div>
+                            <button onclick="reserveSpot(${spot.id}, ${spot.price})" style="width: 100%; background: #000; color: white; border: none; padding: 10px; border-radius: 6px; font-weight: 700; cursor: pointer;">
+                                RESERVE TO UNLOCK
+                            </button>
+                        `}
+                    </div>
+                `);
+                markers[spot.id] = marker;
+            }
 
             // External Maps Link (Fallback)
             const navUrl = `https://www.google.com/maps/dir/?api=1&destination=${spot.lat},${spot.lng}`;
@@ -936,8 +1117,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 bookingData.payment_reference = response.reference;
                 bookingData.payment_method = 'paystack';
 
-                // Call Backend
-                fetch(`/api/reserve/${spotId}`, {
+                // Call Backend; retried while the server reports the payment as still being confirmed
+                const submitBooking = (attempt) => fetch(`/api/reserve/${spotId}`, {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify(bookingData)
@@ -957,6 +1138,8 @@ document.addEventListener('DOMContentLoaded', () => {
                             // Trigger Success Logic
                             startSessionSuccess(spotId, duration, bookingData.vehicle_plate, response.reference, DEPOSIT_AMOUNT);
 
+                        } else if (res.pending && attempt < 10) {
+                            setTimeout(() => submitBooking(attempt + 1), 2000);
                         } else {
                             alert("Booking Failed: " + res.message);
                         }
@@ -965,6 +1148,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         console.error(err);
                         alert("System Error: " + err.message);
                     });
+                submitBooking(0);
             },
             onClose: function () {
                 alert('Transaction was not completed.');
@@ -996,6 +1180,7 @@ document.addEventListener('DOMContentLoaded', () => {
             };
 
             localStorage.setItem('activeSession', JSON.stringify(sessionData));
+            subscribeViewport(); // Join the booked spot's room for admin cancellations
 
             // 3. Start Enforcer
             startSessionMonitor();
@@ -1176,7 +1361,7 @@ document.addEventListener('DOMContentLoaded', () => {
     startSessionMonitor(); // specific check on load
 
     // --- ADMIN CANCELLATION LISTENER ---
-    const socket = io(); // Ensure we have socket instance or reuse existing if possible
+    // Delivered to the booked spot's room (see subscribeViewport)
     socket.on('force_end_session', (data) => {
         const session = JSON.parse(localStorage.getItem('activeSession'));
         if (session && session.spotId == data.spot_id) {
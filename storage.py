@@ -0,0 +1,536 @@
+"""Local SQLite storage with the same query-builder interface as SupabaseLite.
+
+LocalStore answers the table()/rpc()/auth calls that app.py's helpers make,
+so the helpers don't care where rows live. Each table is `(id, data)`:
+the row is stored as JSON and filtered with json_extract(), with
+expression indexes on the columns the app filters and sorts on. WAL mode
+lets every worker on the host share one file.
+
+With a `remote` client (a SupabaseLite) the store works local-first:
+- reads are served from SQLite;
+- every write is also queued in an outbox table, in the same transaction;
+- sync() replays the outbox against Supabase in order;
+- pull() refreshes the local tables from Supabase when nothing is queued.
+
+Replays are keyed by primary key (upsert whole rows, update/delete by id),
+so retrying after a dropped connection is harmless. Concurrent writes from
+elsewhere are last-writer-wins. Rows created locally take millisecond-
+timestamp ids, as the legacy JSON files did, which stay clear of the ids
+Supabase's identity columns hand out.
+"""
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from shared_state import _Immediate
+
+INT_ID_TABLES = ('spots', 'transactions', 'sessions')
+TABLES = INT_ID_TABLES + ('users',)
+# (name, table, expression, where); expressions must be spelled exactly as _column() does
+INDEXES = [
+    ('transactions_user_id', 'transactions', "json_extract(data, '$.user_id'), id", None),
+    ('transactions_spot_id', 'transactions', "json_extract(data, '$.spot_id')", None),
+    ('transactions_created_at', 'transactions', "json_extract(data, '$.created_at')", None),
+    ('sessions_spot_id', 'sessions', "json_extract(data, '$.spot_id')", None),
+    ('sessions_created_at', 'sessions', "json_extract(data, '$.created_at')", None),
+]
+UNIQUE_INDEXES = [
+    # Mirrors transactions_deposit_ref_key in migration_payments.sql
+    ('transactions_deposit_ref', 'transactions', "json_extract(data, '$.payment_ref')",
+     "json_extract(data, '$.type') = 'Deposit'"),
+]
+OPS = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+
+def _column(name):
+    return 'id' if name == 'id' else f"json_extract(data, '$.{name}')"
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class LocalResponse:
+    def __init__(self, data, count=None, status=None):
+        self.data = data
+        self.count = count
+        self.status = status
+
+
+class LocalAuthResponse:
+    def __init__(self, user, error=None):
+        self.user = user
+        self.error = error
+        self.session = None # no access tokens for local accounts
+
+
+class LocalStore:
+    def __init__(self, path, remote=None, legacy_root=None):
+        self.path = path
+        self.remote = remote
+        self.legacy_root = legacy_root  # seed empty tables from the JSON dumps here on first use
+        self.http = remote.http if remote else None
+        self.local = threading.local()
+        self.id_lock = threading.Lock()
+        self.last_id = 0
+        self.auth = remote.auth if remote else LocalAuth(self)
+        self.synced = 0
+        self.failed = 0
+        self.last_error = None
+        self.last_sync = None
+        self.last_pull = None
+        self.on_pull = None  # on_pull(tables) after pull() replaced local rows
+        self.thread = None
+        self.stopped = threading.Event()
+        self.ready = False
+        self.ready_lock = threading.Lock()
+
+    def _create(self, conn):
+        # The file, its tables and any legacy seed are made on first use, not when the app is imported
+        with self.ready_lock:
+            if self.ready:
+                return
+            with _Immediate(conn) as db:
+                for name in TABLES:
+                    kind = 'integer' if name in INT_ID_TABLES else 'text'
+                    db.execute(f"create table if not exists {name} (id {kind} primary key, data text not null)")
+                for name, table, expr, where in INDEXES:
+                    db.execute(f"create index if not exists {name} on {table} ({expr})")
+                for name, table, expr, where in UNIQUE_INDEXES:
+                    db.execute(f"create unique index if not exists {name} on {table} ({expr}) where {where}")
+                db.execute("create table if not exists outbox (seq integer primary key autoincrement, tbl text, "
+                           "op text, payload text, attempts integer not null default 0, "
+                           "failed integer not null default 0, error text)")
+                db.execute("create table if not exists auth_users (email text primary key, id text, salt text, hash text)")
+                db.execute("create table if not exists meta (name text primary key, value text)")
+            # Other threads wait on ready_lock, so none of them sees the tables half seeded
+            if self.legacy_root and self.is_empty():
+                self.import_legacy(self.legacy_root)
+            self.ready = True
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            self.local.conn, self.local.pid = conn, os.getpid()
+            if not self.ready:
+                self._create(conn)
+        return conn
+
+    def _tx(self):
+        return _Immediate(self._conn())
+
+    def table(self, name):
+        return LocalTable(self, name)
+
+    def rpc(self, fn, params=None):
+        # No Postgres functions locally; callers treat 404 as "not installed" and fall back
+        return _Missing()
+
+    def is_empty(self):
+        db = self._conn()
+        return all(db.execute(f"select 1 from {t} limit 1").fetchone() is None for t in TABLES)
+
+    def next_id(self, db, table):
+        if self.remote is None:
+            return (db.execute(f"select max(id) from {table}").fetchone()[0] or 0) + 1
+        with self.id_lock:
+            self.last_id = max(int(time.time() * 1000), self.last_id + 1)
+            return self.last_id
+
+    def enqueue(self, db, table, op, payload):
+        if self.remote is not None:
+            db.execute("insert into outbox (tbl, op, payload) values (?, ?, ?)", (table, op, json.dumps(payload)))
+
+    def import_legacy(self, root):
+        """Load parking_data.json / users.json / transactions.json / active_sessions.json into empty tables."""
+        def load(fname):
+            path = os.path.join(root, fname)
+            if not os.path.exists(path):
+                return []
+            with open(path) as f:
+                return json.load(f)
+
+        spots = [{k: v for k, v in s.items() if k != 'distance'} for s in load('parking_data.json')]
+        users = [{'id': u['id'], 'name': u.get('name'), 'points': u.get('points', 0), 'tier': u.get('tier', 'Bronze'),
+                  'wallet_balance': float(u.get('wallet_balance', 0) or 0)} for u in load('users.json')]
+        uid = users[0]['id'] if users else None
+        txns = []
+        for t in load('transactions.json'):
+            ts = t.get('timestamp') or time.time()
+            txns.append({'id': t.get('id'), 'user_id': t.get('user_id', uid), 'type': t.get('type', 'Booking'),
+                         'amount': t.get('amount', t.get('price')), 'user_name': t.get('user_name'),
+                         'payment_ref': t.get('payment_ref'), 'timestamp': ts,
+                         'date': t.get('date') or time.strftime('%Y-%m-%d', time.localtime(ts)),
+                         'spot_id': t.get('spot_id'), 'spot_name': t.get('spot_name'),
+                         'vehicle_plate': t.get('vehicle_plate'),
+                         'created_at': datetime.fromtimestamp(ts, timezone.utc).isoformat()})
+        for name, rows in (('spots', spots), ('users', users), ('transactions', txns),
+                           ('sessions', load('active_sessions.json'))):
+            if rows:
+                self.table(name).insert(rows).execute()
+
+    # --- Sync with Supabase ---
+
+    def _take_lease(self, seconds=30):
+        # One worker syncs at a time; the lease lapses if that worker dies
+        now = time.time()
+        me = f"{os.getpid()}:{id(self)}"
+        with self._tx() as db:
+            row = db.execute("select value from meta where name = 'sync_lease'").fetchone()
+            holder, until = json.loads(row[0]) if row else (None, 0)
+            if holder not in (None, me) and until > now:
+                return False
+            db.execute("insert into meta (name, value) values ('sync_lease', ?) "
+                       "on conflict (name) do update set value = excluded.value", (json.dumps([me, now + seconds]),))
+        return True
+
+    def pending(self):
+        return self._conn().execute("select count(*) from outbox where failed = 0").fetchone()[0]
+
+    def _replay(self, table, op, payload):
+        q = self.remote.table(table)
+        if op == 'upsert':
+            return q.upsert(payload['rows'], on_conflict='id').execute()
+        if op == 'update':
+            return q.update(payload['data']).in_('id', payload['ids']).execute()
+        return q.delete().in_('id', payload['ids']).execute()
+
+    def sync(self, limit=200):
+        """Replay queued writes against Supabase, oldest first.
+
+        Stops at the first network or server error so writes land in
+        order; they are retried on the next call. A write Supabase refuses
+        outright (4xx) is marked failed and kept for inspection.
+        Returns the number of writes applied.
+        """
+        if self.remote is None or not self._take_lease():
+            return 0
+        db = self._conn()
+        done = 0
+        for seq, table, op, payload in db.execute(
+                "select seq, tbl, op, payload from outbox where failed = 0 order by seq limit ?", (limit,)).fetchall():
+            res = self._replay(table, op, json.loads(payload))
+            if res.status is None or res.status >= 500 or res.status == 429:
+                self.last_error = f"{table} {op}: {res.status or 'no response'}"
+                db.execute("update outbox set attempts = attempts + 1, error = ? where seq = ?", (self.last_error, seq))
+                break
+            if res.status >= 400:
+                self.failed += 1
+                self.last_error = f"{table} {op}: {res.status}"
+                db.execute("update outbox set attempts = attempts + 1, failed = 1, error = ? where seq = ?",
+                           (self.last_error, seq))
+                continue
+            db.execute("delete from outbox where seq = ?", (seq,))
+            done += 1
+        self.synced += done
+        self.last_sync = time.time()
+        return done
+
+    def pull(self, tables=TABLES, page=1000):
+        """Replace local tables with Supabase's copy; skipped while writes are queued."""
+        if self.remote is None or self.pending():
+            return []
+        fresh = {}
+        for table in tables:
+            rows, start = [], 0
+            while True:
+                res = self.remote.table(table).select("*").order('id').range(start, start + page - 1).execute()
+                if res.data is None:
+                    return []
+                rows.extend(res.data)
+                if len(res.data) < page:
+                    break
+                start += page
+            fresh[table] = rows
+        with self._tx() as db:
+            if db.execute("select count(*) from outbox where failed = 0").fetchone()[0]:
+                return []  # a write slipped in while we were reading
+            for table, rows in fresh.items():
+                db.execute(f"delete from {table}")
+                db.executemany(f"insert into {table} (id, data) values (?, ?)",
+                               [(r['id'], json.dumps(r)) for r in rows])
+        self.last_pull = time.time()
+        if self.on_pull:
+            self.on_pull(list(fresh))
+        return list(fresh)
+
+    def start(self, spawn=None, interval=2.0, pull_interval=60.0):
+        # spawn(fn) starts fn in the background (socketio.start_background_task under eventlet/gevent)
+        if self.remote is None or self.thread is not None:
+            return self
+        self.thread = (spawn or self._spawn_thread)(lambda: self._run(interval, pull_interval))
+        return self
+
+    @staticmethod
+    def _spawn_thread(fn):
+        t = threading.Thread(target=fn, name='storage-sync', daemon=True)
+        t.start()
+        return t
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self, interval, pull_interval):
+        delay = interval
+        while not self.stopped.is_set():
+            try:
+                self.sync()
+                backlog = self.pending()
+                if not backlog and (self.last_pull is None or time.time() - self.last_pull > pull_interval):
+                    self.pull()
+                # back off while Supabase is unreachable, up to a minute
+                delay = min(delay * 2, 60.0) if backlog and self.last_error else interval
+            except Exception as e:
+                print(f"Storage sync failed: {e}")
+                delay = min(delay * 2, 60.0)
+            self.stopped.wait(delay)
+
+    def stats(self):
+        db = self._conn()
+        return {
+            'path': self.path,
+            'mode': 'local-first' if self.remote else 'local',
+            'pending': self.pending(),
+            'failed': db.execute("select count(*) from outbox where failed = 1").fetchone()[0],
+            'synced': self.synced,
+            'last_error': self.last_error,
+            'last_sync': self.last_sync,
+            'last_pull': self.last_pull
+        }
+
+
+class _Missing:
+    def execute(self):
+        return LocalResponse(None, status=404)
+
+
+class LocalAuth:
+    """Email/password accounts kept in the local file (PBKDF2-SHA256), for stores with no Supabase."""
+
+    ROUNDS = 200_000
+
+    def __init__(self, store):
+        self.store = store
+
+    def _hash(self, password, salt):
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), self.ROUNDS).hex()
+
+    def sign_up(self, credentials):
+        email, password = credentials.get('email'), credentials.get('password') or ''
+        if not email or len(password) < 6:
+            return LocalAuthResponse(None, error='Password should be at least 6 characters')
+        salt = secrets.token_hex(16)
+        user = {'id': str(uuid.uuid4()), 'email': email}
+        try:
+            with self.store._tx() as db:
+                db.execute("insert into auth_users (email, id, salt, hash) values (?, ?, ?, ?)",
+                           (email, user['id'], salt, self._hash(password, salt)))
+        except sqlite3.IntegrityError:
+            return LocalAuthResponse(None, error='User already registered')
+        return LocalAuthResponse(user)
+
+    def sign_in_with_password(self, credentials):
+        email, password = credentials.get('email'), credentials.get('password') or ''
+        row = self.store._conn().execute("select id, salt, hash from auth_users where email = ?", (email,)).fetchone()
+        if row is None or not secrets.compare_digest(self._hash(password, row[1]), row[2]):
+            return LocalAuthResponse(None, error='Invalid login credentials')
+        return LocalAuthResponse({'id': row[0], 'email': email})
+
+
+class LocalTable:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.method = 'GET'
+        self.columns = None
+        self.count = None
+        self.filters = []
+        self.order_by = None
+        self.limit_n = None
+        self.offset_n = None
+        self.data = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.is_single = False
+
+    def select(self, columns="*", count=None):
+        self.method = 'GET'
+        self.columns = None if columns.strip() == '*' else [c.strip() for c in columns.split(',')]
+        self.count = count
+        return self
+
+    def insert(self, data):
+        self.method = 'POST'
+        self.data = data
+        return self
+
+    def upsert(self, data, on_conflict=None, ignore_duplicates=False):
+        self.method = 'UPSERT'
+        self.data = data
+        self.on_conflict = on_conflict or 'id'
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, data):
+        self.method = 'PATCH'
+        self.data = data
+        return self
+
+    def delete(self):
+        self.method = 'DELETE'
+        return self
+
+    def _filter(self, column, op, value):
+        self.filters.append((column, op, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, 'eq', value)
+
+    def neq(self, column, value):
+        return self._filter(column, 'neq', value)
+
+    def gt(self, column, value):
+        return self._filter(column, 'gt', value)
+
+    def gte(self, column, value):
+        return self._filter(column, 'gte', value)
+
+    def lt(self, column, value):
+        return self._filter(column, 'lt', value)
+
+    def lte(self, column, value):
+        return self._filter(column, 'lte', value)
+
+    def in_(self, column, values):
+        return self._filter(column, 'in', list(values))
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, count):
+        self.limit_n = int(count)
+        return self
+
+    def offset(self, count):
+        self.offset_n = int(count)
+        return self
+
+    def range(self, start, end):
+        self.offset_n, self.limit_n = int(start), int(end) - int(start) + 1
+        return self
+
+    def after(self, column, value, desc=False):
+        return self._filter(column, 'lt' if desc else 'gt', value)
+
+    def single(self):
+        self.is_single = True
+        return self
+
+    def _where(self):
+        clauses, args = [], []
+        for column, op, value in self.filters:
+            col = _column(column)
+            if op == 'in':
+                if not value:
+                    clauses.append('0')
+                    continue
+                clauses.append(f"{col} in ({','.join('?' * len(value))})")
+                args.extend(value)
+            else:
+                clauses.append(f"{col} {OPS[op]} ?")
+                args.append(value)
+        return (' where ' + ' and '.join(clauses) if clauses else ''), args
+
+    def _rows(self, db, paged=True):
+        where, args = self._where()
+        sql = f"select data from {self.name}{where}"
+        if self.order_by:
+            sql += f" order by {_column(self.order_by[0])} {'desc' if self.order_by[1] else 'asc'}"
+        if paged and (self.limit_n is not None or self.offset_n):
+            sql += " limit ? offset ?"
+            args += [-1 if self.limit_n is None else self.limit_n, self.offset_n or 0]
+        return [json.loads(r[0]) for r in db.execute(sql, args)]
+
+    def _reply(self, rows, count=None, status=200):
+        if self.is_single:
+            return LocalResponse(rows[0], status=status) if len(rows) == 1 else LocalResponse(None, status=406)
+        return LocalResponse(rows, count=count, status=status)
+
+    def _write(self, db, rows):
+        db.executemany(f"update {self.name} set data = ? where id = ?", [(json.dumps(r), r['id']) for r in rows])
+
+    def execute(self):
+        try:
+            if self.method == 'GET':
+                db = self.store._conn()
+                rows = self._rows(db)
+                count = None
+                if self.count:
+                    where, args = self._where()
+                    count = db.execute(f"select count(*) from {self.name}{where}", args).fetchone()[0]
+                if self.columns:
+                    rows = [{c: r.get(c) for c in self.columns} for r in rows]
+                return self._reply(rows, count)
+            with self.store._tx() as db:
+                return self._apply(db)
+        except sqlite3.IntegrityError as e:
+            print(f"Local store conflict on {self.name}: {e}")
+            return LocalResponse(None, status=409)
+        except sqlite3.Error as e:
+            print(f"Local store error on {self.name}: {e}")
+            return LocalResponse(None)
+
+    def _new_row(self, db, row):
+        row = dict(row)
+        if row.get('id') is None:
+            row['id'] = self.store.next_id(db, self.name) if self.name in INT_ID_TABLES else str(uuid.uuid4())
+        if self.name != 'users':
+            row.setdefault('created_at', _now_iso())
+        return row
+
+    def _apply(self, db):
+        store, name = self.store, self.name
+        if self.method in ('POST', 'UPSERT'):
+            incoming = self.data if isinstance(self.data, list) else [self.data]
+            out = []
+            for row in incoming:
+                existing = None
+                if self.method == 'UPSERT' and row.get(self.on_conflict) is not None:
+                    found = db.execute(f"select data from {name} where {_column(self.on_conflict)} = ?",
+                                       (row[self.on_conflict],)).fetchone()
+                    existing = json.loads(found[0]) if found else None
+                if existing is not None:
+                    if self.ignore_duplicates:
+                        continue
+                    row = {**existing, **row}
+                    self._write(db, [row])
+                else:
+                    row = self._new_row(db, row)
+                    db.execute(f"insert into {name} (id, data) values (?, ?)", (row['id'], json.dumps(row)))
+                out.append(row)
+            if out:
+                store.enqueue(db, name, 'upsert', {'rows': out})
+            return self._reply(out, status=201)
+        rows = self._rows(db, paged=False)
+        ids = [r['id'] for r in rows]
+        if self.method == 'PATCH':
+            rows = [{**r, **self.data} for r in rows]
+            self._write(db, rows)
+            if ids:
+                store.enqueue(db, name, 'update', {'ids': ids, 'data': self.data})
+            return self._reply(rows)
+        db.executemany(f"delete from {name} where id = ?", [(i,) for i in ids])
+        if ids:
+            store.enqueue(db, name, 'delete', {'ids': ids})
+        return self._reply(rows)
@@ -0,0 +1,103 @@
+"""Shared fixtures: the app, imported once, against local fake servers.
+
+app.py reads its settings from the environment at import, so one session
+runs it against a FakeSupabase and a FakePaystack (benchmarks/) with local
+token checks on. The `app` fixture empties the fake tables and the app's
+caches before each test.
+"""
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fake_supabase  # noqa: E402
+from fake_paystack import FakePaystack  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+
+PAYSTACK_WAIT = 0.25
+
+
+@pytest.fixture(scope='session')
+def supa():
+    fake = FakeSupabase().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture(scope='session')
+def paystack():
+    fake = FakePaystack(secret='sk_live_fake').start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture(scope='session')
+def app_module(supa, paystack):
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in {'SUPABASE_URL': supa.url, 'SUPABASE_KEY': 'test',
+                            'SUPABASE_JWT_SECRET': fake_supabase.JWT_SECRET,
+                            'PAYSTACK_SECRET_KEY': paystack.secret, 'PAYSTACK_BASE_URL': paystack.url,
+                            'PAYSTACK_WAIT': str(PAYSTACK_WAIT), 'SESSION_EXPIRY': 'off',
+                            'RATE_LIMITS': 'off', 'STORAGE': 'supabase'}.items():
+            mp.setenv(name, value)
+        for name in ('SHARED_STATE_URL', 'WRITE_BEHIND', 'SOCKETIO_MESSAGE_QUEUE', 'METRICS'):
+            mp.delenv(name, raising=False)
+        import app
+    return app
+
+
+@pytest.fixture
+def app(app_module, supa, monkeypatch):
+    store = supa.store
+    with store.lock:
+        for name in list(store.tables):
+            store.tables[name] = []
+        store.next_id.clear()
+    supa.users.clear()
+    supa.refresh_tokens.clear()
+    supa.reset_stats()
+    app_module.spots_cache.invalidate()
+    app_module.user_cache.invalidate()
+    # Tests may remove RPCs to exercise the fallbacks; put them back afterwards
+    monkeypatch.setattr(fake_supabase, 'RPCS', dict(fake_supabase.RPCS))
+    monkeypatch.setattr(app_module, '_reserve_rpc', True)
+    monkeypatch.setattr(app_module, '_topup_rpc', True)
+    return app_module
+
+
+@pytest.fixture
+def login(app):
+    """login(uid) -> a test client whose session belongs to uid (None: admin)."""
+    def make(uid=None):
+        client = app.app.test_client()
+        with client.session_transaction() as s:
+            if uid is None: s['admin'] = True
+            else: s['user_id'] = uid
+            s['last_active'] = time.time()
+        return client
+    return make
+
+
+@pytest.fixture
+def add_user(app, supa):
+    def add(uid='u1', wallet=0.0, **extra):
+        row = {'id': uid, 'name': 'Ama', 'points': 0, 'tier': 'Bronze', 'wallet_balance': wallet, **extra}
+        supa.store.table('users').append(row)
+        return row
+    return add
+
+
+@pytest.fixture
+def add_spots(app, supa):
+    def add(n, **extra):
+        store = supa.store
+        rows = [store.new_row('spots', {'name': f"Spot {i}", 'price': 2.0, 'available': 10,
+                                        'lat': 5.6 + i * 1e-3, 'lng': -0.18, **extra}) for i in range(n)]
+        store.table('spots').extend(rows)
+        return rows
+    return add
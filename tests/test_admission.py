@@ -0,0 +1,154 @@
+"""Per-client rate limits and the upstream admission gate."""
+import threading
+import time
+
+import pytest
+
+from admission import CRITICAL, HIGH, LOW, NORMAL, AdmissionGate, Overloaded, RateLimiter
+from cache import ReadThroughCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_the_burst_then_refills_at_the_rate():
+    clock = Clock()
+    limiter = RateLimiter({'booking': (2.0, 3)}, clock=clock)
+    assert [limiter.hit('booking', 'u1') for _ in range(3)] == [0, 0, 0]
+    assert limiter.hit('booking', 'u1') == pytest.approx(0.5)
+    assert limiter.hit('booking', 'u2') == 0  # buckets are per client
+    clock.now += 0.5
+    assert limiter.hit('booking', 'u1') == 0
+    assert limiter.stats()['rules']['booking'] == {'rate': 2.0, 'burst': 3, 'allowed': 5, 'limited': 1}
+
+
+def test_full_buckets_are_pruned_before_active_ones():
+    clock = Clock()
+    limiter = RateLimiter({'read': (1.0, 2)}, max_keys=3, clock=clock)
+    limiter.hit('read', 'idle')
+    clock.now += 10  # 'idle' has refilled: same as having no bucket
+    limiter.hit('read', 'a')
+    limiter.hit('read', 'b')
+    limiter.hit('read', 'c')
+    assert set(limiter.buckets) == {('read', 'a'), ('read', 'b'), ('read', 'c')}
+
+
+def hold(gate, n):
+    for _ in range(n):
+        gate.acquire(CRITICAL)
+
+
+def waiter(gate, priority, out, patient=False):
+    def run():
+        try:
+            gate.acquire(priority, patient)
+            out.append(priority)
+        except Overloaded:
+            out.append('shed')
+    t = threading.Thread(target=run)
+    t.start()
+    return t
+
+
+def wait_for(cond, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_any_priority_may_take_a_free_slot():
+    gate = AdmissionGate(4)
+    for priority in (LOW, LOW, NORMAL, LOW):
+        gate.acquire(priority)
+    assert gate.stats()['in_flight'] == 4 and gate.stats()['shed']['low'] == 0
+
+
+def test_freed_slots_go_to_the_highest_priority_waiting():
+    gate = AdmissionGate(1, waits=(None, 5.0, 5.0, 5.0))
+    hold(gate, 1)
+    out = []
+    threads = [waiter(gate, LOW, out)]
+    wait_for(lambda: gate.waiting[LOW])
+    threads.append(waiter(gate, HIGH, out))
+    wait_for(lambda: gate.waiting[HIGH])
+    gate.release()
+    wait_for(lambda: out)
+    assert out == [HIGH]
+    gate.release()
+    for t in threads: t.join()
+    assert out == [HIGH, LOW]
+
+
+def test_low_priority_is_shed_after_its_wait_but_patient_calls_are_not():
+    gate = AdmissionGate(1, waits=(None, 2.0, 0.5, 0.05), retry_after=1.5)
+    hold(gate, 1)
+    with pytest.raises(Overloaded) as shed:
+        gate.acquire(LOW)
+    assert shed.value.retry_after == 2 and gate.stats()['shed']['low'] == 1
+
+    out = []
+    t = waiter(gate, LOW, out, patient=True)
+    time.sleep(0.15)  # three times the LOW wait
+    assert out == []
+    gate.release()
+    t.join()
+    assert out == [LOW]
+
+
+def test_requests_become_patient_after_their_first_call(app):
+    with app.app.test_request_context():
+        app.g.priority = LOW
+        assert app.upstream_priority() == (LOW, False)
+        assert app.upstream_priority() == (LOW, True)
+    assert app.upstream_priority() == (CRITICAL, True)  # background work
+
+
+def test_over_the_rate_answers_429_with_retry_after(app, login, add_spots, monkeypatch):
+    add_spots(2)
+    monkeypatch.setattr(app, 'rate_limiter', RateLimiter({**app.RATE_RULES, 'read': (1.0, 2)}))
+    client = login('u1')
+    assert [client.get('/api/spots').status_code for _ in range(3)] == [200, 200, 429]
+    r = client.get('/api/spots')
+    assert r.status_code == 429 and r.headers['Retry-After'] == '1'
+    assert login('u2').get('/api/spots').status_code == 200
+
+
+def test_shed_calls_answer_503_with_retry_after(app, login, monkeypatch):
+    gate = AdmissionGate(1, waits=(None, 0.01, 0.01, 0.01), retry_after=3, priority=app.upstream_priority)
+    monkeypatch.setattr(app.remote.http, 'gate', gate)
+    # In turn, so the first call is the one shed; a fanned-out second call is patient
+    monkeypatch.setattr(app, '_fanout', None)
+    gate.acquire(CRITICAL)
+    try:
+        r = login().get('/api/spots')
+    finally:
+        gate.release()
+    assert r.status_code == 503 and r.headers['Retry-After'] == '3'
+
+
+def test_a_shed_load_does_not_fail_the_callers_waiting_on_it():
+    cache = ReadThroughCache('t')
+    started, go = threading.Event(), threading.Event()
+
+    def shed():
+        started.set()
+        go.wait()
+        raise Overloaded(LOW, 1)
+
+    out = []
+    leader = threading.Thread(target=lambda: out.append(pytest.raises(Overloaded, cache.get, 'k', shed)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: out.append(cache.get('k', lambda: 'spots')))
+    follower.start()
+    wait_for(lambda: cache.coalesced)
+    go.set()
+    leader.join()
+    follower.join()
+    assert 'spots' in out and cache.peek('k') == 'spots'
@@ -0,0 +1,112 @@
+"""User row cache and in-process access token checks."""
+import time
+
+import fake_supabase
+import pytest
+
+from tokens import TokenError, TokenExpired, decode_hs256, encode_hs256
+
+EMAIL, PASSWORD = 'ama@example.com', 'secret123'
+SECRET = fake_supabase.JWT_SECRET
+
+
+@pytest.fixture
+def user(app, supa, add_spots):
+    """(client, uid): a signed-up, logged-in user with GHS 1000 in the wallet."""
+    add_spots(10, available=1000)
+    client = app.app.test_client()
+    client.post('/signup', data={'email': EMAIL, 'password': PASSWORD})
+    uid = supa.users[EMAIL]['id']
+    next(u for u in supa.store.table('users') if u['id'] == uid)['wallet_balance'] = 1000.0
+    app.user_cache.invalidate()
+    client.post('/login', data={'username': EMAIL, 'password': PASSWORD})
+    with client.session_transaction() as s:
+        assert s.get('user_id') == uid
+    return client, uid
+
+
+def profile(client):
+    r = client.get('/api/user/profile')
+    assert r.status_code == 200
+    return r.get_json()
+
+
+def calls(supa, prefix=''):
+    return sum(n for k, n in supa.stats().items() if k.startswith(prefix))
+
+
+def test_profiles_are_served_from_the_cache_without_auth_calls(supa, user):
+    client, _ = user
+    profile(client)
+    supa.reset_stats()
+    for _ in range(10):
+        assert profile(client)['wallet_balance'] == 1000.0
+    assert calls(supa, 'GET users') == 0 and calls(supa, 'GET auth') == 0 and calls(supa, 'POST auth') == 0
+
+
+@pytest.mark.parametrize('rpc', [True, False], ids=['reserve_spot function', 'fallback'])
+def test_bookings_keep_the_cached_wallet_right(app, supa, user, monkeypatch, rpc):
+    if not rpc: monkeypatch.delitem(fake_supabase.RPCS, 'reserve_spot')
+    client, _ = user
+    profile(client)
+    for i in range(5):
+        r = client.post(f"/api/reserve/{1 + i}", json={'payment_method': 'wallet', 'vehicle_plate': 'GR-1'})
+        assert r.status_code == 200, r.get_data(as_text=True)
+        assert profile(client)['wallet_balance'] == 1000.0 - 2.0 * (i + 1)
+
+
+def test_top_ups_keep_the_cached_wallet_right(app, user):
+    client, _ = user
+    profile(client)
+    for i in range(3):
+        ref = f"auth-topup-{i}"
+        app.payment_verifier.record(ref, {'reference': ref, 'amount': 500, 'status': 'success'})
+        assert client.post('/api/user/topup', json={'reference': ref}).status_code == 200
+        assert profile(client)['wallet_balance'] == 1000.0 + 5.0 * (i + 1)
+
+
+def test_outside_writes_show_once_the_entry_expires(app, supa, user, monkeypatch):
+    client, uid = user
+    monkeypatch.setattr(app.user_cache, 'ttl', 0.2)
+    app.user_cache.invalidate()  # the login stored the row under the usual TTL
+    profile(client)
+    next(u for u in supa.store.table('users') if u['id'] == uid)['points'] = 42
+    time.sleep(0.25)
+    assert profile(client)['points'] == 42
+
+
+def test_expired_token_is_refreshed_with_one_auth_call(app, supa, user):
+    client, uid = user
+    expired = encode_hs256({'sub': uid, 'aud': 'authenticated', 'exp': int(time.time()) - 5}, SECRET)
+    with client.session_transaction() as s:
+        s['access_token'] = expired
+    supa.reset_stats()
+    profile(client)
+    assert supa.stats().get('POST auth/token') == 1 and calls(supa, 'POST auth') + calls(supa, 'GET auth') == 1
+    with client.session_transaction() as s:
+        assert s['access_token'] != expired
+        assert decode_hs256(s['access_token'], SECRET)['sub'] == uid
+
+
+@pytest.mark.parametrize('secret, sub', [('wrong-key', None), (SECRET, 'someone-else')],
+                         ids=['wrong key', 'other user'])
+def test_bad_tokens_end_the_session(user, secret, sub):
+    client, uid = user
+    token = encode_hs256({'sub': sub or uid, 'aud': 'authenticated', 'exp': int(time.time()) + 600}, secret)
+    with client.session_transaction() as s:
+        s['access_token'] = token
+    assert client.get('/api/user/profile').status_code == 302
+    with client.session_transaction() as s:
+        assert 'user_id' not in s
+
+
+def test_decode_hs256():
+    claims = {'sub': 'u1', 'aud': 'authenticated', 'exp': 1000}
+    token = encode_hs256(claims, 'k')
+    assert decode_hs256(token, 'k', now=999) == claims
+    assert decode_hs256(token, 'k', now=1004, leeway=5) == claims
+    with pytest.raises(TokenExpired):
+        decode_hs256(token, 'k', now=1001)
+    for bad in (token + 'x', 'not.a.token', None, encode_hs256(dict(claims, aud='anon'), 'k')):
+        with pytest.raises(TokenError):
+            decode_hs256(bad, 'k', now=999)
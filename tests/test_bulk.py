@@ -0,0 +1,140 @@
+"""Bulk spot import and streaming exports."""
+import csv
+import io
+import json
+import random
+import time
+import tracemalloc
+
+import pytest
+
+import bulk
+
+
+def spots_csv(n, rng, bad=()):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(['name', 'price', 'available', 'lat', 'lng', 'vehicle_type', 'amenities'])
+    for i in range(n):
+        lat = 'north' if i in bad else 5.6 + rng.uniform(-0.15, 0.15)
+        w.writerow([f"Import {i}", rng.choice([5, 8, 15]), rng.randint(1, 20), lat, -0.18 + rng.uniform(-0.15, 0.15),
+                    'car', 'cctv;covered'])
+    return buf.getvalue().encode()
+
+
+def import_csv(client, body):
+    r = client.post('/api/admin/spots/import?format=csv', data=body)
+    return [json.loads(line) for line in r.data.splitlines()]
+
+
+def stream(client, path):
+    # Reads a streamed response chunk by chunk, like a slow download would
+    resp = client.get(path, buffered=False)
+    size = lines = 0
+    for chunk in resp.response:
+        size += len(chunk)
+        lines += chunk.count(b'\n')
+    resp.close()
+    return resp.status_code, size, lines
+
+
+@pytest.fixture
+def admin(app, login):
+    return login()
+
+
+def test_import_lands_every_row_in_batches(app, supa, admin):
+    n = 3 * app.IMPORT_BATCH + 7
+    supa.reset_stats()
+    r = admin.post('/api/admin/spots/import', data=spots_csv(n, random.Random(3)), content_type='text/csv')
+    lines = [json.loads(line) for line in r.data.splitlines()]
+    assert lines[-1]['done'] and lines[-1]['inserted'] == n and lines[-1]['undo']
+    assert len(lines) == 4  # one progress line per full batch, then the summary
+    assert sum(supa.stats().values()) <= 4 + 1  # a write per batch, plus one spots read
+    spots = app.get_all_spots()
+    assert len(spots) == n and spots[0]['amenities'] == ['cctv', 'covered'] and spots[0]['owner_id'] == 'admin'
+
+
+def test_bad_records_are_rejected_by_line(app, admin):
+    lines = import_csv(admin, spots_csv(50, random.Random(3), bad={3, 17}))
+    assert [(e['line'], e['error']) for e in lines if 'line' in e and 'error' in e] == \
+        [(5, 'lat must be a number'), (19, 'lat must be a number')]
+    assert lines[-1]['inserted'] == 48 and lines[-1]['rejected'] == 2
+
+
+def test_dry_run_writes_nothing(app, supa, admin):
+    r = admin.post('/api/admin/spots/import?format=csv&dry_run=1', data=spots_csv(20, random.Random(3)))
+    summary = json.loads(r.data.splitlines()[-1])
+    assert summary['dry_run'] and summary['inserted'] == 0 and supa.store.table('spots') == []
+
+
+def test_reimported_export_updates_in_place_and_undoes(app, admin, add_spots):
+    add_spots(40)
+    before = {s['id']: s['price'] for s in app.get_all_spots()}
+    rows = list(csv.DictReader(io.StringIO(admin.get('/api/admin/export/spots?format=csv').data.decode())))
+    assert len(rows) == 40
+    for row in rows[::4]:
+        row['price'] = str(float(row['price']) + 1)
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=list(rows[0]))
+    w.writeheader()
+    w.writerows(rows[::4])
+    summary = import_csv(admin, buf.getvalue().encode())[-1]
+    assert summary['updated'] == 10 and summary['inserted'] == 0 and summary['undo']
+    prices = {s['id']: s['price'] for s in app.get_all_spots()}
+    assert all(prices[int(row['id'])] == before[int(row['id'])] + 1 for row in rows[::4])
+
+    assert admin.post('/api/admin/undo').status_code == 200
+    assert {s['id']: s['price'] for s in app.get_all_spots()} == before
+
+
+def test_update_records_only_touch_the_fields_they_give(app, supa, admin, add_spots):
+    spot = add_spots(1, amenities=['cctv'], qr_code_id='PW-KEEP', owner_id='owner-1')[0]
+    body = f"{json.dumps({'id': spot['id'], 'price': 9})}\n{json.dumps({'id': spot['id'], 'available': 3})}\n"
+    r = admin.post('/api/admin/spots/import?format=ndjson', data=body.encode())
+    assert json.loads(r.data.splitlines()[-1])['updated'] == 1
+    row = supa.store.table('spots')[0]
+    assert (row['price'], row['available']) == (9.0, 3)
+    assert (row['name'], row['amenities'], row['qr_code_id'], row['owner_id'], row['lat']) == \
+        (spot['name'], ['cctv'], 'PW-KEEP', 'owner-1', spot['lat'])
+
+
+def test_spot_row_fills_defaults_only_for_new_spots():
+    row, error = bulk.spot_row({'name': 'A', 'lat': '5.6', 'lng': '-0.18'})
+    assert error is None and row['owner_id'] == 'admin' and row['amenities'] == [] and row['qr_code_id']
+    assert bulk.spot_row({'name': 'A'}) == (None, 'lat is required')
+    assert bulk.spot_row({'id': '7', 'price': '4.5', 'name': '', 'lat': ''}) == ({'id': 7, 'price': 4.5}, None)
+    assert bulk.spot_row({'id': '7', 'price': 'free'}) == (None, 'price must be a number')
+
+
+def test_exports_stream_every_row(app, supa, admin):
+    store = supa.store
+    for i in range(2500):
+        store.table('transactions').append(store.new_row('transactions', {
+            'user_id': f"u{i % 50}", 'spot_id': 1 + i % 20, 'type': 'Booking', 'amount': 5.0,
+            'payment_ref': f"WALLET-{i}", 'date': time.strftime('%Y-%m-%d', time.gmtime(1.7e9 + i * 150)),
+            'timestamp': 1.7e9 + i * 150}))
+    assert stream(admin, '/api/admin/export/transactions?format=ndjson')[::2] == (200, 2500)
+    assert stream(admin, '/api/admin/export/transactions?format=csv')[::2] == (200, 2501)
+    since = time.strftime('%Y-%m-%d', time.gmtime(1.7e9 + 86400 * 3))
+    status, _, lines = stream(admin, f"/api/admin/export/transactions?since={since}")
+    assert status == 200 and lines == sum(1 for t in store.table('transactions') if t['date'] >= since)
+
+
+def test_export_memory_does_not_grow_with_the_table(app, supa, admin):
+    store = supa.store
+
+    def peak(n):
+        store.tables['transactions'] = [store.new_row('transactions', {
+            'user_id': f"u{i % 50}", 'type': 'Booking', 'amount': 5.0, 'spot_name': f"Spot {i % 20}",
+            'payment_ref': f"WALLET-{i}", 'vehicle_plate': 'GR-1234-24', 'date': '2024-01-01'})
+            for i in range(n)]
+        tracemalloc.start()
+        try:
+            assert stream(admin, '/api/admin/export/transactions?format=csv')[::2] == (200, n + 1)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    small, big = peak(2 * app.EXPORT_PAGE), peak(10 * app.EXPORT_PAGE)
+    assert big < small * 1.5
@@ -0,0 +1,28 @@
+"""Server-side session expiry."""
+import time
+
+from scheduler import ExpiryScheduler
+
+
+def test_load_merges_into_the_queue():
+    sched = ExpiryScheduler(lambda keys: None)
+    sched.schedule('retrying', 105.0)   # its row said 90, but the expiry failed
+    sched.schedule('new', 110.0)        # opened after the rows were read
+    sched.schedule('extended', 95.0)
+    sched.load([('retrying', 90.0), ('extended', 120.0), ('other', 100.0)])
+    assert sched.deadlines == {'retrying': 105.0, 'new': 110.0, 'extended': 120.0, 'other': 100.0}
+    assert sched.pop_due(200.0) == ['other', 'retrying', 'new', 'extended']
+
+
+def test_resync_keeps_sessions_scheduled_since_the_read(app, supa):
+    store = supa.store
+    store.table('sessions').append(store.new_row('sessions', {'spot_id': 1, 'expiry_time': time.time() + 60}))
+    sched = app.expiry_scheduler
+    try:
+        app.schedule_session_expiry({'id': 'spooled', 'expiry_time': time.time() + 30})
+        app.recover_session_expiry()
+        assert {'spooled', store.table('sessions')[0]['id'], app._RESYNC} <= set(sched.deadlines)
+    finally:
+        with sched.cond:
+            sched.deadlines.clear()
+            sched.heap.clear()
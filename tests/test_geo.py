@@ -0,0 +1,94 @@
+"""Spatial index, clusters and viewport rooms."""
+import random
+
+import pytest
+
+from geo import ClusterIndex, SpotIndex, grid_cell, haversine
+
+
+@pytest.mark.parametrize('query', [
+    'lat=nan&lng=-0.18', 'lat=5.6&lng=inf', 'lat=1e309&lng=0', 'lat=5.6&lng=-0.18&radius=nan', 'lat=95&lng=0',
+])
+def test_nearby_rejects_coordinates_that_are_not_finite_or_on_earth(app, login, add_spots, query):
+    add_spots(3)
+    assert login('u1').get(f"/api/spots/nearby?{query}").status_code == 400
+
+
+@pytest.mark.parametrize('query', [
+    'bbox=nan,5,0,6&zoom=10', 'bbox=-1,5,inf,6&zoom=10', 'bbox=-1,5,0,6&zoom=inf', 'bbox=-1,5,0,6&zoom=nan',
+])
+def test_clusters_reject_values_that_are_not_finite(app, login, add_spots, query):
+    add_spots(3)
+    assert login('u1').get(f"/api/spots/clusters?{query}").status_code == 400
+
+
+def test_nearby_and_clusters_still_answer_good_queries(app, login, add_spots):
+    add_spots(3)
+    client = login('u1')
+    assert len(client.get('/api/spots/nearby?lat=5.6&lng=-0.18&radius=1000').get_json()) == 3
+    assert client.get('/api/spots/clusters?bbox=-1,5,0,6&zoom=3').get_json()['clusters'][0]['count'] == 3
+
+
+@pytest.mark.parametrize('viewport', [
+    {'south': float('nan'), 'west': 0, 'north': 1, 'east': 1},
+    {'south': 0, 'west': float('-inf'), 'north': 1, 'east': 1},
+])
+def test_a_viewport_that_is_not_finite_joins_no_cell_rooms(app, login, viewport):
+    client = app.socketio.test_client(app.app, flask_test_client=login('u1'))
+    assert client.emit('subscribe_viewport', dict(viewport, spot_ids=[7]), callback=True) == {'rooms': 1}
+    client.disconnect()
+
+
+def test_indexes_skip_rows_that_are_not_finite():
+    rows = [{'id': 1, 'lat': 5.6, 'lng': -0.18, 'available': 2, 'price': 3.0},
+            {'id': 2, 'lat': float('inf'), 'lng': 0.0}, {'id': 3, 'lat': 'nan', 'lng': 0.0}]
+    index, clusters = SpotIndex(), ClusterIndex()
+    index.rebuild(rows)
+    clusters.rebuild(rows)
+    assert len(index) == len(clusters) == 1
+    index.upsert(dict(rows[0], lat=float('-inf')))
+    assert len(index) == 0
+    with pytest.raises(ValueError):
+        grid_cell(float('nan'), 0, 0.05)
+
+
+@pytest.mark.parametrize('radius', [150, 2000])
+def test_nearby_matches_a_linear_scan(radius):
+    rng = random.Random(4)
+    spots = [{'id': i, 'lat': 5.6 + rng.uniform(-0.05, 0.05), 'lng': -0.18 + rng.uniform(-0.05, 0.05)}
+             for i in range(3000)]
+    index = SpotIndex(cell_deg=0.003)
+    index.rebuild(spots)
+    for _ in range(50):
+        lat, lng = 5.6 + rng.uniform(-0.05, 0.05), -0.18 + rng.uniform(-0.05, 0.05)
+        linear = sorted((haversine(lat, lng, s['lat'], s['lng']), s['id']) for s in spots)
+        expected = [sid for d, sid in linear if d <= radius][:20]
+        assert [s['id'] for _, s in index.nearby(lat, lng, radius, 20)] == expected
+
+
+def test_within_keeps_the_spots_nearest_the_centre_past_the_limit():
+    rng = random.Random(5)
+    spots = [{'id': i, 'lat': 5.6 + rng.uniform(-0.05, 0.05), 'lng': -0.18 + rng.uniform(-0.05, 0.05)}
+             for i in range(2000)]
+    index = SpotIndex(cell_deg=0.003)
+    index.rebuild(spots)
+    south, west, north, east = 5.58, -0.21, 5.63, -0.16
+    inside = [s for s in spots if south <= s['lat'] <= north and west <= s['lng'] <= east]
+    found, truncated = index.within(south, west, north, east)
+    assert [s['id'] for s in found] == sorted(s['id'] for s in inside) and not truncated
+
+    found, truncated = index.within(south, west, north, east, limit=50)
+    by_distance = sorted(inside, key=lambda s: haversine(5.605, -0.185, s['lat'], s['lng']))
+    assert [s['id'] for s in found] == [s['id'] for s in by_distance[:50]] and truncated
+
+
+def test_spots_for_a_map_view_and_by_id(app, login, add_spots):
+    rows = add_spots(5)
+    client = login('u1')
+    r = client.get('/api/spots?bbox=-0.19,5.6005,-0.17,5.6025')
+    assert [s['id'] for s in r.get_json()] == [rows[1]['id'], rows[2]['id']]
+    assert r.headers['X-Spots-Truncated'] == 'false' and r.headers['X-Spots-Revision']
+    assert client.get('/api/spots?bbox=-0.19,5.5,-0.17,5.7&limit=1').headers['X-Spots-Truncated'] == 'true'
+    assert client.get('/api/spots?bbox=-0.19,nan,-0.17,5.7').status_code == 400
+    assert client.get(f"/api/spots/{rows[3]['id']}").get_json()['name'] == 'Spot 3'
+    assert client.get('/api/spots/999999').status_code == 404
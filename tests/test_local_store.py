@@ -0,0 +1,86 @@
+"""Local-first storage: reads from SQLite, writes queued while Supabase is down."""
+import os
+import socket
+
+import pytest
+
+from fake_supabase import FakeSupabase
+from storage import LocalStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def local_first(app, tmp_path, monkeypatch):
+    """(fake, store): the app on a local-first LocalStore in front of its own fake server."""
+    port = free_port()
+    fake = FakeSupabase(port=port, seed=True).start()
+    fake.store.table('users').append({'id': 'kiosk', 'name': 'Kiosk', 'points': 0, 'tier': 'Bronze',
+                                      'wallet_balance': 1000.0})
+    for s in fake.store.table('spots'):
+        s['available'] = 50
+    store = LocalStore(str(tmp_path / 'local.db'), remote=app.SupabaseLite(fake.url, 'test'))
+    monkeypatch.setattr(app, 'supabase', store)
+    app.spots_cache.invalidate()
+    state = {'fake': fake}
+    yield state, store
+    state['fake'].stop()
+    app.spots_cache.invalidate()
+    app.user_cache.invalidate()
+
+
+def rows(client, table):
+    return {r['id']: {k: v for k, v in r.items() if k != 'created_at'}
+            for r in client.table(table).select("*").execute().data}
+
+
+def test_reads_are_served_without_upstream_calls(app, local_first):
+    state, store = local_first
+    fake = state['fake']
+    assert store.pull()
+    fake.reset_stats()
+    remote = store.remote
+    for query in (lambda c: c.table('users').select("*").eq('id', 'user_123'),
+                  lambda c: c.table('transactions').select("*").eq('user_id', 'user_123').order('id', desc=True).limit(21),
+                  lambda c: c.table('spots').select("*").eq('id', 12)):
+        assert query(store).execute().data == query(remote).execute().data
+    assert sum(v for k, v in fake.stats().items() if k.startswith('GET')) == 3  # the remote reads only
+
+
+def test_bookings_while_offline_are_synced_later(app, local_first):
+    state, store = local_first
+    fake = state['fake']
+    store.pull()
+    fake.stop()
+
+    spots = app.get_all_spots()
+    for i in range(10):
+        with app.app.test_request_context():
+            assert app.reserve(app.get_spot_by_id(spots[i % len(spots)]['id']), 'kiosk', 'GR-1-24', 1, 'wallet')['ok']
+    assert store.pending() > 0
+    assert store.sync() == 0  # nothing lands while the server is away, and nothing is dropped
+    assert store.pending() > 0 and store.stats()['failed'] == 0
+
+    # Supabase comes back on the same address with the same data
+    back = FakeSupabase(port=int(fake.url.rsplit(':', 1)[1]))
+    back.store = fake.store
+    state['fake'] = back.start()
+    while store.pending():
+        assert store.sync() > 0
+    for table in ('spots', 'users', 'transactions', 'sessions'):
+        assert rows(store, table) == rows(store.remote, table), table
+    assert sum(1 for s in back.store.table('sessions') if s.get('user_name') == 'Kiosk') == 10
+
+
+def test_local_file_is_created_and_seeded_on_first_use(tmp_path):
+    path = tmp_path / 'parkwell.db'
+    store = LocalStore(str(path), legacy_root=ROOT)
+    assert not path.exists()
+    spots = store.table('spots').select("*").execute().data
+    assert path.exists() and spots and all('distance' not in s for s in spots)
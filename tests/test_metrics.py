@@ -0,0 +1,74 @@
+"""Request, upstream and Socket.IO metrics, and their /metrics rendering."""
+import re
+
+import pytest
+
+from metrics import Histogram, Metrics
+
+
+def test_histogram_buckets_are_cumulative_in_the_rendering():
+    m = Metrics(prefix='t')
+    for seconds in (0.0004, 0.003, 0.003, 20.0):
+        m.observe_request('spots', 'GET', 200, seconds)
+    text = m.render()
+    assert 't_requests_total{endpoint="spots",method="GET",status="200"} 4' in text
+    assert 't_request_duration_seconds_bucket{endpoint="spots",method="GET",le="0.0005"} 1' in text
+    assert 't_request_duration_seconds_bucket{endpoint="spots",method="GET",le="0.005"} 3' in text
+    assert 't_request_duration_seconds_bucket{endpoint="spots",method="GET",le="10.0"} 3' in text
+    assert 't_request_duration_seconds_bucket{endpoint="spots",method="GET",le="+Inf"} 4' in text
+    assert 't_request_duration_seconds_count{endpoint="spots",method="GET"} 4' in text
+
+
+def test_label_values_are_escaped():
+    m = Metrics(prefix='t')
+    m.observe_emit('say "hi"\\\n', 2, 5)
+    assert 't_socketio_emit_recipients_total{event="say \\"hi\\"\\\\\\n"} 5' in m.render()
+
+
+def test_a_failing_collector_does_not_break_the_scrape():
+    m = Metrics(prefix='t')
+    m.add_collector(lambda: 1 / 0)
+    m.add_collector(lambda: [('cache_hits', 'counter', 'Hits', [((('cache', 'spots'),), 7)])])
+    text = m.render()
+    assert '# collector error: division by zero' in text and 't_cache_hits{cache="spots"} 7' in text
+
+
+def test_histogram_counts_values_on_a_bucket_edge_in_that_bucket():
+    h = Histogram(buckets=(1.0, 2.0))
+    for v in (1.0, 2.0, 2.5):
+        h.observe(v)
+    assert h.counts == [1, 1, 1] and h.count == 3
+
+
+@pytest.mark.parametrize('url, target', [
+    ('http://x/rest/v1/spots?id=eq.1', 'spots'),
+    ('http://x/rest/v1/rpc/reserve_spot', 'rpc/reserve_spot'),
+    ('http://x/auth/v1/token?grant_type=password', 'auth/token'),
+    ('https://api.paystack.co/transaction/verify/ref-1', 'transaction/verify'),
+])
+def test_upstream_targets_have_bounded_names(app, url, target):
+    assert app._upstream_target(url) == target
+
+
+def test_responses_split_their_time_in_server_timing(app, login, add_spots):
+    add_spots(3)
+    admin = login()
+    admin.get('/api/admin/sessions')
+    timing = admin.get('/api/admin/sessions').headers['Server-Timing']
+    assert re.fullmatch(r'app;dur=[\d.]+, supabase;desc="1 calls";dur=[\d.]+', timing)
+    admin.get('/api/spots')  # fills the spots cache
+    assert re.fullmatch(r'app;dur=[\d.]+', admin.get('/api/spots').headers['Server-Timing'])
+
+
+def test_metrics_endpoint_needs_admin_or_the_token(app, login, monkeypatch):
+    login().get('/api/admin/sessions')
+    client = app.app.test_client()
+    assert client.get('/metrics').status_code == 401
+    monkeypatch.setattr(app, 'METRICS_TOKEN', 'scrape')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code == 401
+    r = client.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+    assert r.status_code == 200 and r.content_type.startswith('text/plain; version=0.0.4')
+
+    body = login().get('/metrics').get_data(as_text=True)
+    assert 'parkwell_requests_total{endpoint="metrics_endpoint",method="GET",status="401"}' in body
+    assert 'parkwell_upstream_requests_total{service="supabase",target="sessions",verb="GET",status="200"}' in body
@@ -0,0 +1,138 @@
+"""Undo history, spot revisions and Socket.IO events across two app processes.
+
+Both workers run benchmarks/multiworker_demo.py's worker mode on one
+SHARED_STATE_URL file, the way gunicorn workers on a host would.
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+import socketio
+
+from cache import ReadThroughCache
+from conftest import ROOT
+from shared_state import SQLiteState
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_up(url, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        assert proc.poll() is None, 'worker exited'
+        try:
+            requests.get(url + '/api/spots', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise AssertionError(f"worker at {url} did not start")
+
+
+def wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+@pytest.fixture(scope='module')
+def workers(supa, tmp_path_factory):
+    """URLs of two workers sharing one state file, against the session's FakeSupabase."""
+    env = dict(os.environ, SUPABASE_URL=supa.url, SUPABASE_KEY='test', ADMIN_USER='admin', ADMIN_PASS='pw',
+               SESSION_EXPIRY='off', RATE_LIMITS='off', STORAGE='supabase', SHARED_STATE_POLL='0',
+               SHARED_STATE_URL=f"sqlite:///{tmp_path_factory.mktemp('shared') / 'shared.db'}")
+    for name in ('WRITE_BEHIND', 'SOCKETIO_MESSAGE_QUEUE', 'METRICS', 'SUPABASE_JWT_SECRET'):
+        env.pop(name, None)
+    store = supa.store
+    with store.lock:
+        store.tables['spots'] = [store.new_row('spots', {'name': f"Spot {i}", 'price': 2.0, 'available': 10,
+                                                         'lat': 5.6 + i * 1e-3, 'lng': -0.18}) for i in range(3)]
+    ports = [free_port(), free_port()]
+    procs = [subprocess.Popen([sys.executable, os.path.join(ROOT, 'benchmarks', 'multiworker_demo.py'),
+                               '--worker', str(p)], env=env, cwd=ROOT) for p in ports]
+    try:
+        urls = [f"http://127.0.0.1:{p}" for p in ports]
+        for url, proc in zip(urls, procs):
+            wait_up(url, proc)
+        yield urls
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+
+@pytest.fixture(scope='module')
+def admin(workers):
+    http = requests.Session()
+    http.post(workers[0] + '/login', data={'username': 'admin', 'password': 'pw'}, allow_redirects=False)
+    return http
+
+
+def spot_ids(http, url):
+    return sorted(s['id'] for s in http.get(url + '/api/spots').json())
+
+
+def test_undo_and_redo_history_is_shared(workers, admin, supa):
+    before = spot_ids(admin, workers[0])
+    created = admin.post(workers[0] + '/api/spots', json={'name': 'New', 'lat': 5.6, 'lng': -0.18}).json()
+    assert spot_ids(admin, workers[1]) == sorted(before + [created['id']])
+
+    assert admin.post(workers[1] + '/api/admin/undo').json()['success']
+    assert spot_ids(admin, workers[0]) == spot_ids(admin, workers[1]) == before
+    assert admin.post(workers[0] + '/api/admin/redo').json()['success']
+    assert spot_ids(admin, workers[1]) == sorted(before + [created['id']])
+    assert sorted(s['id'] for s in supa.store.table('spots')) == spot_ids(admin, workers[0])
+
+
+def test_events_reach_clients_of_the_other_worker(workers, admin):
+    events = []
+    client = socketio.Client()
+    client.on('data_update', lambda data: events.append(data))
+    cookie = '; '.join(f"{k}={v}" for k, v in admin.cookies.items())
+    client.connect(workers[1], headers={'Cookie': cookie}, transports=['polling'])
+    try:
+        created = admin.post(workers[0] + '/api/spots', json={'name': 'Queued', 'lat': 5.6, 'lng': -0.18}).json()
+        wait_for(lambda: any(e['type'] == 'spot_added' for e in events))
+        added = next(e for e in events if e['type'] == 'spot_added')
+        assert [c['id'] for c in added['changes']] == [created['id']]
+    finally:
+        client.disconnect()
+
+
+def test_revisions_are_only_replayed_by_the_worker_that_issued_them(workers, admin):
+    rev = int(admin.get(workers[0] + '/api/spots').headers['X-Spots-Revision'])
+    spot = spot_ids(admin, workers[0])[0]
+    admin.put(workers[0] + f"/api/spots/{spot}", json={'price': 7.5})
+
+    own = admin.get(workers[0] + f"/api/spots?since={rev}").json()
+    assert [(c['id'], c['fields']) for c in own['changes']] == [(spot, {'price': 7.5})]
+    other = admin.get(workers[1] + f"/api/spots?since={rev}").json()
+    assert other['full'] and next(s for s in other['spots'] if s['id'] == spot)['price'] == 7.5
+    assert other['rev'] != rev
+
+
+def test_a_write_drops_only_that_key_in_the_other_workers(tmp_path):
+    state = SQLiteState(str(tmp_path / 'shared.db'))
+    here, there = (ReadThroughCache('users', shared=state, shared_keys=2) for _ in range(2))
+    for cache in (here, there):
+        for uid in ('u1', 'u2', 'u3'):
+            cache.get(uid, lambda uid=uid: f"{uid} v1")
+
+    here.patch('u1', lambda _: 'u1 v2')
+    assert [there.get(uid, lambda uid=uid: f"{uid} v2") for uid in ('u1', 'u2', 'u3')] == ['u1 v2', 'u2 v1', 'u3 v1']
+    assert here.get('u1', None) == 'u1 v2'
+
+    for uid in ('u1', 'u2', 'u3'):  # more writes than the key log keeps
+        here.invalidate(uid)
+    assert [there.get(uid, lambda uid=uid: f"{uid} v3") for uid in ('u1', 'u2', 'u3')] == ['u1 v3', 'u2 v3', 'u3 v3']
+    here.invalidate()
+    assert there.get('u2', lambda: 'u2 v4') == 'u2 v4'
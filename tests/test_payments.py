@@ -0,0 +1,133 @@
+"""Top-up verification and settlement against the fake Paystack and Supabase servers."""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_supabase
+import pytest
+
+
+@pytest.fixture
+def wallet(app, supa, add_user):
+    add_user('u1')
+    return lambda: next(u for u in supa.store.table('users') if u['id'] == 'u1')['wallet_balance']
+
+
+@pytest.fixture
+def slow_paystack(paystack, monkeypatch):
+    monkeypatch.setattr(paystack, 'latency', 0.5)
+    return paystack
+
+
+def topup(client, ref):
+    r = client.post('/api/user/topup', json={'reference': ref})
+    return r.status_code, r.get_json()
+
+
+def deposits(supa, ref):
+    return [t for t in supa.store.table('transactions') if t.get('payment_ref') == ref]
+
+
+def test_slow_verify_answers_pending_then_credits_once(app, slow_paystack, login, wallet):
+    slow_paystack.add_charge('slow-1', 5000)
+    client = login('u1')
+    start = time.perf_counter()
+    status, body = topup(client, 'slow-1')
+    assert status == 202 and body['pending']
+    assert time.perf_counter() - start < app.PAYSTACK_WAIT + 0.2  # not held for the Paystack round trip
+
+    time.sleep(slow_paystack.latency + 0.1)
+    assert topup(client, 'slow-1') == (200, {'success': True, 'message': 'Funded'})
+    assert topup(client, 'slow-1')[1]['message'] == 'Already credited'
+    assert wallet() == 50.0
+    assert slow_paystack.verify_calls['slow-1'] == 1
+
+
+def test_parallel_submits_credit_once(supa, slow_paystack, login, wallet):
+    slow_paystack.add_charge('burst-1', 2000)
+    client = login('u1')
+    with ThreadPoolExecutor(20) as pool:
+        results = list(pool.map(lambda _: topup(client, 'burst-1'), range(20)))
+    deadline = time.time() + 5
+    while wallet() < 20.0 and time.time() < deadline:
+        topup(client, 'burst-1')
+        time.sleep(0.1)
+    assert wallet() == 20.0
+    assert sum(1 for _, body in results if body.get('message') == 'Funded') <= 1
+    assert len(deposits(supa, 'burst-1')) == 1
+
+
+def test_signed_webhook_settles_a_pending_top_up(slow_paystack, login, wallet):
+    slow_paystack.add_charge('hook-1', 1000)
+    client = login('u1')
+    assert topup(client, 'hook-1')[0] == 202
+
+    r = client.post('/api/paystack/webhook', data=b'{"event":"charge.success","data":{"reference":"hook-1"}}',
+                    headers={'X-Paystack-Signature': 'bad', 'Content-Type': 'application/json'})
+    assert r.status_code == 401
+    calls = slow_paystack.verify_calls['hook-1']
+    body = json.dumps({'event': 'charge.success', 'data': slow_paystack.charges['hook-1']}).encode()
+    r = client.post('/api/paystack/webhook', data=body,
+                    headers={'X-Paystack-Signature': slow_paystack.sign(body), 'Content-Type': 'application/json'})
+    assert r.status_code == 200
+    assert wallet() == 10.0
+
+    # The client's retry is answered from the webhook, without another verify
+    assert topup(client, 'hook-1')[1]['message'] == 'Already credited'
+    assert slow_paystack.verify_calls['hook-1'] == calls
+
+
+def test_unknown_reference_fails(paystack, login, wallet):
+    client = login('u1')
+    deadline = time.time() + 2
+    while (result := topup(client, 'nope'))[0] == 202 and time.time() < deadline:
+        time.sleep(0.05)
+    assert result[0] == 400
+    assert wallet() == 0.0
+
+
+def test_paystack_outage_stays_pending_and_is_not_cached(app, paystack, login, wallet, monkeypatch):
+    paystack.add_charge('outage-1', 3000)
+    monkeypatch.setitem(paystack.errors, 'outage-1', 503)
+    client = login('u1')
+    for _ in range(2):
+        assert topup(client, 'outage-1')[0] == 202
+        time.sleep(0.05)
+    assert paystack.verify_calls['outage-1'] >= 2  # asked again, not answered from the cache
+
+    del paystack.errors['outage-1']
+    deadline = time.time() + 2
+    while topup(client, 'outage-1')[0] == 202 and time.time() < deadline:
+        time.sleep(0.05)
+    assert wallet() == 30.0
+
+
+@pytest.mark.parametrize('rpc', [True, False], ids=['settle_topup function', 'fallback'])
+def test_failed_credit_is_finished_by_a_retry(app, supa, add_user, monkeypatch, rpc):
+    if not rpc: monkeypatch.delitem(fake_supabase.RPCS, 'settle_topup')
+
+    # The user row is missing, so the credit fails: the claim must not count as done
+    assert app.settle_topup('u2', 'ref-retry', 12.5) == 'error'
+    assert app.settle_topup('u2', 'ref-retry', 12.5) == 'error'
+
+    add_user('u2')
+    assert app.settle_topup('u2', 'ref-retry', 12.5) == 'credited'
+    assert app.settle_topup('u2', 'ref-retry', 12.5) == 'duplicate'
+    assert supa.store.table('users')[0]['wallet_balance'] == 12.5
+    rows = deposits(supa, 'ref-retry')
+    assert len(rows) == 1 and rows[0]['credited'] is True
+    assert app._topup_rpc is rpc
+
+
+def test_pending_top_ups_are_bounded_in_number_and_age(app, monkeypatch):
+    monkeypatch.setattr(app, '_pending_topups', {})
+    monkeypatch.setattr(app, 'PENDING_TOPUP_MAX', 3)
+    for i in range(5):
+        app._hold_pending_topup(f"ref-{i}", 'u1')
+    assert list(app._pending_topups) == ['ref-2', 'ref-3', 'ref-4']
+
+    app._pending_topups['ref-2'] = ('u1', time.time() - app.PENDING_TOPUP_TTL - 1)
+    assert app._take_pending_topup('ref-2') is None and app._take_pending_topup('ref-3') == 'u1'
+    app._pending_topups['ref-4'] = ('u1', time.time() - app.PENDING_TOPUP_TTL - 1)
+    app._hold_pending_topup('ref-5', 'u2')
+    assert list(app._pending_topups) == ['ref-5']
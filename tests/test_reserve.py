@@ -0,0 +1,33 @@
+"""Concurrent bookings on one spot can't oversell it or mis-debit wallets."""
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_supabase
+import pytest
+
+PRICE = 10.0
+BAYS, USERS, ATTEMPTS = 15, 12, 60
+
+
+@pytest.mark.parametrize('rpc', [True, False], ids=['reserve_spot function', 'fallback'])
+def test_concurrent_bookings_never_oversell(app, supa, add_user, add_spots, monkeypatch, rpc):
+    if not rpc: monkeypatch.delitem(fake_supabase.RPCS, 'reserve_spot')
+    spot_id = add_spots(1, price=PRICE, available=BAYS)[0]['id']
+    for i in range(USERS):
+        add_user(f"u{i}", wallet=PRICE * 2)  # credit for two bookings each
+
+    def book(i):
+        with app.app.test_request_context():
+            spot = app.get_spot_by_id(spot_id)
+            if not spot or spot['available'] < 1: return False
+            return app.reserve(spot, f"u{i % USERS}", 'GR-1234-24', 1, 'wallet')['ok']
+
+    with ThreadPoolExecutor(16) as pool:
+        accepted = sum(pool.map(book, range(ATTEMPTS)))
+
+    store = supa.store
+    bookings = sum(1 for t in store.table('transactions') if t['type'] == 'Booking')
+    debited = sum(PRICE * 2 - float(u['wallet_balance']) for u in store.table('users'))
+    assert accepted == bookings <= BAYS
+    assert store.table('spots')[0]['available'] == BAYS - bookings
+    assert debited == pytest.approx(bookings * PRICE)
+    assert len(store.table('sessions')) == bookings
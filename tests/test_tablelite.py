@@ -0,0 +1,102 @@
+"""TableLite's query builder against the fake PostgREST server."""
+import pytest
+
+
+@pytest.fixture
+def spots(app, add_spots):
+    rows = add_spots(10)
+    for i, row in enumerate(rows):
+        row['price'] = float(i)
+    # A builder collects filters as it goes: start a fresh one per query
+    return lambda: app.remote.table('spots'), rows
+
+
+def ids(res):
+    return [r['id'] for r in res.data]
+
+
+def test_in_matches_ints_and_quoted_strings(app, spots, add_user):
+    table, rows = spots
+    res = table().select('id').in_('id', [rows[1]['id'], rows[4]['id'], 999]).order('id').execute()
+    assert ids(res) == [rows[1]['id'], rows[4]['id']]
+
+    # Commas, quotes and backslashes stay inside their value
+    for uid in ('plain', 'with,comma', 'say "hi"', 'back\\slash'):
+        add_user(uid)
+    res = app.remote.table('users').select('id').in_('id', ['with,comma', 'say "hi"', 'back\\slash']).execute()
+    assert sorted(ids(res)) == sorted(['with,comma', 'say "hi"', 'back\\slash'])
+
+
+def test_in_with_no_values_matches_nothing(spots):
+    table, _ = spots
+    assert table().select('id').in_('id', []).execute().data == []
+
+
+def test_gt_and_repeated_filters_on_one_column(spots):
+    table, rows = spots
+    assert ids(table().select('id').gt('price', 7).order('id').execute()) == [r['id'] for r in rows[8:]]
+    # gte + lt on the same column become two query params, both applied
+    res = table().select('id').gte('price', 2).lt('price', 5).order('id').execute()
+    assert ids(res) == [r['id'] for r in rows[2:5]]
+
+
+def test_after_pages_by_key(spots):
+    table, rows = spots
+    assert ids(table().select('id').order('id').after('id', rows[6]['id']).execute()) == [r['id'] for r in rows[7:]]
+    res = table().select('id').order('id', desc=True).after('id', rows[2]['id'], desc=True).execute()
+    assert ids(res) == [rows[1]['id'], rows[0]['id']]
+
+
+def test_range_is_an_inclusive_window(spots):
+    table, rows = spots
+    res = table().select('id').order('id').range(3, 5).execute()
+    assert ids(res) == [r['id'] for r in rows[3:6]]
+    assert res.count is None
+
+
+def test_count_reports_the_total_not_the_page(spots):
+    table, rows = spots
+    res = table().select('id', count='exact').gte('price', 4).order('id').range(0, 1).execute()
+    assert ids(res) == [rows[4]['id'], rows[5]['id']]
+    assert res.count == 6
+
+
+def test_single_returns_one_object(spots):
+    table, rows = spots
+    res = table().select('*').eq('id', rows[3]['id']).single().execute()
+    assert isinstance(res.data, dict) and res.data['name'] == rows[3]['name']
+
+
+@pytest.mark.parametrize('price', [None, 1000])
+def test_single_without_exactly_one_row_is_an_error(spots, price):
+    table, _ = spots
+    q = table().select('*')
+    if price is not None: q = q.eq('price', price)
+    res = q.single().execute()
+    assert res.data is None and res.status == 406
+
+
+def test_upsert_merges_on_the_key_and_inserts_the_rest(spots):
+    table, rows = spots
+    res = table().upsert([{'id': rows[0]['id'], 'price': 50.0}, {'name': 'New', 'price': 1.0}]).execute()
+    assert res.status == 201 and len(res.data) == 2
+    merged = table().select('*').eq('id', rows[0]['id']).single().execute().data
+    assert merged['price'] == 50.0 and merged['name'] == rows[0]['name']
+    assert table().select('id', count='exact').execute().count == 11
+
+
+def test_upsert_ignore_duplicates_keeps_existing_rows(spots):
+    table, rows = spots
+    res = table().upsert({'id': rows[0]['id'], 'price': 50.0}, ignore_duplicates=True).execute()
+    assert res.data == []
+    assert table().select('price').eq('id', rows[0]['id']).execute().data == [{'price': 0.0}]
+
+
+def test_upsert_on_conflict_column(app, supa, add_user):
+    add_user('u1')
+    deposit = {'user_id': 'u1', 'type': 'Deposit', 'amount': 5.0, 'payment_ref': 'ref-1'}
+    app.remote.table('transactions').insert(deposit).execute()
+    res = app.remote.table('transactions').upsert(dict(deposit, amount=7.0), on_conflict='payment_ref').execute()
+    assert res.status == 201
+    rows = [t for t in supa.store.table('transactions') if t['payment_ref'] == 'ref-1']
+    assert len(rows) == 1 and rows[0]['amount'] == 7.0
@@ -0,0 +1,68 @@
+"""Write-behind spooling of transactions and sessions."""
+import time
+import types
+
+import pytest
+
+import writebehind
+from writebehind import WriteBehindQueue
+
+
+@pytest.fixture
+def frozen(monkeypatch):
+    # Every id handed out within the same millisecond
+    clock = types.SimpleNamespace(time=lambda: 1.7e9, strftime=time.strftime, gmtime=time.gmtime,
+                                  monotonic=time.monotonic)
+    monkeypatch.setattr(writebehind, 'time', clock)
+
+
+def session(i):
+    return {'spot_id': 1, 'user_name': f"Driver {i}", 'start_time': 1.7e9, 'expiry_time': 1.7e9 + 3600}
+
+
+def test_workers_sharing_a_spool_never_reuse_an_id(app, supa, tmp_path, monkeypatch, frozen):
+    path = str(tmp_path / 'spool.db')
+    # Two workers whose pids agree modulo 1000, adding rows in the same millisecond
+    workers = []
+    for pid in (1000, 2000):
+        monkeypatch.setattr(writebehind.os, 'getpid', lambda pid=pid: pid)
+        workers.append(WriteBehindQueue(path, app._insert_rows, id_block=3))
+    rows = [workers[i % 2].add('sessions', session(i)) for i in range(20)]
+    assert len({r['id'] for r in rows}) == 20
+    assert workers[0].flush() == 0
+    assert sorted(s['id'] for s in supa.store.table('sessions')) == sorted(r['id'] for r in rows)
+
+
+def test_ids_keep_rising_in_a_worker(tmp_path):
+    queue = WriteBehindQueue(str(tmp_path / 'spool.db'), lambda table, rows: 201, id_block=4)
+    ids = [queue.next_id() for _ in range(10)]
+    assert ids == sorted(ids) and ids[0] >= int(time.time() * 1000) * 1000 - 10 ** 6
+
+
+def test_refused_rows_are_split_out_and_dead_lettered(tmp_path):
+    sent = []
+
+    def flush(table, rows):
+        if any(r['user_name'] == 'bad' for r in rows): return 400
+        sent.extend(rows)
+        return 201
+
+    queue = WriteBehindQueue(str(tmp_path / 'spool.db'), flush, batch=16, max_attempts=2)
+    for i in range(16):
+        queue.add('sessions', dict(session(i), user_name='bad' if i in (3, 11) else f"Driver {i}"))
+    with pytest.raises(RuntimeError):
+        queue.flush_once()
+    assert len(sent) == 14 and queue.pending() == 2
+    assert queue.flush_once() == 0  # refused a second time: given up on
+    assert queue.pending() == 0 and queue.stats()['dead'] == 2
+    assert queue._conn().execute("select error from spool where failed = 1").fetchall() == [('sessions: 400',)] * 2
+
+
+def test_server_errors_keep_the_whole_batch_queued(tmp_path):
+    queue = WriteBehindQueue(str(tmp_path / 'spool.db'), lambda table, rows: 503, max_attempts=1)
+    for i in range(5):
+        queue.add('sessions', session(i))
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            queue.flush_once()
+    assert queue.pending() == 5 and queue.stats()['dead'] == 0
@@ -0,0 +1,66 @@
+"""In-process checks for Supabase access tokens.
+
+Supabase Auth signs access tokens as HS256 JWTs with the project's JWT
+secret. With that secret a worker can check a token's signature and
+expiry itself, with no call to the auth server. Only HS256 is handled;
+projects on asymmetric signing keys should leave SUPABASE_JWT_SECRET
+unset, which turns local checks off.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenExpired(TokenError):
+    pass
+
+
+def _b64decode(part):
+    return base64.urlsafe_b64decode(part + '=' * (-len(part) % 4))
+
+
+def decode_hs256(token, secret, leeway=0.0, audience='authenticated', now=None):
+    """Claims of a valid, unexpired token; raises TokenExpired or another TokenError otherwise."""
+    try:
+        header_b64, payload_b64, signature_b64 = token.split('.')
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except (AttributeError, ValueError, TypeError):
+        raise TokenError('malformed token')
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise TokenError('malformed token')
+    if header.get('alg') != 'HS256':
+        raise TokenError(f"unsupported algorithm {header.get('alg')}")
+    expected = hmac.new(secret.encode(), f"{header_b64}.{payload_b64}".encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature):
+        raise TokenError('bad signature')
+    now = time.time() if now is None else now
+    exp = claims.get('exp')
+    if not isinstance(exp, (int, float)):
+        raise TokenError('token has no expiry')
+    if now > exp + leeway:
+        raise TokenExpired('token expired')
+    if audience:
+        aud = claims.get('aud')
+        if aud != audience and not (isinstance(aud, list) and audience in aud):
+            raise TokenError('wrong audience')
+    if not claims.get('sub'):
+        raise TokenError('token has no subject')
+    return claims
+
+
+def encode_hs256(claims, secret):
+    # For tests and the fake auth server; Supabase mints the real tokens
+    def b64(data):
+        return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+    head = b64(json.dumps({'alg': 'HS256', 'typ': 'JWT'}, separators=(',', ':')).encode())
+    body = b64(json.dumps(claims, separators=(',', ':')).encode())
+    signature = hmac.new(secret.encode(), f"{head}.{body}".encode(), hashlib.sha256).digest()
+    return f"{head}.{body}.{b64(signature)}"
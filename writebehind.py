@@ -0,0 +1,240 @@
+"""Write-behind queue for append-only inserts (transactions, sessions).
+
+Rows are written to a SQLite spool file and the caller returns at once. A
+background thread sends them upstream in bulk, one array insert per table
+per round. A round goes out when `batch` rows are waiting or the oldest
+has waited `delay` seconds. The spool is the source of truth:
+- rows leave it only once the upstream insert succeeded;
+- a crashed worker's rows are picked up on the next start (or by another
+  worker sharing the file);
+- close() flushes what is left on shutdown.
+A batch Supabase refuses outright (4xx) is split in halves until the bad
+rows are found, so the rest still land. A row refused `max_attempts` times
+is marked failed and kept in the spool for inspection, like LocalStore's
+outbox does.
+
+Every row gets its id here, so callers can refer to it before it lands
+(e.g. to schedule a session's expiry). Flushes upsert with
+ignore-duplicates on that id, so resending a batch whose reply was lost is
+harmless. Ids come from a sequence kept in the spool file, handed out to
+each worker in blocks of `id_block`: distinct between every worker sharing
+the file, and increasing within a worker. The sequence never drops below
+the current time in milliseconds times 1000, so ids stay clear of rows
+inserted upstream directly and keep rising if the spool file is replaced.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from shared_state import _Immediate
+
+
+class WriteBehindQueue:
+    def __init__(self, path, flush, batch=100, delay=0.05, lease=30.0, retry=1.0, id_block=1000, max_attempts=3):
+        # flush(table, rows) -> HTTP status of the insert (None when there was no response)
+        self.path = path
+        self.flush_rows = flush
+        self.batch = batch
+        self.delay = delay
+        self.lease = lease
+        self.retry = retry
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        self.cond = threading.Condition()
+        self.id_block = id_block
+        self.id_lock = threading.Lock()
+        self.next_free = self.block_end = 0   # this worker's unused ids: [next_free, block_end)
+        self.queued = 0          # rows added by this process and not yet seen flushed
+        self.first_queued = None
+        self.thread = None
+        self.stopped = False
+        self.flushes = 0
+        self.flushed = 0
+        self.failures = 0
+        self.dead = 0
+        with _Immediate(self._conn()) as db:
+            db.execute("create table if not exists spool (seq integer primary key autoincrement, tbl text not null, "
+                       "data text not null, claimed_until real not null default 0, attempts integer not null default 0, "
+                       "failed integer not null default 0, error text)")
+            # spools written before rows could be refused lack the last three columns
+            columns = {r[1] for r in db.execute("pragma table_info(spool)")}
+            for column, decl in (('attempts', 'integer not null default 0'), ('failed', 'integer not null default 0'),
+                                 ('error', 'text')):
+                if column not in columns:
+                    db.execute(f"alter table spool add column {column} {decl}")
+            db.execute("create table if not exists ids (next integer not null)")
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def next_id(self):
+        with self.id_lock:
+            if self.next_free >= self.block_end:
+                with _Immediate(self._conn()) as db:
+                    row = db.execute("select next from ids").fetchone()
+                    start = max(row[0] if row else 0, int(time.time() * 1000) * 1000)
+                    if row: db.execute("update ids set next = ?", (start + self.id_block,))
+                    else: db.execute("insert into ids (next) values (?)", (start + self.id_block,))
+                self.next_free, self.block_end = start, start + self.id_block
+            self.next_free += 1
+            return self.next_free - 1
+
+    def add(self, table, row):
+        """Spool one row for `table`; returns it with its id (and created_at) filled in."""
+        row = dict(row)
+        row['id'] = self.next_id()
+        row.setdefault('created_at', time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime()))
+        self._conn().execute("insert into spool (tbl, data) values (?, ?)", (table, json.dumps(row)))
+        with self.cond:
+            self.queued += 1
+            if self.first_queued is None:
+                self.first_queued = time.monotonic()
+            if self.queued >= self.batch or self.queued == 1:
+                self.cond.notify()
+        return row
+
+    def pending(self):
+        return self._conn().execute("select count(*) from spool where failed = 0").fetchone()[0]
+
+    def _claim(self, limit):
+        now = time.time()
+        with _Immediate(self._conn()) as db:
+            rows = db.execute("select seq, tbl, data from spool where failed = 0 and claimed_until < ? "
+                              "order by seq limit ?",
+                              (now, limit)).fetchall()
+            db.executemany("update spool set claimed_until = ? where seq = ?", [(now + self.lease, r[0]) for r in rows])
+        return rows
+
+    def flush_once(self):
+        """Send one round of spooled rows upstream; returns how many landed."""
+        claimed = self._claim(self.batch)
+        if not claimed:
+            return 0
+        groups = {}
+        for seq, table, data in claimed:
+            row = json.loads(data)
+            # PostgREST bulk inserts need every object to carry the same keys
+            groups.setdefault((table, tuple(sorted(row))), []).append((seq, row))
+        landed, failed, refused = [], [], []
+        for (table, _), items in groups.items():
+            self._send(table, items, landed, failed, refused)
+        db = self._conn()
+        with _Immediate(db):
+            db.executemany("delete from spool where seq = ?", [(s,) for s in landed])
+            # failed rows go back to the queue straight away, retried after `retry`
+            db.executemany("update spool set claimed_until = 0 where seq = ?", [(s,) for s in failed])
+            db.executemany("update spool set claimed_until = 0, attempts = attempts + 1, error = ?, "
+                           "failed = (attempts + 1 >= ?) where seq = ?",
+                           [(error, self.max_attempts, s) for s, error in refused])
+            dead = sum(db.execute("select failed from spool where seq = ?", (s,)).fetchone()[0] for s, _ in refused)
+        self.flushes += 1
+        self.flushed += len(landed)
+        self.dead += dead
+        if dead:
+            print(f"Write-behind gave up on {dead} row(s) refused upstream {self.max_attempts} times")
+        if len(failed) + len(refused) > dead:
+            self.failures += 1
+            raise RuntimeError(f"{len(failed) + len(refused) - dead} row(s) not accepted upstream")
+        return len(landed)
+
+    def _send(self, table, items, landed, failed, refused):
+        # A refused batch is halved until the refused rows are on their own
+        try:
+            status = self.flush_rows(table, [row for _, row in items])
+        except Exception as e:
+            print(f"Write-behind flush to {table} failed: {e}")
+            status = None
+        if status is not None and 200 <= status < 300:
+            landed.extend(seq for seq, _ in items)
+        elif status is None or status >= 500 or status == 429:
+            failed.extend(seq for seq, _ in items)
+        elif len(items) > 1:
+            half = len(items) // 2
+            self._send(table, items[:half], landed, failed, refused)
+            self._send(table, items[half:], landed, failed, refused)
+        else:
+            refused.append((items[0][0], f"{table}: {status}"))
+
+    def flush(self, timeout=None):
+        """Flush until the spool is empty (or `timeout` seconds pass); returns rows left."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            try:
+                if not self.flush_once() and deadline is None:
+                    break  # everything left is claimed by another worker
+            except RuntimeError:
+                if deadline is None or time.monotonic() > deadline:
+                    break
+                time.sleep(min(self.retry, max(deadline - time.monotonic(), 0)))
+            if deadline is not None and time.monotonic() > deadline:
+                break
+        return self.pending()
+
+    def start(self, spawn=None):
+        # spawn(fn) starts fn in the background; socketio.start_background_task under eventlet/gevent
+        if self.thread is None:
+            with self.cond:
+                # rows a previous run left behind go out in the first round
+                self.queued = self.pending()
+                self.first_queued = time.monotonic() if self.queued else None
+            self.thread = (spawn or self._spawn_thread)(self._run)
+        return self
+
+    @staticmethod
+    def _spawn_thread(fn):
+        t = threading.Thread(target=fn, name='write-behind', daemon=True)
+        t.start()
+        return t
+
+    def close(self, timeout=10.0):
+        """Stop the background thread and flush what is left."""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        return self.flush(timeout)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.stopped:
+                    if self.queued >= self.batch:
+                        break
+                    if self.first_queued is not None:
+                        wait = self.first_queued + self.delay - time.monotonic()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self.cond.wait(wait)
+                if self.stopped:
+                    return
+                taken = min(self.queued, self.batch)
+                self.queued -= taken
+                self.first_queued = time.monotonic() if self.queued else None
+            try:
+                self.flush_once()
+            except Exception as e:
+                print(f"Write-behind flush failed, retrying in {self.retry}s: {e}")
+                with self.cond:
+                    self.queued += taken
+                    self.first_queued = self.first_queued or time.monotonic()
+                    self.cond.wait(self.retry)
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'flushes': self.flushes,
+            'flushed': self.flushed,
+            'failures': self.failures,
+            'dead': self.dead,
+            'batch': self.batch,
+            'delay': self.delay
+        }
@@ -0,0 +1,25 @@
+"""Production entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+ASYNC_MODE picks how a worker waits on Supabase and Paystack:
+  gevent     (default) one greenlet per request. The standard library is
+             monkey-patched below, before app imports requests, so every
+             upstream call yields to other requests instead of holding a
+             thread. Needs `pip install gevent gevent-websocket`; the
+             latter serves Socket.IO's WebSocket transport.
+  threading  gunicorn's gthread worker: GUNICORN_THREADS requests per worker.
+gunicorn.conf.py picks the matching worker class. Socket.IO clients must
+keep talking to the worker they connected to: run a single worker, or
+several behind a sticky load balancer with SOCKETIO_MESSAGE_QUEUE (or
+SHARED_STATE_URL) set.
+"""
+import os
+
+os.environ.setdefault('ASYNC_MODE', 'gevent')
+
+if os.environ['ASYNC_MODE'] == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()  # no-op when gunicorn's gevent worker already did it
+
+from app import app, socketio  # noqa: E402,F401